@@ -51,6 +51,17 @@ def get_system_status():
     if os.path.exists(db_path):
         db_size_mb = os.path.getsize(db_path) / (1024 * 1024)
 
+    from ml_service import llm_service
+    from intent_classifier import intent_classifier
+    from embedding_service import embedding_service
+    from topic_index import topic_index
+    from text_search import get_search_stats
+    from retrieval import get_retrieval_stats
+    from video_recommender import get_youtube_stats
+    from video_resolver import get_video_resolver_stats
+    import http_client
+    from job_queue import get_job_stats
+
     # Mocking remaining system telemetry (CPU/RAM requires psutil which is missing)
     return jsonify({
         'ai_services': {
@@ -58,6 +69,22 @@ def get_system_status():
             'gemini': gemini_status,
             'youtube_api': 'Online' if os.getenv('YOUTUBE_API_KEY') else 'Offline'
         },
+        'llm_providers': llm_service.get_provider_status(),
+        'llm_cache': llm_service.get_cache_stats(),
+        'llm_json_output': llm_service.get_json_stats(),
+        'llm_coalescing': llm_service.get_coalescing_stats(),
+        'llm_hedging': llm_service.get_hedge_stats(),
+        'llm_rate_limits': llm_service.get_rate_limit_stats(),
+        'intent_classifier': intent_classifier.get_stats(),
+        'embeddings': embedding_service.get_stats(),
+        'topic_index': topic_index.get_stats(),
+        'text_search': get_search_stats(),
+        'retrieval': get_retrieval_stats(),
+        'youtube': get_youtube_stats(),
+        'video_resolver': get_video_resolver_stats(),
+        'http_pools': http_client.get_pool_stats(),
+        'local_inference': llm_service.get_local_inference_stats(),
+        'jobs': get_job_stats(),
         'resources': {
             'cpu_usage': 24, # Stabilized simulated telemetry
             'memory_usage': 58,
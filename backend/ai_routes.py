@@ -3,32 +3,55 @@ from flask_jwt_extended import jwt_required, get_jwt_identity
 import os
 from models import db, User, Course, Topic, ChatMessage, Quiz, Question, Note
 from ml_service import llm_service
+from streaming import sse_event, sse_response
+from json_output import extract_json
+from job_queue import submit_job, register_job, JobCancelled
+from rate_limiter import RateLimitExceeded, sync_wait_limit
+from topic_index import topic_index
 import json
 from datetime import datetime, timedelta
 
 ai_bp = Blueprint('ai', __name__)
 
-@ai_bp.route('/notes/generate', methods=['POST'])
-@jwt_required()
-def generate_notes():
-    """Generate detailed study notes and SAVE to DB"""
-    current_user_id = get_jwt_identity()
-    data = request.get_json()
-    topic_id = data.get('topic_id')
-    
-    topic = Topic.query.get_or_404(topic_id)
-    course = Course.query.get(topic.course_id)
-    
-    # Check for existing notes to prevent redundant generation
-    existing_note = Note.query.filter_by(student_id=current_user_id, topic_id=topic_id).first()
-    if existing_note:
-        return jsonify({
-            'message': 'Notes retrieved from history',
-            'note': existing_note.to_dict()
-        })
-    
-    try:
-        prompt = f"""
+NOTES_MAX_TOKENS = 2500
+
+MCQ_QUIZ_SCHEMA = {
+    'type': 'array',
+    'minItems': 1,
+    'items': {
+        'type': 'object',
+        'required': ['question_text', 'options', 'correct_answer'],
+        'properties': {
+            'question_text': {'type': 'string'},
+            'options': {'type': 'array', 'minItems': 2, 'items': {'type': 'string'}},
+            'correct_answer': {'type': 'string'},
+            'explanation': {'type': 'string'}
+        }
+    }
+}
+
+REMEDIAL_LESSON_SCHEMA = {
+    'type': 'object',
+    'required': ['title', 'description'],
+    'properties': {
+        'title': {'type': 'string'},
+        'description': {'type': 'string'},
+        'content': {'type': 'string'}
+    }
+}
+
+CHALLENGE_SCHEMA = {
+    'type': 'object',
+    'required': ['title', 'description'],
+    'properties': {
+        'title': {'type': 'string'},
+        'description': {'type': 'string'},
+        'estimated_hours': {'type': 'number'}
+    }
+}
+
+def build_notes_prompt(topic, course):
+    return f"""
         You are an expert professor creating comprehensive study materials.
 
         Topic: "{topic.title}"
@@ -69,49 +92,144 @@ def generate_notes():
             ]
         }}
         """
-        
-        response = llm_service.generate_content(prompt, max_new_tokens=2500)
-        text_resp = response.text.strip()
-        
-        # Robust JSON Extraction
-        clean_text = llm_service.clean_json_response(text_resp)
-        final_content = clean_text
-        if clean_text.startswith('{') or clean_text.startswith('['):
-            try:
-                json_obj = json.loads(clean_text)
-                final_content = json.dumps(json_obj) # Store as clean JSON String
-            except Exception as e:
-                print(f"Notes JSON parse fail: {e}")
-                # If JSON parsing fails but looks like it was meant to be JSON, wrap it
-                final_content = json.dumps({
-                    "title": f"Notes: {topic.title}",
-                    "sections": [{"heading": "Introduction & Content", "content": text_resp}]
-                })
-        else:
-            # It's plain markdown, wrap it in a structure the frontend expects
+
+def format_notes_content(text_resp, topic):
+    """Normalize raw model output into the JSON note structure the frontend expects."""
+    text_resp = text_resp.strip()
+    
+    # Robust JSON Extraction
+    clean_text = llm_service.clean_json_response(text_resp)
+    final_content = clean_text
+    if clean_text.startswith('{') or clean_text.startswith('['):
+        try:
+            # Tolerates trailing commas and notes cut off by the token limit
+            json_obj = extract_json(clean_text)
+            final_content = json.dumps(json_obj) # Store as clean JSON String
+        except Exception as e:
+            print(f"Notes JSON parse fail: {e}")
+            # If JSON parsing fails but looks like it was meant to be JSON, wrap it
             final_content = json.dumps({
                 "title": f"Notes: {topic.title}",
-                "sections": [{"heading": "Detailed Overview", "content": clean_text}]
+                "sections": [{"heading": "Introduction & Content", "content": text_resp}]
             })
+    else:
+        # It's plain markdown, wrap it in a structure the frontend expects
+        final_content = json.dumps({
+            "title": f"Notes: {topic.title}",
+            "sections": [{"heading": "Detailed Overview", "content": clean_text}]
+        })
+    return final_content
+
+def save_generated_note(current_user_id, topic, final_content):
+    new_note = Note(
+        student_id=current_user_id,
+        topic_id=topic.topic_id,
+        title=f"Notes: {topic.title}",
+        content=final_content
+    )
+    db.session.add(new_note)
+    db.session.commit()
+    return new_note
+
+@ai_bp.route('/notes/generate', methods=['POST'])
+@jwt_required()
+def generate_notes():
+    """Generate detailed study notes and SAVE to DB"""
+    data = request.get_json()
+    with sync_wait_limit():
+        body, status = generate_notes_for_student(get_jwt_identity(), data.get('topic_id'))
+    return jsonify(body), status
+
+@ai_bp.route('/notes/generate/async', methods=['POST'])
+@jwt_required()
+def generate_notes_async():
+    """Background-job variant of /notes/generate; poll /api/jobs/<job_id> for the saved note."""
+    data = request.get_json()
+    topic_id = data.get('topic_id')
+    Topic.query.get_or_404(topic_id)
+    job = submit_job(get_jwt_identity(), 'generate_notes', {'topic_id': topic_id})
+    return jsonify({'job_id': job.job_id, 'status': job.status, 'status_url': f"/api/jobs/{job.job_id}"}), 202
+
+@register_job('generate_notes')
+def _generate_notes_job(student_id, payload, progress):
+    return generate_notes_for_student(student_id, payload.get('topic_id'), progress)
+
+def generate_notes_for_student(current_user_id, topic_id, progress=None):
+    """Shared by the synchronous endpoint and the job worker. Returns (body, status_code)."""
+    progress = progress or (lambda percent, message=None: None)
+    topic = Topic.query.get(topic_id)
+    if not topic:
+        return {'error': 'Topic not found'}, 404
+    course = Course.query.get(topic.course_id)
+    
+    # Check for existing notes to prevent redundant generation
+    existing_note = Note.query.filter_by(student_id=current_user_id, topic_id=topic_id).first()
+    if existing_note:
+        return {
+            'message': 'Notes retrieved from history',
+            'note': existing_note.to_dict()
+        }, 200
+    
+    try:
+        progress(10, 'Writing notes')
+        prompt = build_notes_prompt(topic, course)
+        response = llm_service.generate_content(prompt, max_new_tokens=NOTES_MAX_TOKENS, priority='background')
+        final_content = format_notes_content(response.text, topic)
         
         # SAVE to DB
-        new_note = Note(
-            student_id=current_user_id,
-            topic_id=topic_id,
-            title=f"Notes: {topic.title}",
-            content=final_content
-        )
-        db.session.add(new_note)
-        db.session.commit()
+        progress(90, 'Saving notes')
+        new_note = save_generated_note(current_user_id, topic, final_content)
         
-        return jsonify({
+        return {
             'message': 'Notes generated and saved',
             'note': new_note.to_dict()
-        })
+        }, 200
         
+    except JobCancelled:
+        raise
+    except RateLimitExceeded as e:
+        print(f"AI Shed: {e}")
+        return {'error': 'AI providers are busy, please try again shortly'}, 503
     except Exception as e:
         print(f"AI Error: {e}")
-        return jsonify({'error': str(e)}), 500
+        return {'error': str(e)}, 500
+
+@ai_bp.route('/notes/generate/stream', methods=['POST'])
+@jwt_required()
+def generate_notes_stream():
+    """
+    Server-Sent Events variant of /notes/generate.
+    Emits `token` events while the model writes, then a `done` event carrying the saved note.
+    """
+    current_user_id = get_jwt_identity()
+    data = request.get_json()
+    topic_id = data.get('topic_id')
+    
+    topic = Topic.query.get_or_404(topic_id)
+    course = Course.query.get(topic.course_id)
+    existing_note = Note.query.filter_by(student_id=current_user_id, topic_id=topic_id).first()
+    
+    def generate():
+        if existing_note:
+            yield sse_event('done', {'message': 'Notes retrieved from history', 'note': existing_note.to_dict()})
+            return
+        
+        chunks = []
+        try:
+            prompt = build_notes_prompt(topic, course)
+            with sync_wait_limit():
+                for chunk in llm_service.generate_stream(prompt, max_new_tokens=NOTES_MAX_TOKENS, priority='background'):
+                    chunks.append(chunk)
+                    yield sse_event('token', {'text': chunk})
+            
+            final_content = format_notes_content("".join(chunks), topic)
+            new_note = save_generated_note(current_user_id, topic, final_content)
+            yield sse_event('done', {'message': 'Notes generated and saved', 'note': new_note.to_dict()})
+        except Exception as e:
+            print(f"AI Stream Error: {e}")
+            yield sse_event('error', {'error': str(e)})
+    
+    return sse_response(generate())
 
 @ai_bp.route('/notes/<int:note_id>', methods=['PUT'])
 @jwt_required()
@@ -146,6 +264,34 @@ def get_topic_notes(topic_id):
     return jsonify([note.to_dict() for note in notes])
 
 
+@ai_bp.route('/notes/search', methods=['GET'])
+@jwt_required()
+def search_notes():
+    """BM25-ranked keyword search over the current student's notes"""
+    from sqlalchemy import or_
+    from text_search import search_notes as fts_search_notes
+    current_user_id = get_jwt_identity()
+    query_text = request.args.get('q', '').strip()
+    if not query_text:
+        return jsonify({'error': 'q is required'}), 400
+    limit = min(request.args.get('limit', 20, type=int), 50)
+    
+    ranked = fts_search_notes(current_user_id, query_text, limit=limit)
+    if ranked is None:
+        # No FTS5: unranked substring match, as before
+        notes = Note.query.filter(
+            Note.student_id == current_user_id,
+            or_(Note.title.ilike(f"%{query_text}%"), Note.content.ilike(f"%{query_text}%"))
+        ).order_by(Note.updated_at.desc()).limit(limit).all()
+        return jsonify([dict(note.to_dict(), score=None, snippet=None) for note in notes])
+    
+    by_id = {n.note_id: n for n in Note.query.filter(Note.note_id.in_([r[0] for r in ranked])).all()} if ranked else {}
+    return jsonify([
+        dict(by_id[note_id].to_dict(), score=round(score, 3), snippet=snippet)
+        for note_id, score, snippet in ranked if note_id in by_id
+    ])
+
+
 @ai_bp.route('/notes/<int:note_id>/pdf', methods=['GET'])
 @jwt_required()
 def download_note_pdf(note_id):
@@ -230,10 +376,8 @@ def generate_quiz():
         ]
         """
         
-        response = llm_service.generate_content(prompt)
-        text_resp = response.text.replace('```json', '').replace('```', '').strip()
-        
-        quiz_data = json.loads(text_resp)
+        with sync_wait_limit():
+            quiz_data = llm_service.generate_json(prompt, MCQ_QUIZ_SCHEMA, temperature=0.7, priority='background')
         
         quiz = Quiz.query.filter_by(topic_id=topic_id).first()
         if not quiz:
@@ -259,6 +403,9 @@ def generate_quiz():
         
         return jsonify({'message': 'Quiz Generated', 'quiz_id': quiz.quiz_id, 'count': len(created_questions)})
         
+    except RateLimitExceeded as e:
+        print(f"Quiz Gen Shed: {e}")
+        return jsonify({'error': 'AI providers are busy, please try again shortly'}), 503
     except Exception as e:
         print(f"Quiz Gen Error: {e}")
         return jsonify({'error': str(e)}), 500
@@ -303,9 +450,8 @@ def submit_quiz(quiz_id):
                 "content": "Full markdown content with analogies..."
             }}
             """
-            response = llm_service.generate_content(prompt)
-            text_resp = response.text.replace('```json', '').replace('```', '').strip()
-            remedial_data = json.loads(text_resp)
+            with sync_wait_limit():
+                remedial_data = llm_service.generate_json(prompt, REMEDIAL_LESSON_SCHEMA, temperature=0.7)
             
             # Shift sequences
             next_topics = Topic.query.filter(Topic.course_id == topic.course_id, Topic.sequence_order > topic.sequence_order).all()
@@ -324,6 +470,7 @@ def submit_quiz(quiz_id):
             
             db.session.add(new_topic)
             db.session.commit()
+            topic_index.add_topics([new_topic])
                 
         except Exception as e:
             print(f"Dynamic Path Error: {e}")
@@ -368,10 +515,8 @@ def generate_challenge():
         }}
         """
         
-        response = llm_service.generate_content(prompt)
-        text_resp = response.text.replace('```json', '').replace('```', '').strip()
-        
-        challenge_data = json.loads(text_resp)
+        with sync_wait_limit():
+            challenge_data = llm_service.generate_json(prompt, CHALLENGE_SCHEMA, temperature=0.7)
         
         new_task = TaskModel(
             student_id=student_id,
@@ -54,6 +54,13 @@ def after_request(response):
 def health_check():
     return {"status": "ok", "message": "Backend is responsive and CORS is active"}, 200
 
+@app.route('/api/ready')
+def readiness_check():
+    # Liveness stays on /api/health; this only turns 200 once model warm-up has finished
+    from warmup import get_readiness
+    readiness = get_readiness()
+    return readiness, (200 if readiness['ready'] else 503)
+
 # Import routes
 from routes import auth_bp
 from course_routes import courses_bp
@@ -64,6 +71,7 @@ from chat_routes import chat_bp
 from workload_routes import workload_bp
 from dashboard_routes import dashboard_bp
 from admin_routes import admin_bp
+from job_routes import jobs_bp
 
 # Register blueprints
 app.register_blueprint(auth_bp, url_prefix='/api/auth')
@@ -75,11 +83,27 @@ app.register_blueprint(chat_bp, url_prefix='/api/chat')
 app.register_blueprint(workload_bp, url_prefix='/api/workload')
 app.register_blueprint(dashboard_bp, url_prefix='/api/dashboard')
 app.register_blueprint(admin_bp, url_prefix='/api/admin')
+app.register_blueprint(jobs_bp, url_prefix='/api/jobs')
 
 # Create database tables
 with app.app_context():
     db.create_all()
     print("Database tables created successfully!")
+    # FTS5 keyword indexes (topics, notes, chat history); new indexes are backfilled once
+    from text_search import ensure_fts
+    ensure_fts()
+
+# Background job workers (course creation, notes, quizzes) + re-queue of unfinished jobs
+from job_queue import start_job_workers
+start_job_workers(app)
+
+# Background lookup of missing topic videos (learning-path reads never call YouTube)
+from video_resolver import start_video_resolver
+start_video_resolver(app)
+
+# Optional model warm-up (MODEL_WARMUP=true) so the first user does not pay for model loads
+from warmup import start_warmup
+start_warmup()
 
 if __name__ == '__main__':
     port = int(os.getenv('PORT', 5000))
@@ -0,0 +1,13 @@
+from app import app
+from text_search import FTS_INDEXES, ensure_fts
+
+# Migration for the FTS5 keyword indexes: creates any missing index tables and triggers, then
+# rebuilds every index from its base table. Safe to re-run; the app itself only backfills
+# indexes it has just created, so run this after bulk edits made with triggers absent.
+
+if __name__ == "__main__":
+    with app.app_context():
+        if ensure_fts(backfill=True):
+            print(f"Rebuilt {len(FTS_INDEXES)} full-text indexes: {', '.join(FTS_INDEXES)}")
+        else:
+            print("FTS5 is not available for this database; nothing to do.")
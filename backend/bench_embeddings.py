@@ -0,0 +1,108 @@
+import time
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+
+from embedding_service import EmbeddingService, EmbeddingStore
+
+# Micro-benchmark for the MiniLM similarity path: the previous implementation (whole batch padded
+# to the longest title, mean over padding tokens) against the bucketed, mask-aware, L2-normalized
+# encoder. Reports throughput and how often both rank the same video first for a topic.
+# The cache is disabled so every run measures model time.
+
+TOPIC_QUERIES = {
+    "Binary Search Trees": [
+        "Binary Search Tree",
+        "BST insertion and deletion explained step by step with examples | Data Structures Full Course Lecture 14",
+        "Trees",
+        "Balanced vs unbalanced binary search trees: why AVL and red-black trees exist",
+        "Cooking pasta in 10 minutes",
+        "Graph traversal BFS DFS",
+    ],
+    "Photosynthesis": [
+        "Photosynthesis",
+        "Light-dependent reactions and the Calvin cycle | Biology crash course for high school and college exams",
+        "Plant cells",
+        "How do plants make food? Photosynthesis for kids",
+        "Cellular respiration explained",
+        "The French Revolution in 20 minutes",
+    ],
+    "Database Normalization": [
+        "1NF 2NF 3NF",
+        "Database normalization tutorial: functional dependencies, BCNF and decomposition with worked examples",
+        "SQL joins",
+        "What is normalization in DBMS? Full lecture",
+        "Learn guitar chords fast",
+        "Entity relationship diagrams",
+    ],
+    "Newton's Laws of Motion": [
+        "Newton's laws",
+        "Inertia, F = ma and action-reaction pairs: classical mechanics lecture 3 of the introductory physics series",
+        "Forces",
+        "Friction and free-body diagrams",
+        "Top 10 travel destinations",
+        "Kinematics equations",
+    ],
+}
+
+
+def legacy_similarity(service, target_text, candidates):
+    """Previous implementation: padded to the longest text, mean including pad positions."""
+    texts = [target_text] + candidates
+    inputs = service._tokenizer(texts, padding=True, truncation=True, return_tensors="pt",
+                                max_length=service.max_length).to(service.device)
+    with torch.no_grad():
+        out = service._model(**inputs)
+    embs = out.last_hidden_state.mean(dim=1)
+    return F.cosine_similarity(embs[0:1], embs[1:]).cpu().numpy()
+
+
+def bucketed_similarity(service, target_text, candidates):
+    rows, _ = service._encode_bucketed([target_text] + candidates)
+    embs = np.stack(rows)
+    return embs[1:] @ embs[0]
+
+
+def rank_correlation(a, b):
+    """Spearman correlation between two score vectors (no ties expected for float scores)."""
+    ra = np.argsort(np.argsort(a))
+    rb = np.argsort(np.argsort(b))
+    n = len(a)
+    return 1 - 6 * float(((ra - rb) ** 2).sum()) / (n * (n * n - 1))
+
+
+def timed(fn, service, repeats):
+    started = time.monotonic()
+    texts = 0
+    for _ in range(repeats):
+        for topic, candidates in TOPIC_QUERIES.items():
+            fn(service, topic, candidates)
+            texts += 1 + len(candidates)
+    elapsed = time.monotonic() - started
+    return texts / elapsed, elapsed * 1000 / (repeats * len(TOPIC_QUERIES))
+
+
+if __name__ == "__main__":
+    service = EmbeddingService(store=EmbeddingStore(enabled=False))
+    service.warmup()
+    repeats = 20
+
+    legacy_tps, legacy_ms = timed(legacy_similarity, service, repeats)
+    bucketed_tps, bucketed_ms = timed(bucketed_similarity, service, repeats)
+    print(f"Device: {service.device} | model: {service.model_path}")
+    print(f"Legacy (padded mean):        {legacy_tps:8.1f} texts/s | {legacy_ms:6.1f} ms per ranking")
+    print(f"Bucketed (masked mean, L2):  {bucketed_tps:8.1f} texts/s | {bucketed_ms:6.1f} ms per ranking")
+
+    same_top = 0
+    correlations = []
+    for topic, candidates in TOPIC_QUERIES.items():
+        legacy = legacy_similarity(service, topic, candidates)
+        bucketed = bucketed_similarity(service, topic, candidates)
+        same_top += int(np.argmax(legacy) == np.argmax(bucketed))
+        correlations.append(rank_correlation(legacy, bucketed))
+        print(f"\n{topic}")
+        for i in np.argsort(-bucketed):
+            print(f"  {bucketed[i]:.3f} (legacy {legacy[i]:.3f})  {candidates[i][:70]}")
+
+    print(f"\nTop-1 agreement: {same_top}/{len(TOPIC_QUERIES)} | mean Spearman: {np.mean(correlations):.3f}")
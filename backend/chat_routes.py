@@ -1,7 +1,8 @@
 from flask import Blueprint, request, jsonify
 from flask_jwt_extended import jwt_required, get_jwt_identity
 import os
-from models import Task, Enrollment, Course, User, db, ChatMessage
+from models import Task, Enrollment, Course, Topic, User, db, ChatMessage
+from streaming import sse_event, sse_response
 
 chat_bp = Blueprint('chat', __name__)
 
@@ -13,12 +14,21 @@ from ml_service import get_zero_shot_intent
 # Intent Templates
 INTENT_LABELS = ["scheduling", "course content", "analytics", "navigation", "general chat"]
 
+# Fixed persona/instructions lead the prompt so the local model can reuse their KV cache
+PROFESSOR_PROMPT_PREFIX = """You are Professor AI, an intelligent academic assistant.
+    INSTRUCTIONS: Answer the student's question helpfuly. If they asked about a course concept, use the [RELEVANT COURSE CONTENT] to inform your answer. Be concise.
+"""
+
+from ml_service import llm_service as _llm_service
+_llm_service.register_prompt_prefix(PROFESSOR_PROMPT_PREFIX)
+
 def query_rag_context(student_id, query_text):
     """
     Lightweight RAG: Search Course Topics for relevant context.
+    Hybrid BM25 + vector retrieval with reranking; plain ILIKE only if neither index is usable.
     """
-    from models import Topic, Course, Enrollment
-    from sqlalchemy import or_
+    from models import Enrollment
+    from retrieval import retrieve_topics, build_context
     
     # 1. Get Active Courses
     enrollments = Enrollment.query.filter_by(student_id=student_id, status='active').all()
@@ -26,29 +36,33 @@ def query_rag_context(student_id, query_text):
     
     if not course_ids: return ""
     
-    # 2. Keyword Search in Database (Simple & Fast)
+    # 2. Retrieve, then render token-budgeted snippets
+    ranked = retrieve_topics(query_text, course_ids, student_id=student_id)
+    if ranked is None:
+        relevant_topics = _keyword_rag_topics(course_ids, query_text)
+    else:
+        relevant_topics = [topic for topic, _ in ranked]
+    
+    return build_context(relevant_topics, query_text)
+
+def _keyword_rag_topics(course_ids, query_text):
+    """Unindexed keyword search (full scan), used only when FTS5 and embeddings are both unavailable."""
+    from models import Topic
+    from sqlalchemy import or_
+    
     # Split query into keywords (ignore stop words simplified)
     keywords = [w for w in query_text.split() if len(w) > 3]
-    if not keywords: return ""
+    if not keywords: return []
     
     filters = []
     for k in keywords:
         filters.append(Topic.title.ilike(f"%{k}%"))
         filters.append(Topic.description.ilike(f"%{k}%"))
         
-    relevant_topics = Topic.query.filter(
+    return Topic.query.filter(
         Topic.course_id.in_(course_ids),
         or_(*filters)
     ).limit(3).all()
-    
-    context_str = ""
-    if relevant_topics:
-        context_str += "\n[RELEVANT COURSE CONTENT]:\n"
-        for t in relevant_topics:
-            c_title = t.course.title if t.course else "Course"
-            context_str += f"- {c_title} > {t.title}: {t.description[:200]}...\n"
-            
-    return context_str
 
 # Helper for existing context logic
 def get_context_data(student_id):
@@ -67,15 +81,11 @@ def get_context_data(student_id):
     
     return context
 
-@chat_bp.route('/message', methods=['POST'])
-@jwt_required()
-def chat_message():
-    current_student_id = get_jwt_identity()
-    data = request.get_json()
-    user_message = data.get('message', '')
-    context_type = data.get('context_type', 'general')
-    context_id = data.get('context_id')
-    
+def prepare_chat_reply(current_student_id, user_message, context_type, context_id):
+    """
+    Detect intent and route the message.
+    Returns (intent_label, canned_reply, prompt): exactly one of canned_reply / prompt is set.
+    """
     # 1. Intent Detection (Zero-Shot DeBERTa)
     # We classify the user message into one of our core buckets.
     intent_label, confidence = get_zero_shot_intent(user_message, INTENT_LABELS)
@@ -83,73 +93,124 @@ def chat_message():
     # Threshold check
     if confidence < 0.3: intent_label = "general chat"
     
-    ai_response_text = ""
-    
     # 2. Routing Logic
     if intent_label == "scheduling":
         # Fetch Schedule Context
         from workload_routes import optimize_workload # Or just query tasks
         tasks = Task.query.filter_by(student_id=current_student_id, status='todo').limit(5).all()
         task_list = ", ".join([t.title for t in tasks])
-        ai_response_text = f"Beep Boop. I see you're asking about your schedule. You have these pending tasks: {task_list}. Check the Workload tab for the full optimized plan."
+        return intent_label, f"Beep Boop. I see you're asking about your schedule. You have these pending tasks: {task_list}. Check the Workload tab for the full optimized plan.", None
         
     elif intent_label == "analytics":
-        ai_response_text = "I can help with that. Please verify your Mastery Quotient in the Dashboard tab. It updates in real-time based on your quiz reasoning."
+        return intent_label, "I can help with that. Please verify your Mastery Quotient in the Dashboard tab. It updates in real-time based on your quiz reasoning.", None
         
     elif intent_label == "navigation":
-        ai_response_text = "Sure, I can take you there. Try clicking the sidebar icons for Dashboard, Classroom, or Workload."
+        return intent_label, "Sure, I can take you there. Try clicking the sidebar icons for Dashboard, Classroom, or Workload.", None
         
-    else:
-        # COURSE CONTENT or GENERAL CHAT -> Go to Gemini with RAG
-        
-        # Base Context
-        context_str = get_context_data(current_student_id)
-        
-        # Add RAG Context (Search knowledge base)
-        rag_context = query_rag_context(current_student_id, user_message)
-        context_str += rag_context
-        
-        # Add Specific Page Context
-        if context_type == 'course' and context_id:
-            course = Course.query.get(context_id)
-            if course:
-                context_str += f"\n[Active Page]: User is viewing Course '{course.title}'.\n"
-        elif context_type == 'topic' and context_id:
-            topic = Topic.query.get(context_id)
-            if topic:
-                 context_str += f"\n[Active Page]: User is viewing Topic '{topic.title}'.\n"
-
-        # Fetch History
-        history = ChatMessage.query.filter_by(
-            student_id=current_student_id, 
-            context_type=context_type, 
-            context_id=context_id
-        ).order_by(ChatMessage.timestamp.desc()).limit(5).all()
-        history.reverse() 
-        history_str = "\n".join([f"{msg.role.capitalize()}: {msg.content}" for msg in history])
-
-        # CALL GEMINI
-        system_prompt = f"""You are Professor AI, an intelligent academic assistant.
-        INTENT DETECTED: {intent_label.upper()}
-        CONTEXT: {context_str}
-        HISTORY: {history_str}
-        INSTRUCTIONS: Answer the student's question helpfuly. If they asked about a course concept, use the [RELEVANT COURSE CONTENT] to inform your answer. Be concise."""
+    # COURSE CONTENT or GENERAL CHAT -> Go to Gemini with RAG
+    
+    # Base Context
+    context_str = get_context_data(current_student_id)
+    
+    # Add RAG Context (Search knowledge base)
+    rag_context = query_rag_context(current_student_id, user_message)
+    context_str += rag_context
+    
+    # Add Specific Page Context
+    if context_type == 'course' and context_id:
+        course = Course.query.get(context_id)
+        if course:
+            context_str += f"\n[Active Page]: User is viewing Course '{course.title}'.\n"
+    elif context_type == 'topic' and context_id:
+        topic = Topic.query.get(context_id)
+        if topic:
+             context_str += f"\n[Active Page]: User is viewing Topic '{topic.title}'.\n"
+
+    # Fetch History
+    history = ChatMessage.query.filter_by(
+        student_id=current_student_id, 
+        context_type=context_type, 
+        context_id=context_id
+    ).order_by(ChatMessage.timestamp.desc()).limit(5).all()
+    history.reverse() 
+    history_str = "\n".join([f"{msg.role.capitalize()}: {msg.content}" for msg in history])
+
+    # CALL GEMINI
+    system_prompt = PROFESSOR_PROMPT_PREFIX + f"""    INTENT DETECTED: {intent_label.upper()}
+    CONTEXT: {context_str}
+    HISTORY: {history_str}"""
 
+    return intent_label, None, f"{system_prompt}\n\nStudent: {user_message}\nAI:"
+
+def save_chat_exchange(current_student_id, user_message, ai_response_text, context_type, context_id):
+    db.session.add(ChatMessage(student_id=current_student_id, role='user', content=user_message, context_type=context_type, context_id=context_id))
+    db.session.add(ChatMessage(student_id=current_student_id, role='assistant', content=ai_response_text, context_type=context_type, context_id=context_id))
+    db.session.commit()
+
+@chat_bp.route('/message', methods=['POST'])
+@jwt_required()
+def chat_message():
+    current_student_id = get_jwt_identity()
+    data = request.get_json()
+    user_message = data.get('message', '')
+    context_type = data.get('context_type', 'general')
+    context_id = data.get('context_id')
+    
+    intent_label, ai_response_text, prompt = prepare_chat_reply(current_student_id, user_message, context_type, context_id)
+    
+    if prompt:
         from ml_service import llm_service
         try:
-            response = llm_service.generate_content(f"{system_prompt}\n\nStudent: {user_message}\nAI:")
+            response = llm_service.generate_content(prompt, hedge=True, priority='interactive')
             ai_response_text = response.text
         except Exception as e:
             print(f"Chat AI Error: {e}")
             ai_response_text = "My reasoning engine experienced a hiccup. Please try again later."
 
     # Save Messages
-    db.session.add(ChatMessage(student_id=current_student_id, role='user', content=user_message, context_type=context_type, context_id=context_id))
-    db.session.add(ChatMessage(student_id=current_student_id, role='assistant', content=ai_response_text, context_type=context_type, context_id=context_id))
-    db.session.commit()
+    save_chat_exchange(current_student_id, user_message, ai_response_text, context_type, context_id)
 
     return jsonify({'response': ai_response_text, 'intent': intent_label})
 
+@chat_bp.route('/message/stream', methods=['POST'])
+@jwt_required()
+def chat_message_stream():
+    """
+    Server-Sent Events variant of /message.
+    Emits `token` events as text arrives, then a `done` event once the reply is saved.
+    """
+    current_student_id = get_jwt_identity()
+    data = request.get_json()
+    user_message = data.get('message', '')
+    context_type = data.get('context_type', 'general')
+    context_id = data.get('context_id')
+    
+    intent_label, canned_reply, prompt = prepare_chat_reply(current_student_id, user_message, context_type, context_id)
+    
+    def generate():
+        yield sse_event('intent', {'intent': intent_label})
+        
+        if prompt:
+            from ml_service import llm_service
+            chunks = []
+            try:
+                for chunk in llm_service.generate_stream(prompt, priority='interactive'):
+                    chunks.append(chunk)
+                    yield sse_event('token', {'text': chunk})
+                ai_response_text = "".join(chunks)
+            except Exception as e:
+                print(f"Chat AI Stream Error: {e}")
+                ai_response_text = "".join(chunks) or "My reasoning engine experienced a hiccup. Please try again later."
+                yield sse_event('error', {'message': ai_response_text})
+        else:
+            ai_response_text = canned_reply
+            yield sse_event('token', {'text': ai_response_text})
+        
+        save_chat_exchange(current_student_id, user_message, ai_response_text, context_type, context_id)
+        yield sse_event('done', {'response': ai_response_text, 'intent': intent_label})
+    
+    return sse_response(generate())
+
 @chat_bp.route('/history', methods=['GET'])
 @jwt_required()
 def get_chat_history():
@@ -164,3 +225,26 @@ def get_chat_history():
     messages = query.order_by(ChatMessage.timestamp.asc()).limit(50).all()
     
     return jsonify([msg.to_dict() for msg in messages])
+
+@chat_bp.route('/history/search', methods=['GET'])
+@jwt_required()
+def search_history():
+    """BM25-ranked keyword search over the current student's chat history"""
+    from text_search import search_chat_messages
+    current_student_id = get_jwt_identity()
+    query_text = request.args.get('q', '').strip()
+    if not query_text:
+        return jsonify({'error': 'q is required'}), 400
+    
+    ranked = search_chat_messages(current_student_id, query_text, limit=min(request.args.get('limit', 20, type=int), 50))
+    if ranked is None:
+        return jsonify({'error': 'Full-text search is unavailable'}), 503
+    
+    by_id = {m.message_id: m for m in ChatMessage.query.filter(ChatMessage.message_id.in_([r[0] for r in ranked])).all()} if ranked else {}
+    results = []
+    for message_id, score, snippet in ranked:
+        message = by_id.get(message_id)
+        if message:
+            results.append(dict(message.to_dict(), score=round(score, 3), snippet=snippet,
+                                context_type=message.context_type, context_id=message.context_id))
+    return jsonify(results)
@@ -0,0 +1,178 @@
+import os
+import time
+import threading
+from collections import deque
+
+# Per-provider circuit breaker for the LLM fallback chain.
+# A provider trips OPEN when its rolling error rate or slow-call rate crosses a threshold; while
+# OPEN it is skipped at zero cost, and a background probe decides when it is healthy again.
+CB_WINDOW_SECONDS = float(os.getenv('CB_WINDOW_SECONDS', 60))
+CB_MIN_CALLS = int(os.getenv('CB_MIN_CALLS', 5))
+CB_ERROR_RATE = float(os.getenv('CB_ERROR_RATE', 0.5))
+CB_SLOW_CALL_SECONDS = float(os.getenv('CB_SLOW_CALL_SECONDS', 15))
+CB_SLOW_CALL_RATE = float(os.getenv('CB_SLOW_CALL_RATE', 0.8))
+CB_OPEN_SECONDS = float(os.getenv('CB_OPEN_SECONDS', 30))
+CB_PROBE_INTERVAL_SECONDS = float(os.getenv('CB_PROBE_INTERVAL_SECONDS', 15))
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class CircuitBreaker:
+    def __init__(self, name, probe=None, window_seconds=CB_WINDOW_SECONDS, min_calls=CB_MIN_CALLS,
+                 error_rate=CB_ERROR_RATE, slow_call_seconds=CB_SLOW_CALL_SECONDS,
+                 slow_call_rate=CB_SLOW_CALL_RATE, open_seconds=CB_OPEN_SECONDS,
+                 probe_interval=CB_PROBE_INTERVAL_SECONDS):
+        """
+        probe: optional zero-argument callable that raises on failure. When given, recovery
+        is checked from a background thread instead of risking a live request.
+        """
+        self.name = name
+        self.probe = probe
+        self.window_seconds = window_seconds
+        self.min_calls = min_calls
+        self.error_rate = error_rate
+        self.slow_call_seconds = slow_call_seconds
+        self.slow_call_rate = slow_call_rate
+        self.open_seconds = open_seconds
+        self.probe_interval = probe_interval
+
+        self.state = CLOSED
+        self._calls = deque()  # (timestamp, ok, latency_seconds)
+        self._lock = threading.Lock()
+        self._opened_at = None
+        self._trial_in_flight = False
+        self._probe_thread = None
+        self.last_error = None
+        self.stats = {'successes': 0, 'failures': 0, 'cancelled': 0, 'short_circuited': 0, 'trips': 0,
+                      'probes': 0, 'probe_failures': 0}
+
+    def _prune(self, now):
+        cutoff = now - self.window_seconds
+        while self._calls and self._calls[0][0] < cutoff:
+            self._calls.popleft()
+
+    def allow_request(self):
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN and self.probe is None and time.time() - self._opened_at >= self.open_seconds:
+                # No background probe: let a single live request through as the trial
+                self.state = HALF_OPEN
+            if self.state == HALF_OPEN and self.probe is None and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            self.stats['short_circuited'] += 1
+            return False
+
+    def record_success(self, latency):
+        with self._lock:
+            self.stats['successes'] += 1
+            if self.state == HALF_OPEN:
+                self._close()
+            self._record(True, latency)
+
+    def record_failure(self, latency, error=None):
+        with self._lock:
+            self.stats['failures'] += 1
+            self.last_error = str(error)[:200] if error else None
+            if self.state == HALF_OPEN:
+                self._open()
+                return
+            self._record(False, latency)
+
+    def record_cancelled(self, latency):
+        """A call the caller abandoned (e.g. a lost hedge). Not a provider failure, but its elapsed
+        time still enters the window so abandoned slow calls do not drag the percentiles down."""
+        with self._lock:
+            self.stats['cancelled'] += 1
+            if self.state == HALF_OPEN:
+                self._trial_in_flight = False
+                return
+            self._record(True, latency)
+
+    def latency_percentile(self, pct, min_samples=None):
+        """Latency (seconds) at percentile pct (0-1) over successful calls in the window, or None."""
+        with self._lock:
+            self._prune(time.time())
+            latencies = sorted(latency for _, ok, latency in self._calls if ok)
+        if len(latencies) < (self.min_calls if min_samples is None else min_samples):
+            return None
+        return latencies[min(len(latencies) - 1, int(pct * len(latencies)))]
+
+    def _record(self, ok, latency):
+        # Caller holds self._lock
+        now = time.time()
+        self._calls.append((now, ok, latency))
+        self._prune(now)
+        if self.state != CLOSED or len(self._calls) < self.min_calls:
+            return
+        total = len(self._calls)
+        failures = sum(1 for _, call_ok, _ in self._calls if not call_ok)
+        slow = sum(1 for _, _, call_latency in self._calls if call_latency >= self.slow_call_seconds)
+        if failures / total >= self.error_rate or slow / total >= self.slow_call_rate:
+            self._open()
+
+    def _open(self):
+        # Caller holds self._lock
+        if self.state != OPEN:
+            self.stats['trips'] += 1
+            print(f"⚠️ Circuit Breaker: {self.name} tripped OPEN. Skipping it for {self.open_seconds:.0f}s.")
+        self.state = OPEN
+        self._opened_at = time.time()
+        self._trial_in_flight = False
+        if self.probe is not None and (self._probe_thread is None or not self._probe_thread.is_alive()):
+            self._probe_thread = threading.Thread(target=self._probe_loop, name=f'cb-probe-{self.name}', daemon=True)
+            self._probe_thread.start()
+
+    def _close(self):
+        # Caller holds self._lock
+        if self.state != CLOSED:
+            print(f"✅ Circuit Breaker: {self.name} recovered. Closing circuit.")
+        self.state = CLOSED
+        self._calls.clear()
+        self._opened_at = None
+        self._trial_in_flight = False
+
+    def _probe_loop(self):
+        time.sleep(self.open_seconds)
+        while True:
+            with self._lock:
+                if self.state == CLOSED:
+                    return
+                self.state = HALF_OPEN
+                self.stats['probes'] += 1
+            started = time.monotonic()
+            try:
+                self.probe()
+            except Exception as e:
+                with self._lock:
+                    self.stats['probe_failures'] += 1
+                    self.last_error = str(e)[:200]
+                    self.state = OPEN
+                    self._opened_at = time.time()
+                time.sleep(self.probe_interval)
+                continue
+            with self._lock:
+                self._close()
+                self._record(True, time.monotonic() - started)
+            return
+
+    def get_status(self):
+        with self._lock:
+            now = time.time()
+            self._prune(now)
+            total = len(self._calls)
+            failures = sum(1 for _, ok, _ in self._calls if not ok)
+            latencies = sorted(latency for _, _, latency in self._calls)
+            status = {
+                'state': self.state,
+                'window_calls': total,
+                'window_error_rate': round(failures / total, 3) if total else 0.0,
+                'window_p50_latency_ms': round(latencies[len(latencies) // 2] * 1000) if latencies else None,
+                'open_for_seconds': round(now - self._opened_at, 1) if self._opened_at else None,
+                'last_error': self.last_error
+            }
+            status.update(self.stats)
+        return status
@@ -2,7 +2,11 @@ from flask import Blueprint, request, jsonify
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from models import db, Course, Enrollment, Topic, User
 from datetime import datetime
-import requests
+import http_client
+from job_queue import submit_job, register_job, JobCancelled
+from rate_limiter import RateLimitExceeded, sync_wait_limit
+from topic_index import topic_index
+from video_resolver import enqueue_video_resolution
 import os
 
 courses_bp = Blueprint('courses', __name__)
@@ -10,6 +14,30 @@ courses_bp = Blueprint('courses', __name__)
 GOOGLE_API_KEY = os.getenv('GOOGLE_API_KEY')
 CSE_ID = os.getenv('GOOGLE_CSE_ID')
 
+COURSE_SEARCH_SCHEMA = {
+    'type': 'object',
+    'required': ['best_book', 'courses'],
+    'properties': {
+        'best_book': {'type': 'string'},
+        'courses': {'type': 'array', 'items': {'type': 'object', 'required': ['title']}},
+        'chatbot_insight': {'type': 'string'},
+        'related_searches': {'type': 'array', 'items': {'type': 'string'}}
+    }
+}
+
+SYLLABUS_SCHEMA = {
+    'type': 'array',
+    'minItems': 1,
+    'items': {
+        'type': 'object',
+        'required': ['title'],
+        'properties': {
+            'title': {'type': 'string'},
+            'duration_minutes': {'type': 'integer'}
+        }
+    }
+}
+
 @courses_bp.route('/search', methods=['GET'])
 @jwt_required()
 def search_courses():
@@ -61,7 +89,7 @@ def search_courses():
             'num': 3
         }
         try:
-            s_resp = requests.get(search_url, params=search_params)
+            s_resp = http_client.get(search_url, params=search_params)
             s_data = s_resp.json()
             snippets = [item.get('snippet', '') for item in s_data.get('items', [])]
             book_info = " | ".join(snippets)
@@ -98,10 +126,8 @@ def search_courses():
         }}
         """
         
-        response = llm_service.generate_content(prompt, max_new_tokens=1024)
-        text_resp = response.text.replace('```json', '').replace('```', '').strip()
-        import json
-        data_resp = json.loads(text_resp)
+        with sync_wait_limit():
+            data_resp = llm_service.generate_json(prompt, COURSE_SEARCH_SCHEMA, max_new_tokens=1024, temperature=0.7)
         
         # Inject the best book into each course result
         results = data_resp.get('courses', [])
@@ -208,8 +234,30 @@ def create_course_from_search():
         "category": "Computer Science"
     }
     """
-    current_student_id = get_jwt_identity()
+    with sync_wait_limit():
+        body, status = create_course_for_student(get_jwt_identity(), request.get_json())
+    return jsonify(body), status
+
+@courses_bp.route('/async', methods=['POST'])
+@jwt_required()
+def create_course_from_search_async():
+    """Same as POST /api/courses/ but runs as a background job; poll /api/jobs/<job_id>."""
     data = request.get_json()
+    if not data or not data.get('title'):
+        return jsonify({'error': 'title is required'}), 400
+    job = submit_job(get_jwt_identity(), 'create_course', data)
+    return jsonify({'job_id': job.job_id, 'status': job.status, 'status_url': f"/api/jobs/{job.job_id}"}), 202
+
+@register_job('create_course')
+def _create_course_job(student_id, payload, progress):
+    return create_course_for_student(student_id, payload, progress)
+
+def create_course_for_student(current_student_id, data, progress=None):
+    """
+    Course creation + enrollment shared by the synchronous endpoint and the job worker.
+    progress(percent, message) is called between the slow steps. Returns (body, status_code).
+    """
+    progress = progress or (lambda percent, message=None: None)
     print(f"DEBUG: Enrollment POST received for '{data.get('title')}' by student {current_student_id}")
     
     # Simple check if course already exists (by title)
@@ -233,6 +281,7 @@ def create_course_from_search():
         # Generate Syllabus via AI
         topics_to_add = []
         try:
+            progress(10, 'Designing syllabus')
             from ml_service import llm_service
             
             book_ctx = f"This course is based on the gold-standard textbook: {course.best_book_referenced}" if course.best_book_referenced else ""
@@ -256,14 +305,16 @@ def create_course_from_search():
                 {{"title": "Specific Academic Chapter Title", "duration_minutes": 60}}
             ]
             """
-            response = llm_service.generate_content(prompt, max_new_tokens=1500)
-            text_resp = llm_service.clean_json_response(response.text)
-            syllabus = json.loads(text_resp)
+            syllabus = llm_service.generate_json(
+                prompt, SYLLABUS_SCHEMA, max_new_tokens=1500, temperature=0.7, priority='background'
+            )
             
-            from video_recommender import get_video_for_topic
+            from video_recommender import get_videos_for_topics
             
-            for idx, item in enumerate(syllabus):
-                video = get_video_for_topic(item['title'], course.title)
+            progress(40, f'Finding videos for {len(syllabus)} topics')
+            videos = get_videos_for_topics([item['title'] for item in syllabus], course.title)
+            progress(80, 'Saving topics')
+            for idx, (item, video) in enumerate(zip(syllabus, videos)):
                 video_id = video['youtube_id'] if video else None
                 
                 t = Topic(
@@ -276,13 +327,24 @@ def create_course_from_search():
                 )
                 topics_to_add.append(t)
                 
+        except JobCancelled:
+            # A half-built course would be found by title on retry and never get its syllabus
+            db.session.delete(course)
+            db.session.commit()
+            raise
+        except RateLimitExceeded as e:
+            # Same as a cancel: the fallback syllabus would stick to this title for every later student
+            print(f"Syllabus Gen Shed: {e}")
+            db.session.delete(course)
+            db.session.commit()
+            return {'error': 'AI providers are busy, please try again shortly'}, 503
         except Exception as e:
             print(f"Syllabus Gen Error: {e}")
             # Fallback will trigger if topics_to_add is empty
                 
         if not topics_to_add:
             # Enhanced Fallback: Use Course Title to make it slightly less generic
-            from video_recommender import get_video_for_topic
+            from video_recommender import get_videos_for_topics
             
             fallback_titles = [
                 f"Fundamental Principles of {course.title}",
@@ -293,8 +355,8 @@ def create_course_from_search():
                 f"Synthesis and Peer Review of {course.title}"
             ]
             
-            for idx, title in enumerate(fallback_titles):
-                video = get_video_for_topic(title, course.title)
+            videos = get_videos_for_topics(fallback_titles, course.title)
+            for idx, (title, video) in enumerate(zip(fallback_titles, videos)):
                 video_id = video['youtube_id'] if video else None
                 
                 t = Topic(
@@ -309,8 +371,10 @@ def create_course_from_search():
             
         db.session.add_all(topics_to_add)
         db.session.commit()
+        topic_index.add_topics(topics_to_add)
         
         # Calculate Intelligent Deadlines
+        progress(90, 'Scheduling deadlines')
         try:
             from workload_routes import calculate_topic_deadlines
             assigned_dates = calculate_topic_deadlines(current_student_id, topics_to_add)
@@ -329,7 +393,7 @@ def create_course_from_search():
     # Check if already enrolled
     existing_enrollment = Enrollment.query.filter_by(student_id=current_student_id, course_id=course.course_id).first()
     if existing_enrollment:
-        return jsonify({'message': 'Already enrolled', 'course_id': course.course_id}), 200
+        return {'message': 'Already enrolled', 'course_id': course.course_id}, 200
         
     # Enroll user
     enrollment = Enrollment(
@@ -341,11 +405,11 @@ def create_course_from_search():
     db.session.add(enrollment)
     db.session.commit()
     
-    return jsonify({
+    return {
         'message': 'Enrolled successfully',
         'course': course.to_dict(),
         'enrollment': enrollment.to_dict()
-    }), 201
+    }, 201
 
 @courses_bp.route('/<int:course_id>', methods=['GET'])
 @jwt_required()
@@ -396,6 +460,7 @@ def complete_topic(topic_id):
     from models import Quiz
     topic_quiz = Quiz.query.filter_by(topic_id=topic.topic_id).first()
     
+    next_topic = None
     if not topic_quiz:
         next_topic = Topic.query.filter(
             Topic.course_id == topic.course_id, 
@@ -405,14 +470,11 @@ def complete_topic(topic_id):
         if next_topic:
             next_topic.is_unlocked = True
             
-            # Fetch video for next module if missing
-            from video_recommender import get_video_for_topic
-            if not next_topic.youtube_video_id:
-                course = Course.query.get(topic.course_id)
-                v = get_video_for_topic(next_topic.title, course.title if course else "")
-                if v: next_topic.youtube_video_id = v['youtube_id']
-                
     db.session.commit()
+    
+    # Fetch video for next module if missing (resolved in the background)
+    if next_topic and not next_topic.youtube_video_id:
+        enqueue_video_resolution([next_topic.topic_id])
     return jsonify({'message': 'Topic completed', 'new_progress': enrollment.completion_percentage})
 
 
@@ -602,17 +664,17 @@ def get_active_learning_path():
         d = deadlines[i] if i < len(deadlines) else date.today()
         t_dict['suggested_deadline'] = d.strftime('%Y-%m-%d') if isinstance(d, (date, datetime)) else str(d)
         
-        # Add video metadata if missing
-        if not t.youtube_video_id:
-            from video_recommender import get_video_for_topic
-            video = get_video_for_topic(t.title, course.title)
-            if video:
-                t.youtube_video_id = video['youtube_id']
-                db.session.commit()
-                t_dict['youtube_video_id'] = t.youtube_video_id
-                
         topics_data.append(t_dict)
     
+    # Missing videos are looked up by the background resolver; the client re-fetches while pending
+    missing = [t_dict['topic_id'] for t_dict in topics_data if not t_dict.get('youtube_video_id')]
+    pending = enqueue_video_resolution(missing) if missing else set()
+    for t_dict in topics_data:
+        if t_dict.get('youtube_video_id'):
+            t_dict['video_status'] = 'ready'
+        else:
+            t_dict['video_status'] = 'pending' if t_dict['topic_id'] in pending else 'unavailable'
+    
     return jsonify({
         'course': course.to_dict(),
         'progress': enrollment.completion_percentage,
@@ -0,0 +1,340 @@
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+
+# Shared MiniLM sentence-embedding service: one model instance per process, batched encoding,
+# and a two-tier text -> vector cache (in-process LRU over an SQLite file) so topic titles,
+# video titles and task tags are embedded once rather than on every request. Inputs are sorted
+# by token length into buckets (little padding per batch), pooled with an attention-mask-aware
+# mean and L2-normalized, so cosine similarity is a plain dot product over a NumPy matrix.
+EMBEDDING_MODEL_PATH = os.getenv('MINILM_PATH', 'sentence-transformers/all-MiniLM-L6-v2')
+EMBEDDING_MAX_LENGTH = int(os.getenv('EMBEDDING_MAX_LENGTH', 128))
+EMBEDDING_BATCH_SIZE = int(os.getenv('EMBEDDING_BATCH_SIZE', 32))
+EMBEDDING_CACHE_ENABLED = os.getenv('EMBEDDING_CACHE_ENABLED', 'true').lower() == 'true'
+EMBEDDING_CACHE_PATH = os.getenv('EMBEDDING_CACHE_PATH', 'cache/embedding_cache.db')
+EMBEDDING_CACHE_MEMORY_ENTRIES = int(os.getenv('EMBEDDING_CACHE_MEMORY_ENTRIES', 4096))
+EMBEDDING_CACHE_DISK_ENTRIES = int(os.getenv('EMBEDDING_CACHE_DISK_ENTRIES', 200000))
+# Part of every cache key: bump when pooling/normalization changes so stale vectors are never served
+EMBEDDING_VERSION = 'masked-mean-l2-v2'
+# A failed load is retried at most this often instead of on every request
+EMBEDDING_LOAD_RETRY_SECONDS = float(os.getenv('EMBEDDING_LOAD_RETRY_SECONDS', 60))
+
+
+class EmbeddingStore:
+    """text-key -> float32 vector. Memory LRU in front of an SQLite table; lookups are batched."""
+
+    def __init__(self, path=EMBEDDING_CACHE_PATH, memory_entries=EMBEDDING_CACHE_MEMORY_ENTRIES,
+                 disk_entries=EMBEDDING_CACHE_DISK_ENTRIES, enabled=EMBEDDING_CACHE_ENABLED):
+        self.path = path
+        self.memory_entries = memory_entries
+        self.disk_entries = disk_entries
+        self.enabled = enabled
+
+        self._memory = OrderedDict()  # key -> np.ndarray
+        self._lock = threading.Lock()
+        self._disk_ok = False
+        self._writes_since_prune = 0
+        self.stats = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0, 'stores': 0, 'evictions': 0}
+
+        if self.enabled:
+            self._init_disk()
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=5)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def _init_disk(self):
+        try:
+            directory = os.path.dirname(self.path)
+            if directory and not os.path.exists(directory):
+                os.makedirs(directory, exist_ok=True)
+            with self._connect() as conn:
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute("""
+                    CREATE TABLE IF NOT EXISTS embedding_cache (
+                        cache_key TEXT PRIMARY KEY,
+                        vector BLOB NOT NULL,
+                        last_access REAL NOT NULL
+                    )
+                """)
+                conn.execute("CREATE INDEX IF NOT EXISTS idx_embedding_cache_access ON embedding_cache(last_access)")
+            self._disk_ok = True
+        except Exception as e:
+            print(f"⚠️ Embedding Cache: Disk tier unavailable, using memory only. Error: {e}")
+
+    def get_many(self, keys):
+        """Return {key: vector} for the keys that are cached (memory first, then one disk query)."""
+        if not self.enabled:
+            return {}
+        found = {}
+        with self._lock:
+            for key in keys:
+                vector = self._memory.get(key)
+                if vector is not None:
+                    self._memory.move_to_end(key)
+                    found[key] = vector
+            self.stats['memory_hits'] += len(found)
+
+        missing = [key for key in dict.fromkeys(keys) if key not in found]
+        if missing and self._disk_ok:
+            try:
+                with self._connect() as conn:
+                    for start in range(0, len(missing), 500):  # SQLite parameter limit
+                        chunk = missing[start:start + 500]
+                        rows = conn.execute(
+                            f"SELECT cache_key, vector FROM embedding_cache WHERE cache_key IN ({','.join('?' * len(chunk))})",
+                            chunk
+                        ).fetchall()
+                        for key, blob in rows:
+                            found[key] = np.frombuffer(blob, dtype=np.float32)
+                        if rows:
+                            conn.executemany("UPDATE embedding_cache SET last_access = ? WHERE cache_key = ?",
+                                             [(time.time(), key) for key, _ in rows])
+                with self._lock:
+                    for key in missing:
+                        if key in found:
+                            self.stats['disk_hits'] += 1
+                            self._remember(key, found[key])
+            except Exception as e:
+                print(f"⚠️ Embedding Cache: Disk read failed: {e}")
+
+        with self._lock:
+            self.stats['misses'] += sum(1 for key in missing if key not in found)
+        return found
+
+    def set_many(self, items):
+        """Store {key: vector}."""
+        if not self.enabled or not items:
+            return
+        with self._lock:
+            for key, vector in items.items():
+                self._remember(key, vector)
+            self.stats['stores'] += len(items)
+
+        if self._disk_ok:
+            try:
+                now = time.time()
+                with self._connect() as conn:
+                    conn.executemany(
+                        "INSERT OR REPLACE INTO embedding_cache (cache_key, vector, last_access) VALUES (?, ?, ?)",
+                        [(key, np.asarray(vector, dtype=np.float32).tobytes(), now) for key, vector in items.items()]
+                    )
+                    self._writes_since_prune += len(items)
+                    if self._writes_since_prune >= 1000:
+                        self._writes_since_prune = 0
+                        self._prune_disk(conn)
+            except Exception as e:
+                print(f"⚠️ Embedding Cache: Disk write failed: {e}")
+
+    def _remember(self, key, vector):
+        # Caller holds self._lock
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+            self.stats['evictions'] += 1
+
+    def _prune_disk(self, conn):
+        count = conn.execute("SELECT COUNT(*) FROM embedding_cache").fetchone()[0]
+        overflow = count - self.disk_entries
+        if overflow > 0:
+            removed = conn.execute(
+                "DELETE FROM embedding_cache WHERE cache_key IN "
+                "(SELECT cache_key FROM embedding_cache ORDER BY last_access ASC LIMIT ?)", (overflow,)
+            ).rowcount
+            with self._lock:
+                self.stats['evictions'] += max(removed, 0)
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+        if self._disk_ok:
+            try:
+                with self._connect() as conn:
+                    conn.execute("DELETE FROM embedding_cache")
+            except Exception as e:
+                print(f"⚠️ Embedding Cache: Clear failed: {e}")
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self.stats)
+            stats['memory_entries'] = len(self._memory)
+        hits = stats['memory_hits'] + stats['disk_hits']
+        lookups = hits + stats['misses']
+        stats['hit_rate'] = round(hits / lookups, 3) if lookups else 0.0
+        stats['enabled'] = self.enabled
+        stats['disk_tier'] = self._disk_ok
+        return stats
+
+
+class EmbeddingService:
+    def __init__(self, model_path=EMBEDDING_MODEL_PATH, batch_size=EMBEDDING_BATCH_SIZE,
+                 max_length=EMBEDDING_MAX_LENGTH, store=None):
+        self.model_path = model_path
+        self.batch_size = batch_size
+        self.max_length = max_length
+        self.store = store if store is not None else EmbeddingStore()
+        self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+
+        self._tokenizer = None
+        self._model = None
+        self._load_lock = threading.Lock()
+        self._load_error = None
+        self._failed_at = 0.0
+        self._stats_lock = threading.Lock()
+        self.stats = {'requests': 0, 'texts': 0, 'encoded': 0, 'batches': 0, 'encode_ms': 0.0, 'load_seconds': None}
+
+    def _load(self):
+        """Load MiniLM once per process. Returns False (and logs why) when it cannot be loaded."""
+        if self._model is not None:
+            return True
+        with self._load_lock:
+            if self._model is not None:
+                return True
+            if self._load_error and time.monotonic() - self._failed_at < EMBEDDING_LOAD_RETRY_SECONDS:
+                return False
+            started = time.monotonic()
+            try:
+                from transformers import AutoTokenizer, AutoModel
+                tokenizer = AutoTokenizer.from_pretrained(self.model_path)
+                model = AutoModel.from_pretrained(self.model_path)
+                model.to(self.device)
+                model.eval()
+                self._tokenizer = tokenizer
+                self._model = model
+                self._load_error = None
+                self.stats['load_seconds'] = round(time.monotonic() - started, 2)
+                print(f"✅ Embeddings: Loaded {self.model_path} on {self.device}")
+                return True
+            except Exception as e:
+                self._load_error = str(e)
+                self._failed_at = time.monotonic()
+                print(f"⚠️ Embeddings: Failed to load {self.model_path}: {e}")
+                return False
+
+    def _cache_key(self, text, cache_id=None):
+        # cache_id (e.g. a video id) stands in for the text when the caller has a stable identity
+        subject = f"id:{cache_id}" if cache_id is not None else text
+        payload = f"{EMBEDDING_VERSION}\0{self.model_path}\0{self.max_length}\0{subject}"
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def _encode_batch(self, texts):
+        inputs = self._tokenizer(texts, padding=True, truncation=True, return_tensors="pt",
+                                 max_length=self.max_length).to(self.device)
+        return self._forward(inputs)
+
+    def _forward(self, inputs):
+        """Masked mean over real tokens only, then L2 normalization. Returns float32 [n, dim]."""
+        with torch.no_grad():
+            out = self._model(**inputs)
+        mask = inputs['attention_mask'].unsqueeze(-1).to(out.last_hidden_state.dtype)
+        summed = (out.last_hidden_state * mask).sum(dim=1)
+        pooled = summed / mask.sum(dim=1).clamp(min=1e-9)
+        return F.normalize(pooled.float(), dim=-1).cpu().numpy()
+
+    def _encode_bucketed(self, texts):
+        """
+        Tokenize once without padding, sort by length and pad each batch only to its own longest
+        input, so short titles are not padded to the length of the longest one in the request.
+        """
+        encoded = self._tokenizer(list(texts), truncation=True, max_length=self.max_length)
+        input_ids = encoded['input_ids']
+        order = sorted(range(len(texts)), key=lambda i: len(input_ids[i]))
+        rows = [None] * len(texts)
+        batches = 0
+        for start in range(0, len(order), self.batch_size):
+            batch = order[start:start + self.batch_size]
+            features = [{key: encoded[key][i] for key in encoded.keys()} for i in batch]
+            inputs = self._tokenizer.pad(features, padding=True, return_tensors="pt").to(self.device)
+            for i, row in zip(batch, self._forward(inputs)):
+                rows[i] = row
+            batches += 1
+        return rows, batches
+
+    def encode(self, texts, cache_ids=None):
+        """
+        L2-normalized sentence embeddings as a float32 NumPy matrix [len(texts), dim], or None if
+        the model is unavailable. Cached vectors are reused; only unseen texts go through the model.
+        cache_ids optionally gives a stable id per text (None entries fall back to the text itself).
+        """
+        texts = list(texts)
+        with self._stats_lock:
+            self.stats['requests'] += 1
+            self.stats['texts'] += len(texts)
+        if not texts:
+            return None
+
+        cache_ids = list(cache_ids) if cache_ids is not None else [None] * len(texts)
+        keys = [self._cache_key(text, cache_id) for text, cache_id in zip(texts, cache_ids)]
+        vectors = self.store.get_many(keys)
+        pending = {}  # key -> text, deduplicated
+        for key, text in zip(keys, texts):
+            if key not in vectors:
+                pending.setdefault(key, text)
+
+        if pending:
+            if not self._load():
+                return None
+            started = time.monotonic()
+            pending_keys = list(pending)
+            rows, batches = self._encode_bucketed([pending[key] for key in pending_keys])
+            computed = dict(zip(pending_keys, rows))
+            with self._stats_lock:
+                self.stats['encoded'] += len(pending_keys)
+                self.stats['batches'] += batches
+                self.stats['encode_ms'] += (time.monotonic() - started) * 1000
+            self.store.set_many(computed)
+            vectors.update(computed)
+
+        return np.stack([vectors[key] for key in keys])
+
+    def similarity_matrix(self, queries, candidates):
+        """Cosine similarities [len(queries), len(candidates)] in one matrix multiply, or None."""
+        embs = self.encode(list(queries) + list(candidates))
+        if embs is None:
+            return None
+        return embs[:len(queries)] @ embs[len(queries):].T
+
+    def similarity(self, target_text, candidates):
+        """Cosine similarity of target_text to each candidate; zeros when the model is unavailable."""
+        if not candidates:
+            return []
+        sims = self.similarity_matrix([target_text], candidates)
+        if sims is None:
+            return [0] * len(candidates)
+        return sims[0].tolist()
+
+    def warmup(self):
+        """Load the model and run one forward pass so the first real request is not the slow one."""
+        if not self._load():
+            raise RuntimeError(f"MiniLM embedder failed to load: {self._load_error}")
+        self._encode_batch(["warm-up"])
+
+    def get_stats(self):
+        with self._stats_lock:
+            stats = dict(self.stats)
+        stats['encode_ms'] = round(stats['encode_ms'], 1)
+        stats['model'] = self.model_path
+        stats['loaded'] = self._model is not None
+        stats['device'] = str(self.device)
+        stats['version'] = EMBEDDING_VERSION
+        if self._load_error:
+            stats['load_error'] = self._load_error[:200]
+        stats['cache'] = self.store.get_stats()
+        return stats
+
+
+embedding_service = EmbeddingService()
@@ -0,0 +1,92 @@
+import os
+import time
+
+# Set before ml_service pulls in protobuf (same as app.py)
+os.environ['PROTOCOL_BUFFERS_PYTHON_IMPLEMENTATION'] = 'python'
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from chat_routes import INTENT_LABELS
+from intent_classifier import intent_classifier
+from ml_service import get_llm_intent
+
+# Held-out phrasings (none of these are classifier exemplars)
+LABELLED_MESSAGES = [
+    ("Do I have anything due on Friday?", "scheduling"),
+    ("Can you fit two hours of revision into my evening?", "scheduling"),
+    ("Move my project task to next week", "scheduling"),
+    ("What should I work on first today?", "scheduling"),
+    ("Explain the CAP theorem", "course content"),
+    ("How does a hash table handle collisions?", "course content"),
+    ("What is gradient descent in simple terms?", "course content"),
+    ("Can you walk me through Dijkstra's algorithm?", "course content"),
+    ("What does ACID mean for transactions?", "course content"),
+    ("What's my average score so far?", "analytics"),
+    ("Am I improving compared to last week?", "analytics"),
+    ("Which course have I completed the most of?", "analytics"),
+    ("Show my quiz performance", "analytics"),
+    ("How do I get to my notes?", "navigation"),
+    ("Where is the classroom tab?", "navigation"),
+    ("Open the analytics page", "navigation"),
+    ("Where do I add a new task?", "navigation"),
+    ("Hi!", "general chat"),
+    ("You're awesome, thank you", "general chat"),
+    ("What's your name?", "general chat"),
+    ("Have a nice day", "general chat"),
+]
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(round(pct * (len(ordered) - 1))))]
+
+
+def evaluate(name, classify):
+    correct = 0
+    latencies = []
+    mistakes = []
+    for text, expected in LABELLED_MESSAGES:
+        started = time.monotonic()
+        try:
+            label, confidence = classify(text)
+        except Exception as e:
+            label, confidence = f"error: {e}", 0.0
+        latencies.append((time.monotonic() - started) * 1000)
+        if label == expected:
+            correct += 1
+        else:
+            mistakes.append((text, expected, label, confidence))
+
+    print(f"\n--- {name} ---")
+    print(f"Accuracy: {correct}/{len(LABELLED_MESSAGES)} ({correct / len(LABELLED_MESSAGES):.0%})")
+    print(f"Latency: mean {sum(latencies) / len(latencies):.1f} ms | p95 {percentile(latencies, 0.95):.1f} ms")
+    for text, expected, label, confidence in mistakes:
+        print(f"  MISS: '{text}' expected={expected} got={label} ({confidence})")
+
+
+def classify_embedding(text):
+    return intent_classifier.classify(text, INTENT_LABELS)
+
+
+def classify_hybrid(text):
+    label, confidence = intent_classifier.classify(text, INTENT_LABELS)
+    if confidence >= intent_classifier.threshold:
+        return label, confidence
+    return get_llm_intent(text, INTENT_LABELS, use_cache=False)
+
+
+def classify_llm(text):
+    return get_llm_intent(text, INTENT_LABELS, use_cache=False)
+
+
+if __name__ == "__main__":
+    # Build centroids once so the embedding latency below is per-message cost only
+    intent_classifier.classify("warm-up", INTENT_LABELS)
+
+    evaluate("Embedding classifier (nearest centroid)", classify_embedding)
+    evaluate(f"Hybrid (LLM below confidence {intent_classifier.threshold})", classify_hybrid)
+    evaluate("LLM zero-shot (previous behaviour, cache bypassed)", classify_llm)
@@ -0,0 +1,133 @@
+import os
+import threading
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# Shared outbound HTTP layer for OpenRouter, YouTube and Google CSE calls.
+# One Session per process keeps TCP/TLS connections alive between requests.
+HTTP_POOL_CONNECTIONS = int(os.getenv('HTTP_POOL_CONNECTIONS', 10))  # distinct hosts kept pooled
+HTTP_POOL_MAXSIZE = int(os.getenv('HTTP_POOL_MAXSIZE', 16))  # keep-alive sockets per host
+HTTP_POOL_BLOCK = os.getenv('HTTP_POOL_BLOCK', 'false').lower() == 'true'
+HTTP_CONNECT_TIMEOUT = float(os.getenv('HTTP_CONNECT_TIMEOUT', 5))
+HTTP_READ_TIMEOUT = float(os.getenv('HTTP_READ_TIMEOUT', 30))
+
+_session = None
+_session_lock = threading.Lock()
+_stats_lock = threading.Lock()
+_host_stats = {}
+
+
+def get_session():
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(
+                    pool_connections=HTTP_POOL_CONNECTIONS,
+                    pool_maxsize=HTTP_POOL_MAXSIZE,
+                    pool_block=HTTP_POOL_BLOCK
+                )
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                _session = session
+    return _session
+
+
+def _host_entry(host):
+    # Caller holds _stats_lock
+    entry = _host_stats.get(host)
+    if entry is None:
+        entry = {'requests': 0, 'errors': 0, 'in_flight': 0, 'peak_in_flight': 0, 'saturated': 0}
+        _host_stats[host] = entry
+    return entry
+
+
+def request(method, url, timeout=None, **kwargs):
+    """Issue a request through the pooled session.
+
+    timeout may be a single number (read timeout) or a (connect, read) tuple. With
+    stream=True the caller must close the response (or use it as a context manager).
+    """
+    if timeout is None:
+        timeout = (HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT)
+    elif not isinstance(timeout, tuple):
+        timeout = (HTTP_CONNECT_TIMEOUT, timeout)
+
+    host = urlparse(url).netloc
+    with _stats_lock:
+        entry = _host_entry(host)
+        entry['requests'] += 1
+        entry['in_flight'] += 1
+        entry['peak_in_flight'] = max(entry['peak_in_flight'], entry['in_flight'])
+        # More concurrent requests than pooled sockets means someone opens a throwaway
+        # connection (or blocks, with HTTP_POOL_BLOCK) instead of reusing one
+        if entry['in_flight'] > HTTP_POOL_MAXSIZE:
+            entry['saturated'] += 1
+
+    try:
+        response = get_session().request(method, url, timeout=timeout, **kwargs)
+    except requests.exceptions.RequestException:
+        with _stats_lock:
+            entry = _host_entry(host)
+            entry['errors'] += 1
+            entry['in_flight'] -= 1
+        raise
+    except BaseException:
+        _release(host)
+        raise
+
+    if kwargs.get('stream'):
+        # A streamed body keeps its pooled socket checked out until it is consumed, so the
+        # request stays in flight until the caller closes the response
+        _release_on_close(response, host)
+    else:
+        _release(host)
+    return response
+
+
+def _release(host):
+    with _stats_lock:
+        _host_entry(host)['in_flight'] -= 1
+
+
+def _release_on_close(response, host):
+    close = response.close
+    released = False
+
+    def close_and_release():
+        nonlocal released
+        try:
+            close()
+        finally:
+            with _stats_lock:
+                if not released:
+                    released = True
+                    _host_entry(host)['in_flight'] -= 1
+
+    response.close = close_and_release
+
+
+def get(url, **kwargs):
+    return request('GET', url, **kwargs)
+
+
+def post(url, **kwargs):
+    return request('POST', url, **kwargs)
+
+
+def get_pool_stats():
+    """Per-host usage against the configured pool size, for sizing pools vs. worker count."""
+    with _stats_lock:
+        hosts = {host: dict(entry) for host, entry in _host_stats.items()}
+    for entry in hosts.values():
+        entry['saturation_rate'] = round(entry['saturated'] / entry['requests'], 3) if entry['requests'] else 0.0
+    return {
+        'pool_connections': HTTP_POOL_CONNECTIONS,
+        'pool_maxsize': HTTP_POOL_MAXSIZE,
+        'pool_block': HTTP_POOL_BLOCK,
+        'timeouts': {'connect': HTTP_CONNECT_TIMEOUT, 'read': HTTP_READ_TIMEOUT},
+        'hosts': hosts
+    }
@@ -0,0 +1,118 @@
+import os
+import time
+import threading
+
+import torch
+import torch.nn.functional as F
+
+# Local intent classifier for chat routing: nearest-centroid over MiniLM embeddings of a few
+# exemplar phrases per label. Replaces a full LLM generation per chat message; the LLM is only
+# consulted when the classifier's confidence is below INTENT_CONFIDENCE_THRESHOLD.
+INTENT_CONFIDENCE_THRESHOLD = float(os.getenv('INTENT_CONFIDENCE_THRESHOLD', 0.45))
+# Cosine similarities sit in a narrow band, so they are sharpened before the softmax
+INTENT_SOFTMAX_TEMPERATURE = float(os.getenv('INTENT_SOFTMAX_TEMPERATURE', 0.05))
+
+INTENT_EXEMPLARS = {
+    "scheduling": [
+        "What is on my schedule this week?",
+        "When is my next deadline?",
+        "Help me plan my study time for tomorrow",
+        "Which tasks are due soon?",
+        "Can you reschedule my pending tasks?",
+        "How many hours should I study today?",
+    ],
+    "course content": [
+        "Can you explain how backpropagation works?",
+        "What is the difference between a process and a thread?",
+        "I don't understand recursion, explain it simply",
+        "Give me an example of normalization in databases",
+        "Why does quicksort have n log n average complexity?",
+        "Summarize the key ideas of this topic",
+    ],
+    "analytics": [
+        "How am I doing in my courses?",
+        "Show me my progress and scores",
+        "What is my mastery level?",
+        "Which subject am I weakest in?",
+        "How did I perform on my last quiz?",
+        "What is my completion rate?",
+    ],
+    "navigation": [
+        "Where can I find my courses?",
+        "How do I open the workload page?",
+        "Take me to the dashboard",
+        "Where is the quiz section?",
+        "How do I enroll in a new course?",
+        "Which tab shows my learning path?",
+    ],
+    "general chat": [
+        "Hello there!",
+        "How are you today?",
+        "Thanks for the help",
+        "Tell me a joke",
+        "Who are you?",
+        "Good morning professor",
+    ],
+}
+
+
+class IntentClassifier:
+    def __init__(self, exemplars=INTENT_EXEMPLARS, threshold=INTENT_CONFIDENCE_THRESHOLD,
+                 temperature=INTENT_SOFTMAX_TEMPERATURE):
+        self.exemplars = exemplars
+        self.threshold = threshold
+        self.temperature = temperature
+        self._centroids = {}  # tuple(labels) -> normalized [n_labels, dim] tensor
+        self._lock = threading.Lock()
+        self.stats = {'classified': 0, 'confident': 0, 'llm_fallbacks': 0, 'errors': 0, 'total_ms': 0.0}
+
+    def _embed(self, texts):
+        from embedding_service import embedding_service
+        embeddings = embedding_service.encode(texts)
+        if embeddings is None:
+            raise RuntimeError("MiniLM embedder unavailable")
+        return torch.from_numpy(embeddings)
+
+    def _get_centroids(self, labels):
+        key = tuple(labels)
+        centroids = self._centroids.get(key)
+        if centroids is None:
+            with self._lock:
+                centroids = self._centroids.get(key)
+                if centroids is None:
+                    rows = []
+                    for label in labels:
+                        # The label text itself always counts as one exemplar
+                        phrases = [label] + list(self.exemplars.get(label, []))
+                        rows.append(self._embed(phrases).mean(dim=0))
+                    centroids = F.normalize(torch.stack(rows), dim=-1)
+                    self._centroids[key] = centroids
+        return centroids
+
+    def classify(self, text, labels):
+        """Return (label, confidence) where confidence is the softmax probability of the best label."""
+        started = time.monotonic()
+        centroids = self._get_centroids(labels)
+        query = self._embed([text])
+        sims = (query @ centroids.T)[0]
+        probs = torch.softmax(sims / self.temperature, dim=-1)
+        best = int(torch.argmax(probs).item())
+        with self._lock:
+            self.stats['classified'] += 1
+            self.stats['total_ms'] += (time.monotonic() - started) * 1000
+        return labels[best], round(float(probs[best].item()), 3)
+
+    def record(self, outcome):
+        with self._lock:
+            self.stats[outcome] += 1
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self.stats)
+        total_ms = stats.pop('total_ms')
+        stats['avg_latency_ms'] = round(total_ms / stats['classified'], 2) if stats['classified'] else 0.0
+        stats['threshold'] = self.threshold
+        return stats
+
+
+intent_classifier = IntentClassifier()
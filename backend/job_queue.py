@@ -0,0 +1,284 @@
+import os
+import json
+import uuid
+import time
+import queue
+import threading
+from datetime import datetime, timedelta
+
+from models import db, Job
+
+# Background jobs for long-running generation endpoints. Jobs are rows in the `jobs` table
+# (so they survive restarts and can be polled from any worker process) and are executed by a
+# small in-process thread pool. Handlers report progress, honour cancellation between steps,
+# and failed attempts are retried with a short back-off up to Job.max_attempts.
+JOB_WORKERS = int(os.getenv('JOB_WORKERS', 2))
+JOB_MAX_ATTEMPTS = int(os.getenv('JOB_MAX_ATTEMPTS', 2))
+JOB_RETRY_DELAY_SECONDS = float(os.getenv('JOB_RETRY_DELAY_SECONDS', 5))
+# Running jobs touch updated_at this often, so a 'running' row not updated for JOB_STALE_SECONDS
+# belonged to a process that died; every process sweeps for such rows every JOB_SWEEP_SECONDS
+JOB_HEARTBEAT_SECONDS = float(os.getenv('JOB_HEARTBEAT_SECONDS', 30))
+JOB_STALE_SECONDS = float(os.getenv('JOB_STALE_SECONDS', 150))
+JOB_SWEEP_SECONDS = float(os.getenv('JOB_SWEEP_SECONDS', 60))
+
+TERMINAL_STATUSES = ('succeeded', 'failed', 'cancelled')
+
+JOB_HANDLERS = {}
+
+_app = None
+_queue = queue.Queue()
+_start_lock = threading.Lock()
+_started = False
+
+
+class JobCancelled(Exception):
+    pass
+
+
+def register_job(job_type):
+    """
+    Decorator for job handlers: handler(student_id, payload, progress) -> (body, status_code).
+    progress(percent, message) records progress and raises JobCancelled once a cancel is requested.
+    """
+    def decorator(fn):
+        JOB_HANDLERS[job_type] = fn
+        return fn
+    return decorator
+
+
+def _update_job(job_id, **fields):
+    """Write job fields on a separate connection so a handler's pending session work is untouched."""
+    fields['updated_at'] = datetime.utcnow()
+    with db.engine.begin() as conn:
+        return conn.execute(
+            Job.__table__.update().where(Job.__table__.c.job_id == job_id).values(**fields)
+        ).rowcount
+
+
+def _claim(job_id):
+    """queued -> running in one conditional UPDATE, so a job runs once even if several processes hold its id."""
+    table = Job.__table__
+    with db.engine.begin() as conn:
+        return conn.execute(
+            table.update()
+            .where(table.c.job_id == job_id, table.c.status == 'queued', table.c.cancel_requested.isnot(True))
+            .values(status='running', attempts=table.c.attempts + 1, started_at=datetime.utcnow(),
+                    updated_at=datetime.utcnow(), progress_message='Started')
+        ).rowcount == 1
+
+
+def _cancel_requested(job_id):
+    with db.engine.connect() as conn:
+        return bool(conn.execute(
+            db.select(Job.__table__.c.cancel_requested).where(Job.__table__.c.job_id == job_id)
+        ).scalar())
+
+
+def _make_progress(job_id):
+    def progress(percent, message=None):
+        if _cancel_requested(job_id):
+            raise JobCancelled()
+        _update_job(job_id, progress=max(0, min(100, int(percent))), progress_message=(message or '')[:200])
+    return progress
+
+
+def submit_job(student_id, job_type, payload, max_attempts=JOB_MAX_ATTEMPTS):
+    if job_type not in JOB_HANDLERS:
+        raise ValueError(f"Unknown job type '{job_type}'")
+    job = Job(
+        job_id=uuid.uuid4().hex,
+        student_id=student_id,
+        job_type=job_type,
+        payload=json.dumps(payload),
+        max_attempts=max_attempts,
+        progress_message='Queued'
+    )
+    db.session.add(job)
+    db.session.commit()
+    _queue.put(job.job_id)
+    return job
+
+
+def cancel_job(job):
+    """Queued jobs are cancelled immediately; running ones stop at their next progress checkpoint."""
+    if job.status in TERMINAL_STATUSES:
+        return False
+    table = Job.__table__
+    with db.engine.begin() as conn:
+        # Conditional so a worker claiming the job at the same moment is not overwritten
+        cancelled = conn.execute(
+            table.update()
+            .where(table.c.job_id == job.job_id, table.c.status == 'queued')
+            .values(status='cancelled', cancel_requested=True, finished_at=datetime.utcnow(),
+                    updated_at=datetime.utcnow(), progress_message='Cancelled')
+        ).rowcount
+    if not cancelled:
+        # Already claimed: the handler sees the flag at its next progress checkpoint
+        _update_job(job.job_id, cancel_requested=True, progress_message='Cancelling')
+    db.session.refresh(job)
+    return True
+
+
+def retry_job(job):
+    """Re-queue a failed or cancelled job with a fresh attempt budget."""
+    if job.status not in ('failed', 'cancelled'):
+        return False
+    _update_job(job.job_id, status='queued', attempts=0, error=None, cancel_requested=False, progress=0,
+                progress_message='Queued (retry)', result=None, result_code=None, started_at=None,
+                finished_at=None)
+    db.session.refresh(job)
+    _queue.put(job.job_id)
+    return True
+
+
+def _requeue_later(job_id):
+    timer = threading.Timer(JOB_RETRY_DELAY_SECONDS, _queue.put, args=(job_id,))
+    timer.daemon = True
+    timer.start()
+
+
+def _heartbeat(job_id, stop):
+    """Keep a running job's updated_at fresh, so the stale sweep leaves it alone while this process lives."""
+    table = Job.__table__
+    with _app.app_context():
+        while not stop.wait(JOB_HEARTBEAT_SECONDS):
+            try:
+                with db.engine.begin() as conn:
+                    conn.execute(
+                        table.update()
+                        .where(table.c.job_id == job_id, table.c.status == 'running')
+                        .values(updated_at=datetime.utcnow())
+                    )
+            except Exception as e:
+                print(f"⚠️ Job {job_id} heartbeat failed: {e}")
+
+
+def _run(job_id):
+    if not _claim(job_id):
+        return
+    stop = threading.Event()
+    threading.Thread(target=_heartbeat, args=(job_id, stop), name=f'job-heartbeat-{job_id[:8]}', daemon=True).start()
+    try:
+        _execute(job_id)
+    finally:
+        stop.set()
+
+
+def _execute(job_id):
+    job = Job.query.get(job_id)
+
+    handler = JOB_HANDLERS.get(job.job_type)
+    try:
+        if handler is None:
+            raise ValueError(f"No handler registered for job type '{job.job_type}'")
+        body, status_code = handler(job.student_id, json.loads(job.payload or '{}'), _make_progress(job_id))
+        if status_code >= 500:
+            # Server-side failures (LLM outage, etc.) are worth another attempt
+            raise RuntimeError(body.get('error', f"Handler returned {status_code}") if isinstance(body, dict) else status_code)
+    except JobCancelled:
+        db.session.rollback()
+        _update_job(job_id, status='cancelled', finished_at=datetime.utcnow(), progress_message='Cancelled')
+        return
+    except Exception as e:
+        db.session.rollback()
+        print(f"⚠️ Job {job_id} ({job.job_type}) attempt {job.attempts} failed: {e}")
+        if job.attempts < job.max_attempts:
+            _update_job(job_id, status='queued', error=str(e)[:1000], progress_message='Retrying')
+            _requeue_later(job_id)
+        else:
+            _update_job(job_id, status='failed', error=str(e)[:1000], finished_at=datetime.utcnow(),
+                        progress_message='Failed')
+        return
+
+    # Client errors (unknown topic, etc.) are final; they would fail the same way on retry
+    _update_job(
+        job_id,
+        status='succeeded' if status_code < 400 else 'failed',
+        result=json.dumps(body),
+        result_code=status_code,
+        error=body.get('error') if status_code >= 400 and isinstance(body, dict) else None,
+        progress=100,
+        progress_message='Done',
+        finished_at=datetime.utcnow()
+    )
+
+
+def _worker():
+    while True:
+        job_id = _queue.get()
+        try:
+            with _app.app_context():
+                _run(job_id)
+        except Exception as e:
+            print(f"⚠️ Job worker error on {job_id}: {e}")
+
+
+def _sweep_stale():
+    """
+    Re-queue 'running' jobs whose heartbeat stopped (their process died), or fail them once they
+    are out of attempts. Each row is flipped with a conditional UPDATE, so when several processes
+    sweep at once only one of them re-queues a given job.
+    """
+    table = Job.__table__
+    stale_before = datetime.utcnow() - timedelta(seconds=JOB_STALE_SECONDS)
+    stale = Job.query.filter(Job.status == 'running', Job.updated_at < stale_before).all()
+    db.session.rollback()
+    requeued = 0
+    for job in stale:
+        out_of_attempts = job.attempts >= job.max_attempts
+        values = (
+            dict(status='failed', error='Worker stopped responding', finished_at=datetime.utcnow(),
+                 progress_message='Failed')
+            if out_of_attempts else dict(status='queued', progress_message='Recovered from a stopped worker')
+        )
+        with db.engine.begin() as conn:
+            flipped = conn.execute(
+                table.update()
+                .where(table.c.job_id == job.job_id, table.c.status == 'running', table.c.updated_at < stale_before)
+                .values(updated_at=datetime.utcnow(), **values)
+            ).rowcount
+        if flipped and not out_of_attempts:
+            _queue.put(job.job_id)
+            requeued += 1
+    if requeued:
+        print(f"ℹ️ Job Queue: Re-queued {requeued} stale job(s).")
+
+
+def _sweeper():
+    while True:
+        time.sleep(JOB_SWEEP_SECONDS)
+        try:
+            with _app.app_context():
+                _sweep_stale()
+        except Exception as e:
+            print(f"⚠️ Job sweep error: {e}")
+
+
+def _recover():
+    """Re-queue jobs left behind by a restart: queued ones, and running ones gone stale."""
+    _sweep_stale()
+    recovered = Job.query.filter_by(status='queued').order_by(Job.created_at).all()
+    for job in recovered:
+        _queue.put(job.job_id)
+    if recovered:
+        print(f"ℹ️ Job Queue: Re-queued {len(recovered)} pending job(s).")
+
+
+def start_job_workers(app):
+    """Start the worker threads once per process and re-queue unfinished jobs."""
+    global _app, _started
+    with _start_lock:
+        if _started:
+            return
+        _started = True
+        _app = app
+    with app.app_context():
+        _recover()
+    for i in range(JOB_WORKERS):
+        threading.Thread(target=_worker, name=f'job-worker-{i}', daemon=True).start()
+    threading.Thread(target=_sweeper, name='job-sweeper', daemon=True).start()
+
+
+def get_job_stats():
+    counts = dict(db.session.query(Job.status, db.func.count(Job.job_id)).group_by(Job.status).all())
+    return {'workers': JOB_WORKERS, 'local_queue_depth': _queue.qsize(), 'by_status': counts}
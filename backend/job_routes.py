@@ -0,0 +1,48 @@
+from flask import Blueprint, jsonify
+from flask_jwt_extended import jwt_required, get_jwt_identity
+from models import Job
+from job_queue import cancel_job, retry_job
+
+jobs_bp = Blueprint('jobs', __name__)
+
+def _get_own_job(job_id):
+    job = Job.query.get(job_id)
+    if not job or job.student_id != get_jwt_identity():
+        return None
+    return job
+
+@jobs_bp.route('/', methods=['GET'])
+@jwt_required()
+def list_jobs():
+    """Most recent background jobs of the current student"""
+    jobs = Job.query.filter_by(student_id=get_jwt_identity()).order_by(Job.created_at.desc()).limit(20).all()
+    return jsonify([job.to_dict() for job in jobs])
+
+@jobs_bp.route('/<job_id>', methods=['GET'])
+@jwt_required()
+def get_job(job_id):
+    """Status, progress and (once finished) the result body of a background job"""
+    job = _get_own_job(job_id)
+    if not job:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job.to_dict())
+
+@jobs_bp.route('/<job_id>/cancel', methods=['POST'])
+@jwt_required()
+def cancel(job_id):
+    job = _get_own_job(job_id)
+    if not job:
+        return jsonify({'error': 'Job not found'}), 404
+    if not cancel_job(job):
+        return jsonify({'error': f'Job already {job.status}', 'job': job.to_dict()}), 409
+    return jsonify(job.to_dict()), 202
+
+@jobs_bp.route('/<job_id>/retry', methods=['POST'])
+@jwt_required()
+def retry(job_id):
+    job = _get_own_job(job_id)
+    if not job:
+        return jsonify({'error': 'Job not found'}), 404
+    if not retry_job(job):
+        return jsonify({'error': f'Only failed or cancelled jobs can be retried (job is {job.status})'}), 409
+    return jsonify(job.to_dict()), 202
@@ -0,0 +1,292 @@
+import json
+
+try:
+    import torch
+    from transformers import LogitsProcessor, StoppingCriteria
+except ImportError:
+    torch = None
+    LogitsProcessor = StoppingCriteria = object
+
+# Structured-output helpers for MultiLLMService.generate_json: a single-pass tolerant JSON
+# extractor, a small JSON-schema subset validator, and local-model decoding constraints.
+
+OPENERS = {'{': '}', '[': ']'}
+MAX_EXTRACT_ATTEMPTS = 3
+
+
+class JSONGenerationError(ValueError):
+    def __init__(self, message, raw_text=None, errors=None):
+        super().__init__(message)
+        self.raw_text = raw_text
+        self.errors = errors or []
+
+
+def _scan(text, start):
+    """
+    Walk one JSON container starting at text[start] in a single pass.
+    Returns (end, cut, cut_stack): end is the index after the matching closer (None if the
+    text ends first); cut/cut_stack describe the last comma outside strings, which is where a
+    truncated value can be cut and closed.
+    """
+    stack = []
+    in_string = False
+    escaped = False
+    cut, cut_stack = None, None
+    for i in range(start, len(text)):
+        ch = text[i]
+        if in_string:
+            if escaped:
+                escaped = False
+            elif ch == '\\':
+                escaped = True
+            elif ch == '"':
+                in_string = False
+            continue
+        if ch == '"':
+            in_string = True
+        elif ch in OPENERS:
+            stack.append(OPENERS[ch])
+        elif ch in ('}', ']'):
+            if not stack or stack[-1] != ch:
+                return None, cut, cut_stack
+            stack.pop()
+            if not stack:
+                return i + 1, cut, cut_stack
+        elif ch == ',':
+            cut, cut_stack = i, list(stack)
+    return None, cut, cut_stack
+
+
+def _strip_trailing_commas(candidate):
+    """Drop commas that directly precede a closer (outside strings), in one pass."""
+    out = []
+    in_string = False
+    escaped = False
+    pending_comma = None
+    for ch in candidate:
+        if in_string:
+            out.append(ch)
+            if escaped:
+                escaped = False
+            elif ch == '\\':
+                escaped = True
+            elif ch == '"':
+                in_string = False
+            continue
+        if pending_comma is not None:
+            if ch.isspace():
+                pending_comma.append(ch)
+                continue
+            if ch not in ('}', ']'):
+                out.extend(pending_comma)
+            pending_comma = None
+        if ch == ',':
+            pending_comma = [ch]
+            continue
+        if ch == '"':
+            in_string = True
+        out.append(ch)
+    if pending_comma:
+        out.extend(pending_comma)
+    return ''.join(out)
+
+
+def _loads_tolerant(candidate):
+    try:
+        return json.loads(candidate)
+    except ValueError:
+        return json.loads(_strip_trailing_commas(candidate))
+
+
+def extract_json_span(text, expect=None):
+    """
+    Return the text of the first complete JSON container in `text` (None if there is none).
+    expect: '{' or '[' to only accept that container type.
+    """
+    if not text:
+        return None
+    openers = expect if expect else '{['
+    pos = 0
+    for _ in range(MAX_EXTRACT_ATTEMPTS):
+        starts = [text.find(o, pos) for o in openers]
+        starts = [s for s in starts if s != -1]
+        if not starts:
+            return None
+        start = min(starts)
+        end, _, _ = _scan(text, start)
+        if end is not None:
+            return text[start:end]
+        pos = start + 1
+    return None
+
+
+def extract_json(text, expect=None):
+    """
+    Parse the first JSON value embedded in model output, tolerating markdown fences, prose
+    around the JSON, trailing commas and output truncated by the token limit.
+    Runs in time linear in the text length (each attempt is one pass; attempts are capped).
+    Raises ValueError if nothing parseable is found.
+    """
+    if not text:
+        raise ValueError("Empty response")
+    openers = expect if expect else '{['
+    pos = 0
+    last_error = None
+    for _ in range(MAX_EXTRACT_ATTEMPTS):
+        starts = [text.find(o, pos) for o in openers]
+        starts = [s for s in starts if s != -1]
+        if not starts:
+            break
+        start = min(starts)
+        end, cut, cut_stack = _scan(text, start)
+        try:
+            if end is not None:
+                return _loads_tolerant(text[start:end])
+            if cut is not None:
+                # Truncated output: keep every complete element before the last comma
+                return _loads_tolerant(text[start:cut] + ''.join(reversed(cut_stack)))
+        except ValueError as e:
+            last_error = e
+        pos = start + 1
+    raise ValueError(f"No JSON value found in response ({last_error})" if last_error else "No JSON value found in response")
+
+
+_TYPE_CHECKS = {
+    'object': lambda v: isinstance(v, dict),
+    'array': lambda v: isinstance(v, list),
+    'string': lambda v: isinstance(v, str),
+    'number': lambda v: isinstance(v, (int, float)) and not isinstance(v, bool),
+    'integer': lambda v: isinstance(v, int) and not isinstance(v, bool),
+    'boolean': lambda v: isinstance(v, bool),
+    'null': lambda v: v is None,
+}
+
+
+def validate_schema(value, schema, path='$'):
+    """
+    Validate against the JSON-schema subset our prompts use: type, properties, required,
+    items, enum, minItems, maxItems. Returns a list of error strings (empty when valid).
+    """
+    errors = []
+    expected = schema.get('type')
+    if expected:
+        types = expected if isinstance(expected, list) else [expected]
+        if not any(_TYPE_CHECKS[t](value) for t in types):
+            return [f"{path}: expected {'/'.join(types)}, got {type(value).__name__}"]
+    if 'enum' in schema and value not in schema['enum']:
+        errors.append(f"{path}: {value!r} is not one of {schema['enum']}")
+    if isinstance(value, dict):
+        for key in schema.get('required', []):
+            if key not in value:
+                errors.append(f"{path}: missing required key '{key}'")
+        for key, sub_schema in schema.get('properties', {}).items():
+            if key in value:
+                errors.extend(validate_schema(value[key], sub_schema, f"{path}.{key}"))
+    if isinstance(value, list):
+        if 'minItems' in schema and len(value) < schema['minItems']:
+            errors.append(f"{path}: expected at least {schema['minItems']} items, got {len(value)}")
+        if 'maxItems' in schema and len(value) > schema['maxItems']:
+            errors.append(f"{path}: expected at most {schema['maxItems']} items, got {len(value)}")
+        if 'items' in schema:
+            for i, item in enumerate(value):
+                errors.extend(validate_schema(item, schema['items'], f"{path}[{i}]"))
+    return errors
+
+
+def schema_container(schema):
+    """'{' or '[' for the schema's top-level container, None if it is not a container."""
+    return {'object': '{', 'array': '['}.get(schema.get('type'))
+
+
+def build_repair_prompt(raw_text, schema, errors, max_chars=6000):
+    return f"""The following output was supposed to be JSON matching this JSON schema:
+{json.dumps(schema)}
+
+Problems found: {'; '.join(errors[:10])}
+
+Output:
+{raw_text[:max_chars]}
+
+Return ONLY the corrected JSON value. Keep all existing content; fix only what is needed to satisfy the schema."""
+
+
+_allowed_first_tokens = {}
+
+
+def allowed_first_tokens(tokenizer, opener):
+    """Token ids whose text (ignoring leading whitespace) starts with the opener. Built once per tokenizer."""
+    key = (id(tokenizer), opener)
+    if key not in _allowed_first_tokens:
+        _allowed_first_tokens[key] = [
+            token_id for token_id in range(len(tokenizer))
+            if tokenizer.decode([token_id]).lstrip().startswith(opener)
+        ]
+    return _allowed_first_tokens[key]
+
+
+class JSONFirstTokenProcessor(LogitsProcessor):
+    """Local JSON mode: the first generated token must open the expected container."""
+
+    def __init__(self, tokenizer, opener, prompt_length):
+        self.allowed = allowed_first_tokens(tokenizer, opener)
+        self.prompt_length = prompt_length
+
+    def __call__(self, input_ids, scores):
+        if input_ids.shape[1] != self.prompt_length or not self.allowed:
+            return scores
+        mask = torch.full_like(scores, float('-inf'))
+        mask[:, self.allowed] = 0
+        return scores + mask
+
+
+class JSONBalancedStoppingCriteria(StoppingCriteria):
+    """Local JSON mode: stop once every row has closed its top-level container."""
+
+    def __init__(self, tokenizer, prompt_length, batch_size):
+        self.tokenizer = tokenizer
+        self.prompt_length = prompt_length
+        self._rows = [{'started': False, 'done': False, 'stack': [], 'in_string': False,
+                       'escaped': False, 'seen': 0} for _ in range(batch_size)]
+
+    def _feed(self, row, text):
+        for ch in text:
+            if row['done']:
+                return
+            if not row['started']:
+                if ch in OPENERS:
+                    row['started'] = True
+                    row['stack'].append(OPENERS[ch])
+                continue
+            if row['in_string']:
+                if row['escaped']:
+                    row['escaped'] = False
+                elif ch == '\\':
+                    row['escaped'] = True
+                elif ch == '"':
+                    row['in_string'] = False
+                continue
+            if ch == '"':
+                row['in_string'] = True
+            elif ch in OPENERS:
+                row['stack'].append(OPENERS[ch])
+            elif ch in ('}', ']') and row['stack'] and row['stack'][-1] == ch:
+                row['stack'].pop()
+                if not row['stack']:
+                    row['done'] = True
+
+    def __call__(self, input_ids, scores, **kwargs):
+        # Only tokens generated since the last step are decoded, so this stays linear
+        for row, ids in zip(self._rows, input_ids):
+            new_ids = ids[self.prompt_length + row['seen']:]
+            row['seen'] += len(new_ids)
+            self._feed(row, self.tokenizer.decode(new_ids, skip_special_tokens=True))
+        return all(row['done'] for row in self._rows)
+
+
+def local_json_constraints(tokenizer, opener, prompt_length, batch_size):
+    """generate() kwargs that constrain the local model to emit one JSON container."""
+    from transformers import LogitsProcessorList, StoppingCriteriaList
+    return {
+        'logits_processor': LogitsProcessorList([JSONFirstTokenProcessor(tokenizer, opener, prompt_length)]),
+        'stopping_criteria': StoppingCriteriaList([JSONBalancedStoppingCriteria(tokenizer, prompt_length, batch_size)]),
+    }
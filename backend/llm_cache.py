@@ -0,0 +1,199 @@
+import os
+import time
+import json
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+# Two-tier prompt/response cache for MultiLLMService.
+# Tier 1: in-process LRU (OrderedDict). Tier 2: SQLite file that survives restarts.
+LLM_CACHE_ENABLED = os.getenv('LLM_CACHE_ENABLED', 'true').lower() == 'true'
+LLM_CACHE_PATH = os.getenv('LLM_CACHE_PATH', 'cache/llm_cache.db')
+LLM_CACHE_TTL_SECONDS = int(os.getenv('LLM_CACHE_TTL_SECONDS', 7 * 24 * 3600))
+LLM_CACHE_MEMORY_ENTRIES = int(os.getenv('LLM_CACHE_MEMORY_ENTRIES', 512))
+LLM_CACHE_DISK_ENTRIES = int(os.getenv('LLM_CACHE_DISK_ENTRIES', 20000))
+
+
+def make_cache_key(prompt, **params):
+    """Stable hash of the prompt plus every generation parameter that changes the output."""
+    payload = json.dumps({'prompt': prompt, 'params': params}, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class LLMCache:
+    def __init__(self, path=LLM_CACHE_PATH, ttl_seconds=LLM_CACHE_TTL_SECONDS,
+                 memory_entries=LLM_CACHE_MEMORY_ENTRIES, disk_entries=LLM_CACHE_DISK_ENTRIES,
+                 enabled=LLM_CACHE_ENABLED, label='LLM Cache'):
+        self.path = path
+        self.label = label
+        self.ttl_seconds = ttl_seconds
+        self.memory_entries = memory_entries
+        self.disk_entries = disk_entries
+        self.enabled = enabled
+
+        self._memory = OrderedDict()  # key -> (expires_at, text)
+        self._lock = threading.Lock()
+        self._disk_ok = False
+        self._writes_since_prune = 0
+        self.stats = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0, 'bypassed': 0,
+                      'stores': 0, 'evictions': 0, 'expired': 0}
+
+        if self.enabled:
+            self._init_disk()
+
+    @contextmanager
+    def _connect(self):
+        # One short-lived connection per operation keeps this safe across Flask worker threads
+        conn = sqlite3.connect(self.path, timeout=5)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def _init_disk(self):
+        try:
+            directory = os.path.dirname(self.path)
+            if directory and not os.path.exists(directory):
+                os.makedirs(directory, exist_ok=True)
+            with self._connect() as conn:
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute("""
+                    CREATE TABLE IF NOT EXISTS llm_cache (
+                        cache_key TEXT PRIMARY KEY,
+                        response TEXT NOT NULL,
+                        created_at REAL NOT NULL,
+                        expires_at REAL NOT NULL,
+                        last_access REAL NOT NULL
+                    )
+                """)
+                conn.execute("CREATE INDEX IF NOT EXISTS idx_llm_cache_access ON llm_cache(last_access)")
+            self._disk_ok = True
+        except Exception as e:
+            print(f"⚠️ {self.label}: Disk tier unavailable, using memory only. Error: {e}")
+
+    def get(self, key):
+        """Return cached text or None. Memory tier first, then disk (promoting hits to memory)."""
+        if not self.enabled:
+            return None
+        now = time.time()
+
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry:
+                expires_at, text = entry
+                if expires_at > now:
+                    self._memory.move_to_end(key)
+                    self.stats['memory_hits'] += 1
+                    return text
+                del self._memory[key]
+                self.stats['expired'] += 1
+
+        if self._disk_ok:
+            try:
+                with self._connect() as conn:
+                    row = conn.execute(
+                        "SELECT response, expires_at FROM llm_cache WHERE cache_key = ?", (key,)
+                    ).fetchone()
+                    if row and row[1] > now:
+                        conn.execute("UPDATE llm_cache SET last_access = ? WHERE cache_key = ?", (now, key))
+                        with self._lock:
+                            self.stats['disk_hits'] += 1
+                            self._remember(key, row[1], row[0])
+                        return row[0]
+                    if row:
+                        conn.execute("DELETE FROM llm_cache WHERE cache_key = ?", (key,))
+                        with self._lock:
+                            self.stats['expired'] += 1
+            except Exception as e:
+                print(f"⚠️ {self.label}: Disk read failed: {e}")
+
+        with self._lock:
+            self.stats['misses'] += 1
+        return None
+
+    def set(self, key, text, ttl_seconds=None):
+        if not self.enabled or text is None:
+            return
+        now = time.time()
+        expires_at = now + (ttl_seconds or self.ttl_seconds)
+
+        with self._lock:
+            self._remember(key, expires_at, text)
+            self.stats['stores'] += 1
+
+        if self._disk_ok:
+            try:
+                with self._connect() as conn:
+                    conn.execute(
+                        "INSERT OR REPLACE INTO llm_cache (cache_key, response, created_at, expires_at, last_access) "
+                        "VALUES (?, ?, ?, ?, ?)",
+                        (key, text, now, expires_at, now)
+                    )
+                    self._writes_since_prune += 1
+                    if self._writes_since_prune >= 100:
+                        self._writes_since_prune = 0
+                        self._prune_disk(conn, now)
+            except Exception as e:
+                print(f"⚠️ {self.label}: Disk write failed: {e}")
+
+    def _remember(self, key, expires_at, text):
+        # Caller holds self._lock
+        self._memory[key] = (expires_at, text)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+            self.stats['evictions'] += 1
+
+    def _prune_disk(self, conn, now):
+        """Drop expired rows, then the least recently used rows above the size cap."""
+        removed = conn.execute("DELETE FROM llm_cache WHERE expires_at <= ?", (now,)).rowcount
+        count = conn.execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0]
+        overflow = count - self.disk_entries
+        if overflow > 0:
+            removed += conn.execute(
+                "DELETE FROM llm_cache WHERE cache_key IN "
+                "(SELECT cache_key FROM llm_cache ORDER BY last_access ASC LIMIT ?)", (overflow,)
+            ).rowcount
+        with self._lock:
+            self.stats['evictions'] += max(removed, 0)
+
+    def record_bypass(self):
+        with self._lock:
+            self.stats['bypassed'] += 1
+
+    def delete(self, key):
+        """Evict one entry from both tiers (e.g. a response that turned out to be unusable)."""
+        if not self.enabled or key is None:
+            return
+        with self._lock:
+            self._memory.pop(key, None)
+        if self._disk_ok:
+            try:
+                with self._connect() as conn:
+                    conn.execute("DELETE FROM llm_cache WHERE cache_key = ?", (key,))
+            except Exception as e:
+                print(f"⚠️ {self.label}: Delete failed: {e}")
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+        if self._disk_ok:
+            try:
+                with self._connect() as conn:
+                    conn.execute("DELETE FROM llm_cache")
+            except Exception as e:
+                print(f"⚠️ {self.label}: Clear failed: {e}")
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self.stats)
+            stats['memory_entries'] = len(self._memory)
+        hits = stats['memory_hits'] + stats['disk_hits']
+        lookups = hits + stats['misses']
+        stats['hit_rate'] = round(hits / lookups, 3) if lookups else 0.0
+        stats['enabled'] = self.enabled
+        stats['disk_tier'] = self._disk_ok
+        return stats
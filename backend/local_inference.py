@@ -0,0 +1,198 @@
+import os
+import time
+import queue
+import threading
+from collections import deque
+from concurrent.futures import Future
+
+# Dynamic micro-batching for the local Qwen model.
+# A single worker thread owns model.generate(); request threads enqueue and wait on a Future.
+LOCAL_BATCH_WINDOW_MS = float(os.getenv('LOCAL_BATCH_WINDOW_MS', 25))
+LOCAL_MAX_BATCH_SIZE = int(os.getenv('LOCAL_MAX_BATCH_SIZE', 8))
+LOCAL_MAX_BATCH_TOKENS = int(os.getenv('LOCAL_MAX_BATCH_TOKENS', 16384))
+LOCAL_QUEUE_SIZE = int(os.getenv('LOCAL_QUEUE_SIZE', 256))
+
+
+class InferenceQueueFull(RuntimeError):
+    pass
+
+
+class _InferenceRequest:
+    __slots__ = ('prompt', 'max_new_tokens', 'temperature', 'response_format', 'prompt_tokens', 'future',
+                 'enqueued_at', 'streamer')
+
+    def __init__(self, prompt, max_new_tokens, temperature, streamer=None, response_format=None):
+        self.prompt = prompt
+        self.max_new_tokens = max_new_tokens
+        self.temperature = temperature
+        self.response_format = response_format
+        self.prompt_tokens = None
+        self.future = Future()
+        self.enqueued_at = time.monotonic()
+        self.streamer = streamer
+
+    def batch_key(self):
+        # Streaming requests always run alone; others only share a generate() call
+        # when their sampling settings and output constraints match
+        if self.streamer is not None:
+            return ('stream', id(self))
+        return (self.max_new_tokens, self.temperature, self.response_format)
+
+
+class LocalInferenceWorker:
+    def __init__(self, run_batch, count_tokens, run_stream=None, window_ms=LOCAL_BATCH_WINDOW_MS,
+                 max_batch_size=LOCAL_MAX_BATCH_SIZE, max_batch_tokens=LOCAL_MAX_BATCH_TOKENS,
+                 queue_size=LOCAL_QUEUE_SIZE):
+        """
+        run_batch(prompts, max_new_tokens, temperature, response_format) -> list of responses, one per prompt.
+        count_tokens(prompt) -> prompt length in tokens (called on the worker thread only).
+        run_stream(prompt, max_new_tokens, temperature, streamer) -> generates into a
+        transformers streamer that the caller is iterating on its own thread.
+        """
+        self._run_batch = run_batch
+        self._count_tokens = count_tokens
+        self._run_stream = run_stream
+        self.window = window_ms / 1000.0
+        self.max_batch_size = max_batch_size
+        self.max_batch_tokens = max_batch_tokens
+
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._backlog = deque()  # requests pulled from the queue that did not fit the last batch
+        self._stats_lock = threading.Lock()
+        self._stats = {'requests': 0, 'rejected': 0, 'batches': 0, 'batched_requests': 0,
+                       'max_batch_size': 0, 'total_queue_wait_ms': 0.0, 'total_batch_ms': 0.0}
+        self._batch_sizes = {}
+
+        self._thread = threading.Thread(target=self._loop, name='local-inference', daemon=True)
+        self._thread.start()
+
+    def submit(self, prompt, max_new_tokens, temperature, streamer=None, response_format=None):
+        if streamer is not None and self._run_stream is None:
+            raise ValueError("This worker was created without streaming support")
+        request = _InferenceRequest(prompt, max_new_tokens, temperature, streamer, response_format)
+        try:
+            self._queue.put_nowait(request)
+        except queue.Full:
+            with self._stats_lock:
+                self._stats['rejected'] += 1
+            raise InferenceQueueFull("Local inference queue is full")
+        with self._stats_lock:
+            self._stats['requests'] += 1
+        return request.future
+
+    def generate(self, prompt, max_new_tokens, temperature, response_format=None):
+        return self.submit(prompt, max_new_tokens, temperature, response_format=response_format).result()
+
+    def submit_stream(self, prompt, max_new_tokens, temperature, streamer):
+        """Queue a streaming generation; the returned Future resolves once generation ends."""
+        return self.submit(prompt, max_new_tokens, temperature, streamer=streamer)
+
+    def _next(self, timeout=None):
+        if self._backlog:
+            return self._backlog.popleft()
+        if timeout is None:
+            return self._queue.get()
+        return self._queue.get(timeout=timeout)
+
+    def _tokens(self, request):
+        if request.prompt_tokens is None:
+            try:
+                request.prompt_tokens = self._count_tokens(request.prompt)
+            except Exception:
+                request.prompt_tokens = len(request.prompt) // 4
+        return request.prompt_tokens
+
+    def _fits(self, batch, request):
+        if request.batch_key() != batch[0].batch_key():
+            return False
+        # Padded cost: every row is as long as the longest prompt plus the generation budget
+        longest = max(self._tokens(request), max(self._tokens(r) for r in batch))
+        return (len(batch) + 1) * (longest + request.max_new_tokens) <= self.max_batch_tokens
+
+    def _collect_batch(self):
+        first = self._next()
+        self._tokens(first)
+        batch = [first]
+        skipped = []
+        deadline = time.monotonic() + self.window
+
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                request = self._next(timeout=remaining)
+            except queue.Empty:
+                break
+            if self._fits(batch, request):
+                batch.append(request)
+            else:
+                skipped.append(request)
+
+        # Keep arrival order for whatever did not fit
+        self._backlog.extendleft(reversed(skipped))
+        return batch
+
+    def _loop(self):
+        while True:
+            batch = self._collect_batch()
+            started = time.monotonic()
+            if batch[0].streamer is not None:
+                self._serve_stream(batch[0])
+                self._record_batch(batch, started)
+                continue
+            try:
+                responses = self._run_batch(
+                    [r.prompt for r in batch], batch[0].max_new_tokens, batch[0].temperature,
+                    batch[0].response_format
+                )
+                for request, response in zip(batch, responses):
+                    request.future.set_result(response)
+            except Exception as e:
+                for request in batch:
+                    if not request.future.done():
+                        request.future.set_exception(e)
+            self._record_batch(batch, started)
+
+    def _serve_stream(self, request):
+        try:
+            self._run_stream(request.prompt, request.max_new_tokens, request.temperature, request.streamer)
+            request.future.set_result(None)
+        except Exception as e:
+            # Unblock the consumer still iterating the streamer
+            try:
+                request.streamer.end()
+            except Exception:
+                pass
+            request.future.set_exception(e)
+
+    def _record_batch(self, batch, started):
+        finished = time.monotonic()
+        size = len(batch)
+        with self._stats_lock:
+            self._stats['batches'] += 1
+            self._stats['batched_requests'] += size
+            self._stats['max_batch_size'] = max(self._stats['max_batch_size'], size)
+            self._stats['total_queue_wait_ms'] += sum((started - r.enqueued_at) * 1000 for r in batch)
+            self._stats['total_batch_ms'] += (finished - started) * 1000
+            self._batch_sizes[size] = self._batch_sizes.get(size, 0) + 1
+
+    def get_stats(self):
+        with self._stats_lock:
+            stats = dict(self._stats)
+            histogram = dict(sorted(self._batch_sizes.items()))
+        batches = stats.pop('batches')
+        batched = stats.pop('batched_requests')
+        total_wait = stats.pop('total_queue_wait_ms')
+        total_batch = stats.pop('total_batch_ms')
+        stats.update({
+            'queue_depth': self._queue.qsize() + len(self._backlog),
+            'batches': batches,
+            'avg_batch_size': round(batched / batches, 2) if batches else 0.0,
+            'avg_queue_wait_ms': round(total_wait / batched, 1) if batched else 0.0,
+            'avg_batch_latency_ms': round(total_batch / batches, 1) if batches else 0.0,
+            'batch_size_histogram': histogram,
+            'window_ms': self.window * 1000,
+            'max_batch_tokens': self.max_batch_tokens
+        })
+        return stats
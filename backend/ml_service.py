@@ -2,8 +2,54 @@ import torch
 from transformers import AutoTokenizer, AutoModelForCausalLM
 import os
 import json
-import re
 import google.generativeai as genai
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from llm_cache import LLMCache, make_cache_key
+import http_client
+import threading
+import time
+from local_inference import LocalInferenceWorker
+from circuit_breaker import CircuitBreaker
+from prefix_cache import PrefixKVCache
+from single_flight import SingleFlight
+from rate_limiter import ProviderRateLimiter, RateLimitExceeded, UpstreamRateLimited, provider_limits, wait_deadline
+from stub_provider import StubProvider
+from json_output import (
+    JSONGenerationError, extract_json, extract_json_span, validate_schema,
+    schema_container, build_repair_prompt, local_json_constraints
+)
+import copy
+import gc
+import contextvars
+
+LLM_BATCH_WORKERS = int(os.getenv('LLM_BATCH_WORKERS', 8))
+# 'auto' = OpenRouter > Gemini > local model by available keys; 'stub' = offline canned responses
+LLM_PROVIDER = os.getenv('LLM_PROVIDER', 'auto').lower()
+# Hedged requests (generate_content(hedge=True)): if the primary cloud provider is slower than
+# this percentile of its recent latency, the secondary is raced against it
+LLM_HEDGE_PERCENTILE = float(os.getenv('LLM_HEDGE_PERCENTILE', 0.9))
+LLM_HEDGE_MIN_DELAY_SECONDS = float(os.getenv('LLM_HEDGE_MIN_DELAY_SECONDS', 1.0))
+LLM_HEDGE_DEFAULT_DELAY_SECONDS = float(os.getenv('LLM_HEDGE_DEFAULT_DELAY_SECONDS', 5.0))
+LLM_HEDGE_WORKERS = int(os.getenv('LLM_HEDGE_WORKERS', 8))
+# CPU inference mode for the local model: 'int8' (dynamic quantization of Linear layers) or 'fp32'
+LOCAL_LLM_CPU_MODE = os.getenv('LOCAL_LLM_CPU_MODE', 'int8').lower()
+LOCAL_LLM_INT8_MIN_AGREEMENT = float(os.getenv('LOCAL_LLM_INT8_MIN_AGREEMENT', 0.85))
+LOCAL_LLM_QUANT_CHECK_PROMPT = "Explain in one sentence why binary search runs in logarithmic time."
+
+def _model_footprint_bytes(model):
+    """Bytes held by weights and buffers, counting packed int8 params of quantized Linear layers."""
+    total = 0
+    seen = set()  # tied weights (embeddings / lm_head) appear under two keys
+    for value in model.state_dict().values():
+        tensors = value if isinstance(value, (tuple, list)) else [value]
+        for t in tensors:
+            if isinstance(t, torch.Tensor):
+                key = (t.data_ptr(), t.numel()) if not t.is_quantized else id(t)
+                if key in seen:
+                    continue
+                seen.add(key)
+                total += t.numel() * t.element_size()
+    return total
 
 class MultiLLMService:
     _instance = None
@@ -12,10 +58,16 @@ class MultiLLMService:
     _device = None
     _use_gemini = False
     _use_openrouter = False
+    _use_stub = False
     _openrouter_key = None
+    _load_lock = threading.Lock()
+    _local_model_info = None
+    _quantization_check = {}
 
     MODEL_PATH = "/app/models/Qwen/Qwen2.5-Coder-1.5B-Instruct"
     MODEL_ID = "Qwen/Qwen2.5-Coder-1.5B-Instruct"
+    OPENROUTER_MODEL = "meta-llama/llama-3-8b-instruct"
+    GEMINI_MODEL = "gemini-2.5-flash-lite"
 
     @classmethod
     def get_instance(cls):
@@ -25,12 +77,29 @@ class MultiLLMService:
 
     def __init__(self):
         self._device = None
+        self._cache = LLMCache()
+        self._local_worker = None
+        self._local_worker_lock = threading.Lock()
+        self._prefix_cache = PrefixKVCache()
+        self._inflight = SingleFlight()
+        self._stats_lock = threading.Lock()
+        self._json_stats = {'repairs': 0, 'repair_failures': 0}
+        self._hedge_pool = ThreadPoolExecutor(max_workers=LLM_HEDGE_WORKERS, thread_name_prefix='llm-hedge')
+        self._hedge_stats = {'requests': 0, 'primary_only': 0, 'hedged': 0, 'primary_wins': 0,
+                             'secondary_wins': 0, 'fallbacks': 0, 'cancelled': 0, 'failed': 0}
         self._openrouter_key = os.getenv('OPENROUTER_API_KEY')
+        self._stub = None
+        if LLM_PROVIDER == 'stub':
+            # Load tests / benchmarks: no network, no model weights
+            self._stub = StubProvider()
+            self._use_stub = True
+            self._openrouter_key = None
+            print("✅ ML Service: Stub provider configured (LLM_PROVIDER=stub). No real models will be called.")
         if self._openrouter_key:
             self._use_openrouter = True
             print("✅ ML Service: OpenRouter (Llama-3-8b) configured as primary engine.")
         
-        self._api_key = os.getenv('GOOGLE_API_KEY') or os.getenv('GEMINI_API_KEY')
+        self._api_key = None if self._use_stub else os.getenv('GOOGLE_API_KEY') or os.getenv('GEMINI_API_KEY')
         if self._api_key:
             try:
                 genai.configure(api_key=self._api_key)
@@ -40,13 +109,33 @@ class MultiLLMService:
             except Exception as e:
                 print(f"⚠️ ML Service: Gemini config failed. Error: {e}")
         
-        if not self._use_openrouter and not self._use_gemini:
+        if not self._use_openrouter and not self._use_gemini and not self._use_stub:
             print("ℹ️ ML Service: No Cloud API Keys found. Using local LLM.")
 
+        # Health-aware routing: a tripped provider is skipped without paying its timeout
+        self._breakers = {
+            'openrouter': CircuitBreaker('OpenRouter', probe=lambda: self._generate_openrouter("ping", 1, 0.0)),
+            'gemini': CircuitBreaker('Gemini', probe=lambda: self._generate_gemini("ping", 1, 0.0)),
+            'stub': CircuitBreaker('Stub', probe=lambda: self._generate_stub("ping", 1, 0.0)),
+        }
+        # Priority-aware admission per provider, so bulk work absorbs saturation before chat does
+        self._limiters = {
+            'openrouter': ProviderRateLimiter('OpenRouter', *provider_limits('openrouter', 2.0, 5)),
+            'gemini': ProviderRateLimiter('Gemini', *provider_limits('gemini', 0.25, 3)),
+            'stub': ProviderRateLimiter('Stub', *provider_limits('stub', 1000.0, 1000)),
+        }
+
     def _load_local_model(self):
         if self._local_model:
             return
         
+        # Concurrent first requests (or warm-up racing a request) must not load the model twice
+        with self._load_lock:
+            if self._local_model:
+                return
+            self._load_local_model_locked()
+
+    def _load_local_model_locked(self):
         try:
             if not self._device:
                 self._device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
@@ -59,123 +148,923 @@ class MultiLLMService:
                 path_to_use = "../models/Qwen/Qwen2.5-Coder-1.5B-Instruct"
 
             self._local_tokenizer = AutoTokenizer.from_pretrained(path_to_use, trust_remote_code=True)
-            self._local_model = AutoModelForCausalLM.from_pretrained(
-                path_to_use,
-                torch_dtype=torch.float16 if self._device.type == 'cuda' else torch.float32,
-                device_map="auto" if self._device.type == 'cuda' else None,
-                trust_remote_code=True
-            )
-            if self._device.type != 'cuda':
-                self._local_model.to(self._device)
-            self._local_model.eval()
-            print("✅ ML Service: Local model loaded.")
+            # Decoder-only models must be left-padded for batched generate()
+            self._local_tokenizer.padding_side = 'left'
+            if self._local_tokenizer.pad_token is None:
+                self._local_tokenizer.pad_token = self._local_tokenizer.eos_token
+            model = self._load_weights(path_to_use)
+
+            mode = 'fp16' if self._device.type == 'cuda' else 'fp32'
+            if self._device.type != 'cuda' and LOCAL_LLM_CPU_MODE == 'int8':
+                if self._quantize_int8(model):
+                    mode = 'int8'
+                else:
+                    # Drop the rejected (possibly partly quantized) weights before loading fp32 again
+                    del model
+                    gc.collect()
+                    model = self._load_weights(path_to_use)
+
+            self._local_model_info = {
+                'mode': mode,
+                'device': self._device.type,
+                'footprint_mb': round(_model_footprint_bytes(model) / (1024 * 1024), 1),
+                'tokens_per_second': self._measure_tokens_per_second(model)
+            }
+            self._local_model_info.update(self._quantization_check)
+            # Publish last so concurrent readers never see a half-initialized model
+            self._local_model = model
+            print(f"✅ ML Service: Local model loaded ({mode}, {self._local_model_info['footprint_mb']} MB, "
+                  f"{self._local_model_info['tokens_per_second']} tok/s).")
         except Exception as e:
             print(f"❌ ML Service: Local model load failed: {e}")
 
-    def generate_content(self, prompt, max_new_tokens=1024, temperature=0.7):
-        """Unified generation interface. Prioritizes OpenRouter, then Gemini."""
+    def _load_weights(self, path):
+        model = AutoModelForCausalLM.from_pretrained(
+            path,
+            torch_dtype=torch.float16 if self._device.type == 'cuda' else torch.float32,
+            device_map="auto" if self._device.type == 'cuda' else None,
+            trust_remote_code=True
+        )
+        if self._device.type != 'cuda':
+            model.to(self._device)
+        model.eval()
+        return model
+
+    def _quantize_int8(self, model):
+        """
+        Dynamic int8 quantization of every nn.Linear (weights stored int8, activations
+        quantized on the fly), done in place so the host never holds fp32 and int8 copies at
+        once. Only the fp32 reference logits for the sanity check are kept. Returns False when
+        quantized next-token predictions disagree too much with them (or quantization fails);
+        the caller then reloads fp32 weights from disk.
+        """
+        try:
+            probe = self._local_tokenizer(LOCAL_LLM_QUANT_CHECK_PROMPT, return_tensors="pt")
+            with torch.no_grad():
+                reference = model(**probe).logits[0].float()
+
+            torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+            with torch.no_grad():
+                candidate = model(**probe).logits[0].float()
+
+            agreement = (reference.argmax(dim=-1) == candidate.argmax(dim=-1)).float().mean().item()
+            cosine = torch.nn.functional.cosine_similarity(reference, candidate, dim=-1).mean().item()
+            self._quantization_check = {
+                'int8_top1_agreement': round(agreement, 3),
+                'int8_logit_cosine': round(cosine, 4)
+            }
+            if agreement < LOCAL_LLM_INT8_MIN_AGREEMENT:
+                print(f"⚠️ ML Service: int8 sanity check failed (top-1 agreement {agreement:.2f} < "
+                      f"{LOCAL_LLM_INT8_MIN_AGREEMENT}). Reloading fp32 weights.")
+                return False
+            print(f"✅ ML Service: int8 sanity check passed (top-1 agreement {agreement:.2f}, logit cosine {cosine:.3f}).")
+            return True
+        except Exception as e:
+            print(f"⚠️ ML Service: int8 quantization failed, reloading fp32 weights. Error: {e}")
+            return False
+
+    def _measure_tokens_per_second(self, model, new_tokens=16):
+        """Short greedy generation at load time so the chosen mode's throughput is visible in the logs."""
+        try:
+            inputs = self._local_tokenizer(LOCAL_LLM_QUANT_CHECK_PROMPT, return_tensors="pt").to(self._device)
+            started = time.monotonic()
+            with torch.no_grad():
+                outputs = model.generate(
+                    **inputs,
+                    max_new_tokens=new_tokens,
+                    min_new_tokens=new_tokens,
+                    do_sample=False,
+                    pad_token_id=self._local_tokenizer.pad_token_id
+                )
+            generated = outputs.shape[1] - inputs["input_ids"].shape[1]
+            return round(generated / (time.monotonic() - started), 1)
+        except Exception as e:
+            print(f"⚠️ ML Service: Throughput check failed: {e}")
+            return None
+
+    def _provider_signature(self):
+        """Identifies the provider chain so cached answers are not reused across engines."""
+        if self._use_stub:
+            return "stub"
+        chain = []
         if self._use_openrouter:
+            chain.append(f"openrouter:{self.OPENROUTER_MODEL}")
+        if self._use_gemini:
+            chain.append(f"gemini:{self.GEMINI_MODEL}")
+        chain.append(f"local:{self.MODEL_ID}")
+        return ">".join(chain)
+
+    def _cache_key(self, prompt, max_new_tokens, temperature, response_format=None):
+        params = {
+            'max_new_tokens': max_new_tokens,
+            'temperature': temperature,
+            'provider': self._provider_signature()
+        }
+        if response_format:
+            params['response_format'] = response_format
+        return make_cache_key(prompt, **params)
+
+    def generate_content(self, prompt, max_new_tokens=1024, temperature=0.7, use_cache=True, response_format=None,
+                         hedge=False, priority='standard'):
+        """Unified generation interface. Prioritizes OpenRouter, then Gemini.
+
+        Responses are served from the prompt cache when possible; pass use_cache=False
+        to force a fresh generation (the result still refreshes the cache).
+        response_format: None, 'json_object' or 'json_array' to request provider JSON modes.
+        hedge: for latency-sensitive callers; races the secondary cloud provider against a
+        slow primary (see _generate_hedged). Costs an extra call whenever the hedge fires.
+        priority: 'interactive', 'standard' or 'background' for provider rate limiting; a shed
+        request raises RateLimitExceeded instead of queueing behind higher-priority work.
+        """
+        cache_key = self._cache_key(prompt, max_new_tokens, temperature, response_format)
+        if use_cache:
+            cached_text = self._cache.get(cache_key)
+            if cached_text is not None:
+                return MockResponse(cached_text, cached=True)
+        else:
+            self._cache.record_bypass()
+
+        # Concurrent callers with the same key share one upstream generation
+        response, shared = self._inflight.do(
+            cache_key, self._generate_and_store, cache_key, prompt, max_new_tokens, temperature, response_format, hedge,
+            priority
+        )
+        if shared:
+            response = copy.copy(response)
+        response.cache_key = cache_key
+        return response
+
+    def _generate_and_store(self, cache_key, prompt, max_new_tokens, temperature, response_format=None, hedge=False,
+                            priority='standard'):
+        # Store before the single-flight slot is released so late arrivals hit the cache
+        response = self._generate_uncached(prompt, max_new_tokens, temperature, response_format, hedge, priority)
+        if not response.is_error:
+            self._cache.set(cache_key, response.text)
+        return response
+
+    def generate_many(self, prompts, max_new_tokens=1024, temperature=0.7, use_cache=True, max_workers=None,
+                      response_format=None, priority='standard'):
+        """Batch generation interface. Returns one response per prompt, in input order.
+
+        Cloud providers are called concurrently from a bounded thread pool; the local model
+        runs all prompts as a single padded generate() call. A failed item comes back as an
+        error response (is_error=True) instead of failing the whole batch.
+        """
+        results = [None] * len(prompts)
+        keys = [self._cache_key(p, max_new_tokens, temperature, response_format) for p in prompts]
+        pending = []
+        for i, key in enumerate(keys):
+            cached_text = self._cache.get(key) if use_cache else None
+            if cached_text is not None:
+                results[i] = MockResponse(cached_text, cached=True)
+            else:
+                pending.append(i)
+        if not use_cache:
+            for _ in pending:
+                self._cache.record_bypass()
+
+        if not pending:
+            return results
+
+        # Duplicates (within this batch or already in flight elsewhere) wait for their leader
+        flights = {i: self._inflight.begin(keys[i]) for i in pending}
+        leaders = [i for i in pending if flights[i][1]]
+        try:
+            if self._cloud_providers():
+                workers = min(max_workers or LLM_BATCH_WORKERS, max(len(leaders), 1))
+                with ThreadPoolExecutor(max_workers=workers) as pool:
+                    futures = [
+                        # Run in a copy of the caller's context so a sync_wait_limit still applies
+                        (i, pool.submit(contextvars.copy_context().run, self._generate_and_store, keys[i], prompts[i],
+                                        max_new_tokens, temperature, response_format, False, priority))
+                        for i in leaders
+                    ]
+                    for i, future in futures:
+                        try:
+                            results[i] = future.result()
+                        except Exception as e:
+                            results[i] = MockResponse(f"Error: {str(e)}", is_error=True)
+                        self._inflight.finish(keys[i], result=results[i])
+            else:
+                # Enqueue everything at once so the inference worker can fold it into one batch
+                futures = []
+                for i in leaders:
+                    try:
+                        futures.append((i, self._get_local_worker().submit(
+                            prompts[i], max_new_tokens, temperature, response_format=response_format
+                        )))
+                    except Exception as e:
+                        results[i] = MockResponse(f"Error: {str(e)}", is_error=True)
+                for i, future in futures:
+                    try:
+                        results[i] = future.result()
+                    except Exception as e:
+                        results[i] = MockResponse(f"Error: {str(e)}", is_error=True)
+                for i in leaders:
+                    if not results[i].is_error:
+                        self._cache.set(keys[i], results[i].text)
+                    self._inflight.finish(keys[i], result=results[i])
+        finally:
+            # Never leave a slot open: waiters elsewhere would block forever
+            for i in leaders:
+                if results[i] is None:
+                    self._inflight.finish(keys[i], error=RuntimeError("Batch generation aborted"))
+
+        # Leaders are all finished before waiting, so two overlapping batches cannot deadlock
+        for i in pending:
+            future, leader = flights[i]
+            if leader:
+                continue
             try:
-                import requests
-                response = requests.post(
-                    url="https://openrouter.ai/api/v1/chat/completions",
-                    headers={
-                        "Authorization": f"Bearer {self._openrouter_key}",
-                        "Content-Type": "application/json",
-                        "X-Title": "Academic Companion",
-                    },
-                    json={
-                        "model": "meta-llama/llama-3-8b-instruct",
-                        "messages": [{"role": "user", "content": prompt}],
-                        "max_tokens": max_new_tokens,
-                        "temperature": temperature
-                    },
-                    timeout=30
-                )
-                if response.status_code == 200:
-                    return MockResponse(response.json()['choices'][0]['message']['content'])
-                else:
-                    print(f"⚠️ OpenRouter failed ({response.status_code}): {response.text}. Falling back.")
+                results[i] = copy.copy(future.result())
             except Exception as e:
-                print(f"⚠️ OpenRouter error: {e}. Falling back.")
+                results[i] = MockResponse(f"Error: {str(e)}", is_error=True)
+
+        for i, key in enumerate(keys):
+            results[i].cache_key = key
+        return results
 
+    def _cloud_providers(self):
+        if self._use_stub:
+            return [('stub', self._generate_stub)]
+        providers = []
+        if self._use_openrouter:
+            providers.append(('openrouter', self._generate_openrouter))
         if self._use_gemini:
+            providers.append(('gemini', self._generate_gemini))
+        return providers
+
+    def _call_with_breaker(self, name, fn, *args, priority='standard', deadline=None):
+        """Run a provider call (once the rate limiter admits it) and feed its outcome and latency to the provider's breaker."""
+        self._limiters[name].acquire(priority, deadline)
+        breaker = self._breakers[name]
+        started = time.monotonic()
+        try:
+            result = fn(*args)
+        except Exception as e:
+            self._record_provider_failure(name, time.monotonic() - started, e)
+            raise
+        breaker.record_success(time.monotonic() - started)
+        return result
+
+    def _record_provider_failure(self, name, latency, error):
+        self._breakers[name].record_failure(latency, error)
+        # A 429 pauses that provider's limiter so queued calls stop hammering it
+        if isinstance(error, UpstreamRateLimited):
+            self._limiters[name].penalize(error.retry_after)
+        elif type(error).__name__ in ('ResourceExhausted', 'TooManyRequests'):
+            self._limiters[name].penalize()
+
+    def _generate_uncached(self, prompt, max_new_tokens, temperature, response_format=None, hedge=False,
+                           priority='standard'):
+        # One wait budget for the whole fallback chain, not one per provider
+        deadline = wait_deadline(priority)
+        # Provider JSON modes are only wired into the non-streaming calls, so JSON requests never hedge
+        if hedge and response_format is None:
+            available = [name for name, _ in self._cloud_providers() if self._breakers[name].allow_request()]
+            if len(available) >= 2:
+                try:
+                    return self._generate_hedged(available[0], available[1], prompt, max_new_tokens, temperature,
+                                                 priority, deadline)
+                except RateLimitExceeded:
+                    # Same policy as the provider loop below
+                    if priority != 'interactive':
+                        raise
+                    print("⚠️ Hedged request shed. Falling back to local model.")
+                except Exception as e:
+                    print(f"⚠️ Hedged request failed: {e}. Falling back to local model.")
+                return self._generate_local(prompt, max_new_tokens, temperature, response_format)
+
+        shed = None
+        for name, generate_fn in self._cloud_providers():
+            if not self._breakers[name].allow_request():
+                continue
             try:
-                model = genai.GenerativeModel('gemini-2.5-flash-lite')
-                response = model.generate_content(
-                    prompt, 
-                    generation_config=genai.types.GenerationConfig(
-                        max_output_tokens=max_new_tokens,
-                        temperature=temperature
-                    )
+                return self._call_with_breaker(
+                    name, generate_fn, prompt, max_new_tokens, temperature, response_format,
+                    priority=priority, deadline=deadline
                 )
-                return MockResponse(response.text)
+            except RateLimitExceeded as e:
+                shed = e
             except Exception as e:
-                print(f"⚠️ Gemini generation failed: {e}. Falling back to local.")
-        
-        # Local Fallback
+                print(f"⚠️ {self._breakers[name].name} error: {e}. Falling back.")
+
+        # Shed non-interactive work fails fast rather than piling onto the CPU model
+        if shed is not None and priority != 'interactive':
+            raise shed
+        return self._generate_local(prompt, max_new_tokens, temperature, response_format)
+
+    def _hedge_delay(self, name):
+        latency = self._breakers[name].latency_percentile(LLM_HEDGE_PERCENTILE)
+        if latency is None:
+            return LLM_HEDGE_DEFAULT_DELAY_SECONDS
+        return max(latency, LLM_HEDGE_MIN_DELAY_SECONDS)
+
+    def _record_hedge(self, outcome):
+        with self._stats_lock:
+            self._hedge_stats[outcome] += 1
+
+    def _collect_stream(self, name, prompt, max_new_tokens, temperature, cancel, priority='standard', deadline=None):
+        """Generate via the provider's streaming API so a losing hedge can be abandoned mid-flight."""
+        self._limiters[name].acquire(priority, deadline)
+        if cancel.is_set():
+            self._record_hedge('cancelled')
+            return None
+        stream_fn = dict(self._stream_providers())[name]
+        breaker = self._breakers[name]
+        started = time.monotonic()
+        chunks = []
+        stream = stream_fn(prompt, max_new_tokens, temperature)
+        try:
+            for chunk in stream:
+                if cancel.is_set():
+                    # Closing the generator closes the HTTP response, so the provider stops generating
+                    breaker.record_cancelled(time.monotonic() - started)
+                    self._record_hedge('cancelled')
+                    return None
+                if chunk:
+                    chunks.append(chunk)
+        except Exception as e:
+            self._record_provider_failure(name, time.monotonic() - started, e)
+            raise
+        finally:
+            stream.close()
+        if not chunks:
+            breaker.record_failure(time.monotonic() - started, "empty response")
+            raise RuntimeError(f"{breaker.name} returned no text")
+        breaker.record_success(time.monotonic() - started)
+        return MockResponse("".join(chunks), provider=name)
+
+    def _generate_hedged(self, primary, secondary, prompt, max_new_tokens, temperature, priority='standard',
+                         deadline=None):
+        """
+        Send the prompt to the primary provider; if it has not answered within its recent
+        LLM_HEDGE_PERCENTILE latency, send it to the secondary as well. The first complete
+        answer wins and the other call is cancelled. A primary that fails outright before the
+        hedge delay falls back to the secondary as usual.
+        """
+        self._record_hedge('requests')
+        errors = []
+        cancels = {primary: threading.Event(), secondary: threading.Event()}
+        futures = {
+            self._hedge_pool.submit(self._collect_stream, primary, prompt, max_new_tokens, temperature,
+                                    cancels[primary], priority, deadline): primary
+        }
+        done, pending = wait(futures, timeout=self._hedge_delay(primary))
+        hedged = not done
+        if done:
+            first = next(iter(done))
+            if first.exception() is None:
+                self._record_hedge('primary_only')
+                return first.result()
+            print(f"⚠️ {self._breakers[primary].name} error: {first.exception()}. Falling back.")
+            errors.append((primary, first.exception()))
+            self._record_hedge('fallbacks')
+        else:
+            self._record_hedge('hedged')
+
+        second = self._hedge_pool.submit(self._collect_stream, secondary, prompt, max_new_tokens, temperature,
+                                         cancels[secondary], priority, deadline)
+        futures[second] = secondary
+        pending = set(pending) | {second}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is not None:
+                    errors.append((futures[future], future.exception()))
+                    continue
+                for other in pending:
+                    cancels[futures[other]].set()
+                    other.cancel()
+                if hedged:
+                    self._record_hedge('primary_wins' if futures[future] == primary else 'secondary_wins')
+                return future.result()
+        self._record_hedge('failed')
+        message = "; ".join(f"{name}: {error}" for name, error in errors)
+        if all(isinstance(error, RateLimitExceeded) for _, error in errors):
+            raise RateLimitExceeded(message)
+        raise RuntimeError(message)
+
+    def _openrouter_request(self, prompt, max_new_tokens, temperature, stream=False, response_format=None):
+        payload = {
+            "model": self.OPENROUTER_MODEL,
+            "messages": [{"role": "user", "content": prompt}],
+            "max_tokens": max_new_tokens,
+            "temperature": temperature
+        }
+        if stream:
+            payload["stream"] = True
+        if response_format == 'json_object':
+            # OpenAI-style JSON mode only guarantees an object, so arrays rely on the extractor
+            payload["response_format"] = {"type": "json_object"}
+        response = http_client.post(
+            url="https://openrouter.ai/api/v1/chat/completions",
+            headers={
+                "Authorization": f"Bearer {self._openrouter_key}",
+                "Content-Type": "application/json",
+                "X-Title": "Academic Companion",
+            },
+            json=payload,
+            stream=stream,
+            timeout=30
+        )
+        if response.status_code != 200:
+            # Read the error body, then give a streamed response's connection back to the pool
+            error_text = response.text
+            response.close()
+            if response.status_code == 429:
+                retry_after = response.headers.get('Retry-After')
+                raise UpstreamRateLimited(
+                    f"OpenRouter rate limited: {error_text}",
+                    retry_after=float(retry_after) if retry_after and retry_after.isdigit() else None
+                )
+            raise RuntimeError(f"OpenRouter failed ({response.status_code}): {error_text}")
+        return response
+
+    def _generate_openrouter(self, prompt, max_new_tokens, temperature, response_format=None):
+        response = self._openrouter_request(prompt, max_new_tokens, temperature, response_format=response_format)
+        return MockResponse(response.json()['choices'][0]['message']['content'], provider='openrouter')
+
+    def _generate_stub(self, prompt, max_new_tokens, temperature, response_format=None):
+        return MockResponse(self._stub.generate(prompt, max_new_tokens, temperature), provider='stub')
+
+    def _generate_gemini(self, prompt, max_new_tokens, temperature, response_format=None):
+        model = genai.GenerativeModel(self.GEMINI_MODEL)
+        config = {'max_output_tokens': max_new_tokens, 'temperature': temperature}
+        if response_format:
+            config['response_mime_type'] = 'application/json'
+        response = model.generate_content(
+            prompt, 
+            generation_config=genai.types.GenerationConfig(**config)
+        )
+        return MockResponse(response.text, provider='gemini')
+
+    def _get_local_worker(self):
+        if self._local_worker is None:
+            with self._local_worker_lock:
+                if self._local_worker is None:
+                    self._local_worker = LocalInferenceWorker(
+                        self._generate_local_batch,
+                        self._count_local_tokens,
+                        run_stream=self._generate_local_into_streamer
+                    )
+        return self._local_worker
+
+    def _count_local_tokens(self, prompt):
+        self._load_local_model()
+        if not self._local_tokenizer:
+            return len(prompt) // 4
+        return len(self._local_tokenizer(prompt)["input_ids"])
+
+    def _generate_local(self, prompt, max_new_tokens, temperature, response_format=None):
+        """Route through the inference worker so concurrent requests are micro-batched."""
+        if self._use_stub:
+            # A stub brownout must surface as an error, not as a 1.5B model load mid-benchmark
+            return MockResponse("Error: All AI models offline.", is_error=True)
+        try:
+            return self._get_local_worker().generate(prompt, max_new_tokens, temperature, response_format=response_format)
+        except Exception as e:
+            return MockResponse(f"Error: {str(e)}", is_error=True)
+
+    def _json_constraints(self, response_format, prompt_length, batch_size):
+        """Constrained decoding for local JSON mode: force the opening bracket, stop when it closes."""
+        if not response_format:
+            return {}
+        opener = '[' if response_format == 'json_array' else '{'
+        return local_json_constraints(self._local_tokenizer, opener, prompt_length, batch_size)
+
+    @staticmethod
+    def _sampling_kwargs(temperature):
+        """generate() kwargs for a temperature: 0 means greedy, since sampling rejects temperature=0."""
+        if temperature and temperature > 0:
+            return {'do_sample': True, 'temperature': temperature, 'top_p': 0.9}
+        return {'do_sample': False}
+
+    def _generate_local_batch(self, prompts, max_new_tokens, temperature, response_format=None):
+        """Runs on the inference worker thread, which is the only caller of model.generate()."""
         self._load_local_model()
         if not self._local_model:
-            return MockResponse("Error: All AI models offline.")
+            return [MockResponse("Error: All AI models offline.", is_error=True) for _ in prompts]
+
+        # Rows sharing a registered prefix are generated together on top of its cached KV
+        results = [None] * len(prompts)
+        groups = {}
+        for i, prompt in enumerate(prompts):
+            groups.setdefault(self._prefix_cache.match(prompt), []).append(i)
+        for prefix, indexes in groups.items():
+            if prefix is None:
+                continue
+            responses = self._generate_local_with_prefix(
+                prefix, [prompts[i] for i in indexes], max_new_tokens, temperature, response_format
+            )
+            for i, response in zip(indexes, responses):
+                results[i] = response
 
+        rest = [i for i, response in enumerate(results) if response is None]
+        if rest:
+            responses = self._generate_local_plain([prompts[i] for i in rest], max_new_tokens, temperature,
+                                                   response_format)
+            for i, response in zip(rest, responses):
+                results[i] = response
+        return results
+
+    def _generate_local_plain(self, prompts, max_new_tokens, temperature, response_format=None):
+        """One padded generate() over the full prompts."""
         try:
-            inputs = self._local_tokenizer(prompt, return_tensors="pt").to(self._device)
+            inputs = self._local_tokenizer(prompts, return_tensors="pt", padding=True).to(self._device)
             with torch.no_grad():
                 outputs = self._local_model.generate(
                     **inputs,
                     max_new_tokens=max_new_tokens,
-                    temperature=temperature,
-                    top_p=0.9,
-                    do_sample=True,
-                    pad_token_id=self._local_tokenizer.eos_token_id
+                    **self._sampling_kwargs(temperature),
+                    pad_token_id=self._local_tokenizer.pad_token_id,
+                    **self._json_constraints(response_format, inputs["input_ids"].shape[1], len(prompts))
                 )
             
+            # Left padding means every row's prompt ends at the same column
             input_length = inputs["input_ids"].shape[1]
-            generated_tokens = outputs[0][input_length:]
-            result_text = self._local_tokenizer.decode(generated_tokens, skip_special_tokens=True)
-            return MockResponse(result_text)
+            return [
+                MockResponse(self._local_tokenizer.decode(row[input_length:], skip_special_tokens=True), provider='local')
+                for row in outputs
+            ]
         except Exception as e:
-            return MockResponse(f"Error: {str(e)}")
+            return [MockResponse(f"Error: {str(e)}", is_error=True) for _ in prompts]
+
+    def register_prompt_prefix(self, prefix):
+        """Declare fixed leading prompt text whose KV cache the local model may reuse."""
+        self._prefix_cache.register(prefix)
+
+    def _compute_prefix_kv(self, prefix):
+        prefix_ids = self._local_tokenizer(prefix, return_tensors="pt")["input_ids"].to(self._device)
+        with torch.no_grad():
+            outputs = self._local_model(input_ids=prefix_ids, use_cache=True)
+        return prefix_ids, outputs.past_key_values
+
+    @staticmethod
+    def _expand_past(past_key_values, batch_size):
+        """Copy of a cached prefix KV with its batch dimension repeated; generate() extends caches in place."""
+        past = copy.deepcopy(past_key_values)
+        if batch_size == 1:
+            return past
+        if hasattr(past, 'batch_repeat_interleave'):
+            past.batch_repeat_interleave(batch_size)
+            return past
+        # Legacy tuple-of-tuples cache
+        return tuple(tuple(t.repeat_interleave(batch_size, dim=0) for t in layer) for layer in past)
+
+    def _prefix_inputs(self, prefix, prompts):
+        """
+        generate() inputs that reuse the cached KV of `prefix` for every prompt that fits it.
+        Each row is the prefix tokens followed by its own suffix, suffixes left-padded to a common
+        length. The padding sits between prefix and suffix and is masked out; generate() derives
+        position ids from the attention mask, so every suffix continues right after the prefix.
+        Returns (rows, inputs, prefix_length) where rows indexes the prompts that fit, or None.
+        """
+        prefix_ids, past_key_values = self._prefix_cache.get(prefix, self._compute_prefix_kv)
+        prefix_length = prefix_ids.shape[1]
+        rows, suffixes = [], []
+        for row, prompt in enumerate(prompts):
+            ids = self._local_tokenizer(prompt, return_tensors="pt")["input_ids"][0].to(self._device)
+            # BPE can merge across the prefix/suffix boundary; only reuse the cache when the
+            # prompt tokenizes to exactly the cached prefix tokens followed by more tokens
+            if ids.shape[0] <= prefix_length or not torch.equal(ids[:prefix_length], prefix_ids[0]):
+                self._prefix_cache.record_boundary_mismatch()
+                continue
+            rows.append(row)
+            suffixes.append(ids[prefix_length:])
+        if not rows:
+            return None
+
+        width = prefix_length + max(len(suffix) for suffix in suffixes)
+        input_ids = torch.full((len(rows), width), self._local_tokenizer.pad_token_id,
+                               dtype=prefix_ids.dtype, device=self._device)
+        attention_mask = torch.zeros_like(input_ids)
+        input_ids[:, :prefix_length] = prefix_ids[0]
+        attention_mask[:, :prefix_length] = 1
+        for i, suffix in enumerate(suffixes):
+            input_ids[i, width - len(suffix):] = suffix
+            attention_mask[i, width - len(suffix):] = 1
+        inputs = {
+            'input_ids': input_ids,
+            'attention_mask': attention_mask,
+            'past_key_values': self._expand_past(past_key_values, len(rows)),
+        }
+        return rows, inputs, prefix_length
+
+    def _generate_local_with_prefix(self, prefix, prompts, max_new_tokens, temperature, response_format=None):
+        """
+        Generate prompts that all start with `prefix` in one batch on top of its cached
+        past_key_values, so only the variable suffixes are prefilled. Returns one response per
+        prompt, None where the caller should take the normal path instead.
+        """
+        results = [None] * len(prompts)
+        try:
+            prepared = self._prefix_inputs(prefix, prompts)
+            if prepared is None:
+                return results
+            rows, inputs, prefix_length = prepared
+            input_length = inputs['input_ids'].shape[1]
+            with torch.no_grad():
+                outputs = self._local_model.generate(
+                    **inputs,
+                    max_new_tokens=max_new_tokens,
+                    **self._sampling_kwargs(temperature),
+                    pad_token_id=self._local_tokenizer.pad_token_id,
+                    **self._json_constraints(response_format, input_length, len(rows))
+                )
+            self._prefix_cache.record_saved_tokens(prefix_length * len(rows))
+            for row, output in zip(rows, outputs):
+                results[row] = MockResponse(
+                    self._local_tokenizer.decode(output[input_length:], skip_special_tokens=True), provider='local'
+                )
+        except Exception as e:
+            print(f"⚠️ ML Service: Prefix cache path failed, running full prefill: {e}")
+            return [None] * len(prompts)
+        return results
+
+    def generate_stream(self, prompt, max_new_tokens=1024, temperature=0.7, use_cache=True, priority='standard'):
+        """Streaming variant of generate_content. Yields text chunks as they arrive.
+
+        Provider order matches generate_content. A provider that fails before sending any
+        text is skipped; once text has been yielded the stream cannot switch providers, so a
+        mid-stream failure just ends it. Only complete streams are written to the cache.
+        """
+        cache_key = self._cache_key(prompt, max_new_tokens, temperature)
+        if use_cache:
+            cached_text = self._cache.get(cache_key)
+            if cached_text is not None:
+                yield cached_text
+                return
+        else:
+            self._cache.record_bypass()
+
+        deadline = wait_deadline(priority)
+        shed = None
+        for name, stream_fn in self._stream_providers():
+            breaker = self._breakers.get(name)
+            if breaker and not breaker.allow_request():
+                continue
+            label = breaker.name if breaker else 'Local'
+            if not breaker and shed is not None and priority != 'interactive':
+                # Shed non-interactive work fails fast rather than piling onto the CPU model
+                raise shed
+            if breaker:
+                try:
+                    self._limiters[name].acquire(priority, deadline)
+                except RateLimitExceeded as e:
+                    print(f"⚠️ {label} stream shed: {e}. Falling back.")
+                    shed = e
+                    continue
+            chunks = []
+            started = time.monotonic()
+            try:
+                for chunk in stream_fn(prompt, max_new_tokens, temperature):
+                    if chunk:
+                        chunks.append(chunk)
+                        yield chunk
+            except Exception as e:
+                if breaker:
+                    self._record_provider_failure(name, time.monotonic() - started, e)
+                if chunks:
+                    print(f"⚠️ {label} stream interrupted: {e}")
+                    return
+                print(f"⚠️ {label} stream failed: {e}. Falling back.")
+                continue
+            if chunks:
+                if breaker:
+                    breaker.record_success(time.monotonic() - started)
+                self._cache.set(cache_key, "".join(chunks))
+                return
+            print(f"⚠️ {label} stream returned no text. Falling back.")
+
+        if shed is not None and priority != 'interactive':
+            raise shed
+        yield "Error: All AI models offline."
+
+    def _stream_providers(self):
+        if self._use_stub:
+            return [('stub', self._stub.stream)]
+        providers = []
+        if self._use_openrouter:
+            providers.append(('openrouter', self._stream_openrouter))
+        if self._use_gemini:
+            providers.append(('gemini', self._stream_gemini))
+        providers.append(('local', self._stream_local))
+        return providers
+
+    def _stream_openrouter(self, prompt, max_new_tokens, temperature):
+        response = self._openrouter_request(prompt, max_new_tokens, temperature, stream=True)
+        try:
+            for line in response.iter_lines(decode_unicode=True):
+                # SSE: skip keep-alive comments (": OPENROUTER PROCESSING") and blank lines
+                if not line or not line.startswith('data:'):
+                    continue
+                data = line[len('data:'):].strip()
+                if data == '[DONE]':
+                    break
+                delta = json.loads(data)['choices'][0].get('delta', {}).get('content')
+                if delta:
+                    yield delta
+        finally:
+            response.close()
+
+    def _stream_gemini(self, prompt, max_new_tokens, temperature):
+        model = genai.GenerativeModel(self.GEMINI_MODEL)
+        response = model.generate_content(
+            prompt,
+            generation_config=genai.types.GenerationConfig(
+                max_output_tokens=max_new_tokens,
+                temperature=temperature
+            ),
+            stream=True
+        )
+        for chunk in response:
+            yield chunk.text
+
+    def _stream_local(self, prompt, max_new_tokens, temperature):
+        from transformers import TextIteratorStreamer
+
+        self._load_local_model()
+        if not self._local_model:
+            raise RuntimeError("Local model unavailable")
+
+        streamer = TextIteratorStreamer(self._local_tokenizer, skip_prompt=True, skip_special_tokens=True)
+        done = self._get_local_worker().submit_stream(prompt, max_new_tokens, temperature, streamer)
+        for text in streamer:
+            yield text
+        # Surface generation errors raised on the worker thread
+        done.result()
+
+    def _generate_local_into_streamer(self, prompt, max_new_tokens, temperature, streamer):
+        """Runs on the inference worker thread; the caller consumes the streamer."""
+        inputs = None
+        prefix = self._prefix_cache.match(prompt)
+        if prefix is not None:
+            try:
+                prepared = self._prefix_inputs(prefix, [prompt])
+            except Exception as e:
+                print(f"⚠️ ML Service: Prefix cache path failed, running full prefill: {e}")
+                prepared = None
+            if prepared is not None:
+                _, inputs, prefix_length = prepared
+                self._prefix_cache.record_saved_tokens(prefix_length)
+        if inputs is None:
+            inputs = self._local_tokenizer(prompt, return_tensors="pt").to(self._device)
+        with torch.no_grad():
+            self._local_model.generate(
+                **inputs,
+                max_new_tokens=max_new_tokens,
+                **self._sampling_kwargs(temperature),
+                pad_token_id=self._local_tokenizer.pad_token_id,
+                streamer=streamer
+            )
+
+    def warmup_local_model(self):
+        """Load the local model and run a one-token generation so kernels are allocated before traffic."""
+        if self._use_stub:
+            return
+        self._load_local_model()
+        if not self._local_model:
+            raise RuntimeError("Local model failed to load")
+        response = self._get_local_worker().generate("Hello", 1, 0.7)
+        if response.is_error:
+            raise RuntimeError(response.text)
+
+    def get_cache_stats(self):
+        return self._cache.get_stats()
+
+    def get_coalescing_stats(self):
+        return self._inflight.get_stats()
+
+    def get_rate_limit_stats(self):
+        return {name: limiter.get_stats() for name, limiter in self._limiters.items()}
+
+    def get_hedge_stats(self):
+        with self._stats_lock:
+            stats = dict(self._hedge_stats)
+        stats['hedge_rate'] = round(stats['hedged'] / stats['requests'], 3) if stats['requests'] else 0.0
+        stats['delay_seconds'] = {
+            name: round(self._hedge_delay(name), 3) for name, _ in self._cloud_providers()
+        }
+        return stats
+
+    def get_provider_status(self):
+        enabled = {'openrouter': self._use_openrouter, 'gemini': self._use_gemini, 'stub': self._use_stub}
+        status = {
+            name: dict(breaker.get_status(), enabled=enabled[name])
+            for name, breaker in self._breakers.items()
+        }
+        if self._use_stub:
+            status['stub'].update(simulation=self._stub.get_stats())
+        return status
+
+    def get_local_inference_stats(self):
+        if self._local_worker is None:
+            return {'status': 'idle', 'model': self._local_model_info, 'prefix_cache': self._prefix_cache.get_stats()}
+        return dict(self._local_worker.get_stats(), model=self._local_model_info, prefix_cache=self._prefix_cache.get_stats())
+
+    def generate_json(self, prompt, schema, max_new_tokens=1024, temperature=0.3, use_cache=True, repair=True,
+                      priority='standard'):
+        """Structured-output generation. Returns the parsed JSON value, validated against schema.
+
+        Uses provider JSON modes (OpenRouter json_object, Gemini application/json) and
+        constrained decoding on the local model. Output is parsed with a single-pass tolerant
+        extractor; if it still fails validation, one targeted repair call is made before
+        giving up with JSONGenerationError.
+        """
+        container = schema_container(schema)
+        response_format = {'{': 'json_object', '[': 'json_array'}.get(container)
+        response = self.generate_content(
+            prompt, max_new_tokens=max_new_tokens, temperature=temperature,
+            use_cache=use_cache, response_format=response_format, priority=priority
+        )
+        return self.json_from_response(response, schema, max_new_tokens=max_new_tokens, repair=repair, priority=priority)
+
+    def json_from_response(self, response, schema, max_new_tokens=1024, repair=True, priority='standard'):
+        """Parse and validate a response from generate_content/generate_many (see generate_json)."""
+        if response.is_error:
+            raise JSONGenerationError(response.text, raw_text=response.text)
+
+        data, errors = self.parse_json_output(response.text, schema)
+        if not errors:
+            return data
+
+        # Never serve an output that failed validation from the cache again
+        self._cache.delete(response.cache_key)
+        if not repair:
+            raise JSONGenerationError(f"Invalid JSON output: {'; '.join(errors[:3])}", raw_text=response.text, errors=errors)
+        return self.repair_json(response.text, schema, errors, max_new_tokens=max_new_tokens, priority=priority)
+
+    def parse_json_output(self, text, schema):
+        """Returns (data, errors); errors is empty when text held a value valid against schema."""
+        try:
+            data = extract_json(text, expect=schema_container(schema))
+        except ValueError as e:
+            return None, [str(e)]
+        return data, validate_schema(data, schema)
+
+    def repair_json(self, raw_text, schema, errors, max_new_tokens=1024, priority='standard'):
+        """One cheap, deterministic repair attempt for output that failed parsing or validation."""
+        with self._stats_lock:
+            self._json_stats['repairs'] += 1
+        container = schema_container(schema)
+        response = self.generate_content(
+            build_repair_prompt(raw_text, schema, errors),
+            max_new_tokens=max_new_tokens,
+            temperature=0.0,
+            use_cache=False,
+            response_format={'{': 'json_object', '[': 'json_array'}.get(container),
+            priority=priority
+        )
+        data, repair_errors = self.parse_json_output(response.text, schema)
+        if response.is_error or repair_errors:
+            with self._stats_lock:
+                self._json_stats['repair_failures'] += 1
+            raise JSONGenerationError(
+                f"Invalid JSON output after repair: {'; '.join((repair_errors or errors)[:3])}",
+                raw_text=raw_text, errors=repair_errors or errors
+            )
+        return data
+
+    def get_json_stats(self):
+        with self._stats_lock:
+            return dict(self._json_stats)
 
     @staticmethod
     def clean_json_response(text):
         """Robustly extracts JSON from AI markdown response."""
         if not text:
             return "{}"
-        
-        try:
-            # 1. Remove markdown code blocks
-            text = re.sub(r'```(?:json)?\s*', '', text)
-            text = re.sub(r'\s*```', '', text)
-            
-            # 2. Find the first '{' and last '}' or first '[' and last ']'
-            start_brace = text.find('{')
-            end_brace = text.rfind('}')
-            
-            start_bracket = text.find('[')
-            end_bracket = text.rfind(']')
-            
-            # Decide which one is the outer container
-            if start_brace != -1 and (start_bracket == -1 or start_brace < start_bracket):
-                if end_brace != -1:
-                    return text[start_brace:end_brace+1].strip()
-            elif start_bracket != -1:
-                if end_bracket != -1:
-                    return text[start_bracket:end_bracket+1].strip()
-            
-            return text.strip()
-        except:
-            return text.strip()
+        span = extract_json_span(text)
+        return span if span is not None else text.strip()
 
 class MockResponse:
-    def __init__(self, text):
+    def __init__(self, text, provider=None, cached=False, is_error=False):
         self.text = text
+        self.provider = provider
+        self.cached = cached
+        self.is_error = is_error
+        self.cache_key = None
 
 llm_service = MultiLLMService.get_instance()
 
 def get_zero_shot_intent(text, candidate_labels):
+    """Embedding classifier first; the LLM is only asked when the classifier is unsure."""
+    from intent_classifier import intent_classifier
+    try:
+        label, confidence = intent_classifier.classify(text, candidate_labels)
+        if confidence >= intent_classifier.threshold:
+            intent_classifier.record('confident')
+            return label, confidence
+        intent_classifier.record('llm_fallbacks')
+    except Exception as e:
+        print(f"⚠️ Intent classifier unavailable: {e}. Using LLM.")
+        intent_classifier.record('errors')
+    return get_llm_intent(text, candidate_labels)
+
+def get_llm_intent(text, candidate_labels, use_cache=True, hedge=True):
     prompt = f"Classify this text into one category from {candidate_labels}: \"{text}\". Return ONLY the category name."
-    resp = llm_service.generate_content(prompt, max_new_tokens=20)
+    resp = llm_service.generate_content(prompt, max_new_tokens=20, use_cache=use_cache, hedge=hedge, priority='interactive')
     best_label = resp.text.strip().lower()
     for label in candidate_labels:
         if label.lower() in best_label:
@@ -1,5 +1,6 @@
 from flask_sqlalchemy import SQLAlchemy
 from datetime import datetime
+import json
 import string
 import random
 
@@ -371,3 +372,43 @@ class Note(db.Model):
             'created_at': self.created_at.isoformat(),
             'updated_at': self.updated_at.isoformat()
         }
+
+class Job(db.Model):
+    """Durable background job for long-running generation endpoints"""
+    __tablename__ = 'jobs'
+    
+    job_id = db.Column(db.String(32), primary_key=True) # uuid4 hex
+    student_id = db.Column(db.String(20), db.ForeignKey('users.student_id'), nullable=False)
+    job_type = db.Column(db.String(50), nullable=False) # create_course, generate_notes, generate_quiz
+    status = db.Column(db.String(20), default='queued', index=True) # queued, running, succeeded, failed, cancelled
+    payload = db.Column(db.Text) # JSON arguments
+    result = db.Column(db.Text) # JSON response body
+    result_code = db.Column(db.Integer) # HTTP status the synchronous endpoint would have returned
+    error = db.Column(db.Text)
+    progress = db.Column(db.Integer, default=0) # 0-100
+    progress_message = db.Column(db.String(200))
+    attempts = db.Column(db.Integer, default=0)
+    max_attempts = db.Column(db.Integer, default=2)
+    cancel_requested = db.Column(db.Boolean, default=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    def to_dict(self):
+        return {
+            'job_id': self.job_id,
+            'job_type': self.job_type,
+            'status': self.status,
+            'progress': self.progress,
+            'progress_message': self.progress_message,
+            'result': json.loads(self.result) if self.result else None,
+            'result_code': self.result_code,
+            'error': self.error,
+            'attempts': self.attempts,
+            'max_attempts': self.max_attempts,
+            'cancel_requested': self.cancel_requested,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None
+        }
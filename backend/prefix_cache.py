@@ -0,0 +1,72 @@
+import os
+import threading
+from collections import OrderedDict
+
+# Bounded LRU of precomputed past_key_values for registered prompt prefixes on the local model.
+# Callers register the fixed instruction text their prompts start with; a prompt that begins
+# with a registered prefix only needs its variable suffix prefilled.
+LOCAL_PREFIX_CACHE_ENTRIES = int(os.getenv('LOCAL_PREFIX_CACHE_ENTRIES', 8))
+
+
+class PrefixKVCache:
+    def __init__(self, max_entries=LOCAL_PREFIX_CACHE_ENTRIES):
+        self.max_entries = max_entries
+        self._prefixes = []
+        self._entries = OrderedDict()  # prefix -> (prefix_input_ids, past_key_values)
+        self._lock = threading.Lock()
+        self.stats = {'lookups': 0, 'hits': 0, 'misses': 0, 'unmatched': 0,
+                      'boundary_mismatches': 0, 'evictions': 0, 'prefill_tokens_saved': 0}
+
+    def register(self, prefix):
+        if not prefix:
+            return
+        with self._lock:
+            if prefix not in self._prefixes:
+                self._prefixes.append(prefix)
+                # Longest first so the most specific prefix wins
+                self._prefixes.sort(key=len, reverse=True)
+
+    def match(self, prompt):
+        with self._lock:
+            self.stats['lookups'] += 1
+            for prefix in self._prefixes:
+                if prompt.startswith(prefix) and len(prompt) > len(prefix):
+                    return prefix
+            self.stats['unmatched'] += 1
+        return None
+
+    def get(self, prefix, compute):
+        """Return (prefix_input_ids, past_key_values), computing and storing them on a miss."""
+        with self._lock:
+            entry = self._entries.get(prefix)
+            if entry is not None:
+                self._entries.move_to_end(prefix)
+                self.stats['hits'] += 1
+                return entry
+            self.stats['misses'] += 1
+
+        entry = compute(prefix)
+        with self._lock:
+            self._entries[prefix] = entry
+            self._entries.move_to_end(prefix)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.stats['evictions'] += 1
+        return entry
+
+    def record_saved_tokens(self, count):
+        with self._lock:
+            self.stats['prefill_tokens_saved'] += count
+
+    def record_boundary_mismatch(self):
+        with self._lock:
+            self.stats['boundary_mismatches'] += 1
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self.stats)
+            stats['registered_prefixes'] = len(self._prefixes)
+            stats['cached_prefixes'] = len(self._entries)
+        matched = stats['hits'] + stats['misses']
+        stats['hit_rate'] = round(stats['hits'] / matched, 3) if matched else 0.0
+        return stats
@@ -6,29 +6,111 @@ import json
 import random
 import os
 import requests
+from job_queue import submit_job, register_job, JobCancelled
+from rate_limiter import RateLimitExceeded, sync_wait_limit
+from topic_index import topic_index
+from video_resolver import enqueue_video_resolution
 
 quiz_bp = Blueprint('quiz', __name__)
 GOOGLE_API_KEY = os.getenv('GOOGLE_API_KEY')
 
+# Fixed generation instructions lead the prompt so the local model can reuse their KV cache;
+# the topic-specific subject block is appended after them.
+QUIZ_PROMPT_PREFIX = """
+You are creating a HIGH-QUALITY ACADEMIC CONCEPTUAL ASSESSMENT for the topic described under ASSESSMENT SUBJECT below.
+
+CRITICAL REQUIREMENTS:
+- Generate EXACTLY 5 Conceptual Reasoning Questions.
+- These questions should NOT have options. They are open-ended assessments of understanding.
+- Questions must be CHALLENGING and focus on "HOW" and "WHY" rather than "WHAT".
+- For each question, provide a "Model Correct Answer" which is a detailed step-by-step reasoning that explains the fundamental principles.
+- The goal is to force the student to explain the underlying logic in their own words.
+
+Output ONLY a valid JSON array of objects:
+[
+  {
+    "question": "The complex conceptual reasoning question here?",
+    "correct_answer": "Detailed model reasoning that the student's answer should match in principle",
+    "explanation": "Pedagogical goal of this question",
+    "type": "conceptual"
+  },
+  ... (generate exactly 5 items) ...
+]
+
+IMPORTANT: 
+- Focus on synthesis and application of concepts
+- Output ONLY the JSON array, no other text
+"""
+
+# Loose on purpose: the question loop below accepts several key spellings per field
+QUIZ_QUESTIONS_SCHEMA = {
+    'type': 'array',
+    'minItems': 1,
+    'items': {'type': 'object'}
+}
+
+REMEDIAL_PATH_SCHEMA = {
+    'type': 'array',
+    'minItems': 1,
+    'items': {
+        'type': 'object',
+        'required': ['title', 'description', 'duration'],
+        'properties': {
+            'title': {'type': 'string'},
+            'description': {'type': 'string'},
+            'duration': {'type': 'integer'}
+        }
+    }
+}
+
+try:
+    from ml_service import llm_service as _llm_service
+    _llm_service.register_prompt_prefix(QUIZ_PROMPT_PREFIX)
+except ImportError:
+    pass
+
 @quiz_bp.route('/generate/<int:topic_id>', methods=['POST'])
 @jwt_required()
 def generate_quiz(topic_id):
     """
     Generate or retrieve a quiz for a topic.
     """
+    with sync_wait_limit():
+        body, status = generate_quiz_for_topic(topic_id)
+    return jsonify(body), status
+
+@quiz_bp.route('/generate/<int:topic_id>/async', methods=['POST'])
+@jwt_required()
+def generate_quiz_async(topic_id):
+    """Background-job variant of /generate/<topic_id>; poll /api/jobs/<job_id> for the quiz."""
+    if not Topic.query.get(topic_id):
+        return jsonify({'error': 'Topic not found'}), 404
+    job = submit_job(get_jwt_identity(), 'generate_quiz', {'topic_id': topic_id})
+    return jsonify({'job_id': job.job_id, 'status': job.status, 'status_url': f"/api/jobs/{job.job_id}"}), 202
+
+@register_job('generate_quiz')
+def _generate_quiz_job(student_id, payload, progress):
+    return generate_quiz_for_topic(payload.get('topic_id'), progress)
+
+def generate_quiz_for_topic(topic_id, progress=None):
+    """Shared by the synchronous endpoint and the job worker. Returns (body, status_code)."""
+    progress = progress or (lambda percent, message=None: None)
     topic = Topic.query.get(topic_id)
     if not topic:
-        return jsonify({'error': 'Topic not found'}), 404
+        return {'error': 'Topic not found'}, 404
 
     # Check if quiz already exists and HAS questions with options
     quiz = Quiz.query.filter_by(topic_id=topic_id).first()
     
     should_generate = False
+    # A re-generation means the previous output was unusable, so skip the prompt cache
+    bypass_cache = False
     if not quiz:
         should_generate = True
     elif not quiz.questions:
         print(f"DEBUG: Quiz {quiz.quiz_id} exists but has no questions. Generating...")
         should_generate = True
+        bypass_cache = True
     else:
         # Check if ANY question is missing options (for MCQ/TrueFalse)
         has_empty_options = any(
@@ -42,6 +124,7 @@ def generate_quiz(topic_id):
                 db.session.delete(q)
             db.session.commit()
             should_generate = True
+            bypass_cache = True
 
     if should_generate:
         if not quiz:
@@ -55,84 +138,28 @@ def generate_quiz(topic_id):
         
         # AI Question Generation
         try:
+            progress(10, 'Writing questions')
             from ml_service import llm_service
             
             # Define simplified question types for stability
             course_title = topic.course.title if topic.course else "General Knowledge"
             context_material = topic.description if topic.description else f"{topic.title} in the context of {course_title}"
             
-            prompt = f"""
-You are creating a HIGH-QUALITY ACADEMIC CONCEPTUAL ASSESSMENT for: "{topic.title}"
+            prompt = QUIZ_PROMPT_PREFIX + f"""
+ASSESSMENT SUBJECT:
+Topic: "{topic.title}"
 Course: "{course_title}"
 
 Source Material:
 {topic.description}
-
-CRITICAL REQUIREMENTS:
-- Generate EXACTLY 5 Conceptual Reasoning Questions.
-- These questions should NOT have options. They are open-ended assessments of understanding.
-- Questions must be CHALLENGING and focus on "HOW" and "WHY" rather than "WHAT".
-- For each question, provide a "Model Correct Answer" which is a detailed step-by-step reasoning that explains the fundamental principles.
-- The goal is to force the student to explain the underlying logic in their own words.
-
-Output ONLY a valid JSON array of objects:
-[
-  {{
-    "question": "The complex conceptual reasoning question here?",
-    "correct_answer": "Detailed model reasoning that the student's answer should match in principle",
-    "explanation": "Pedagogical goal of this question",
-    "type": "conceptual"
-  }},
-  ... (generate exactly 5 items) ...
-]
-
-IMPORTANT: 
-- Focus on synthesis and application of concepts
-- Output ONLY the JSON array, no other text
 """
             
-            response = llm_service.generate_content(prompt, max_new_tokens=3000)
-            text_resp = response.text.strip()
-            print(f"DEBUG: AI Raw Response: {text_resp[:100]}...")
-
-            def extract_json_array(text):
-                """Robustly find JSON array by searching backwards from the end"""
-                text = text.strip()
-                start = text.find('[')
-                if start == -1: return None
-                
-                # Find all closing brackets after the start
-                end_candidates = [i for i, char in enumerate(text) if char == ']' and i > start]
-                
-                # Try from the last closing bracket backwards
-                for end in reversed(end_candidates):
-                    candidate = text[start:end+1]
-                    try:
-                        return json.loads(candidate)
-                    except:
-                        continue
-                return None
-
-            questions_data = extract_json_array(text_resp)
-            
-            if not questions_data:
-                # Fallback: Try cleaning markdown code blocks explicitly
-                clean_text = text_resp.replace('```json', '').replace('```', '').strip()
-                try:
-                    questions_data = json.loads(clean_text)
-                except:
-                     # One last try with loose parsing (finding first [ and last ])
-                     # This was the old way, but maybe useful as last resort if strict parser failed
-                    try:
-                        import re
-                        m = re.search(r'\[.*\]', text_resp, re.DOTALL)
-                        if m: questions_data = json.loads(m.group(0))
-                    except:
-                        pass
-            
-            if not questions_data:
-                 raise ValueError("Could not extract JSON from AI response")
+            questions_data = llm_service.generate_json(
+                prompt, QUIZ_QUESTIONS_SCHEMA, max_new_tokens=3000, temperature=0.7, use_cache=not bypass_cache,
+                priority='background'
+            )
 
+            progress(80, 'Saving questions')
             for q_data in questions_data:
                 # robust key extraction
                 raw_type = q_data.get('question_type', q_data.get('type', 'mcq')).lower()
@@ -182,6 +209,14 @@ IMPORTANT:
             
             db.session.commit()
             
+        except JobCancelled:
+            db.session.rollback()
+            raise
+        except RateLimitExceeded as e:
+            # Shed, not failed: leave the quiz empty so the next request (or job retry) generates it
+            db.session.rollback()
+            print(f"Quiz AI Generation Shed: {e}")
+            return {'error': 'AI providers are busy, please try again shortly'}, 503
         except Exception as e:
             print(f"Quiz AI Generation Failed: {e}")
             import traceback
@@ -233,11 +268,11 @@ IMPORTANT:
             'reasoning_required': q.reasoning_required
         })
         
-    return jsonify({
+    return {
         'quiz_id': quiz.quiz_id,
         'title': quiz.title,
         'questions': questions_data
-    })
+    }, 200
 
 @quiz_bp.route('/submit/<int:quiz_id>', methods=['POST'])
 @jwt_required()
@@ -275,27 +310,29 @@ def submit_quiz(quiz_id):
     feedback_details = {}
     misconceptions = []
     
-    from reasoning_analyzer import analyze_reasoning
+    from reasoning_analyzer import analyze_reasoning_batch
     
-    for question in quiz.questions:
+    # Reasoning Analysis: grade every answer in one concurrent batch instead of N serial calls
+    analyses = analyze_reasoning_batch([
+        (
+            question.question_text,
+            question.correct_answer,
+            submitted_answers.get(str(question.question_id)),
+            submitted_reasoning.get(str(question.question_id), "")
+        )
+        for question in quiz.questions
+    ])
+    
+    for question, analysis in zip(quiz.questions, analyses):
         max_score += question.points
         q_id = str(question.question_id)
         user_answer = submitted_answers.get(q_id)
-        user_reason = submitted_reasoning.get(q_id, "")
         
         # Grading
         is_correct = False
         if question.question_type in ['mcq', 'true_false']:
             is_correct = (user_answer == question.correct_answer)
         
-        # Reasoning Analysis
-        analysis = analyze_reasoning(
-            question.question_text, 
-            question.correct_answer, 
-            user_answer, 
-            user_reason
-        )
-        
         # Scoring logic for conceptual questions (Pure reasoning 0-10)
         points_awarded = 0
         if question.question_type == 'conceptual':
@@ -351,6 +388,7 @@ def submit_quiz(quiz_id):
     
     # Logic for Passed/Failed
     from models import Task, TopicResource
+    topics_needing_videos = []
     
     if passed:
         # Unlock Next Topic / Module
@@ -364,12 +402,9 @@ def submit_quiz(quiz_id):
             next_topic.is_unlocked = True
             print(f"DEBUG: Unlocked next topic: {next_topic.title}")
             
-            # Feature: Next Module Video Suggestion
-            from video_recommender import get_video_for_topic
+            # Feature: Next Module Video Suggestion (resolved in the background after commit)
             if not next_topic.youtube_video_id:
-                course = Course.query.get(topic.course_id)
-                v = get_video_for_topic(next_topic.title, course.title if course else "")
-                if v: next_topic.youtube_video_id = v['youtube_id']
+                topics_needing_videos.append(next_topic)
 
         # Auto-assign creative task (existing logic)
         existing_task = Task.query.filter_by(
@@ -424,9 +459,8 @@ def submit_quiz(quiz_id):
                 ]
                 """
                 
-                response = llm_service.generate_content(prompt)
-                text_resp = llm_service.clean_json_response(response.text)
-                remedial_steps = json.loads(text_resp)
+                with sync_wait_limit():
+                    remedial_steps = llm_service.generate_json(prompt, REMEDIAL_PATH_SCHEMA, temperature=0.7)
                 
                 # Shift sequence of all upcoming topics
                 upcoming = Topic.query.filter(
@@ -436,8 +470,8 @@ def submit_quiz(quiz_id):
                 for u in upcoming:
                     u.sequence_order += len(remedial_steps)
                 
-                # Insert new remedial topics
-                from video_recommender import get_video_for_topic
+                # Insert new remedial topics (their videos are resolved in the background)
+                new_topics = []
                 for i, step in enumerate(remedial_steps):
                     new_t = Topic(
                         course_id=topic.course_id,
@@ -448,18 +482,19 @@ def submit_quiz(quiz_id):
                         estimated_duration_minutes=step['duration'],
                         is_unlocked=(i == 0) # Unlock the first remedial topic immediately
                     )
-                    # Video for remedial
-                    v = get_video_for_topic(new_t.title, topic.title)
-                    if v: new_t.youtube_video_id = v['youtube_id']
-                    
                     db.session.add(new_t)
+                    new_topics.append(new_t)
                 
                 db.session.commit()
+                topic_index.add_topics(new_topics)
+                topics_needing_videos.extend(new_topics)
                 
             except Exception as e:
                 print(f"Adaptive Path Error: {e}")
 
     db.session.commit()
+    if topics_needing_videos:
+        enqueue_video_resolution([t.topic_id for t in topics_needing_videos])
     
     # Fetch next topic info for immediate suggestion
     next_topic = Topic.query.filter(Topic.course_id == topic.course_id, Topic.sequence_order > topic.sequence_order).order_by(Topic.sequence_order.asc()).first()
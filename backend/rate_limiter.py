@@ -0,0 +1,190 @@
+import os
+import time
+import heapq
+import itertools
+import threading
+import contextvars
+from contextlib import contextmanager
+
+# Per-provider token-bucket rate limiting with priority classes for upstream LLM calls.
+# Callers wait in a bounded priority queue (interactive before standard before background);
+# when the queue is full the lowest-priority waiter is shed with RateLimitExceeded, so
+# saturation and provider 429s land on bulk work instead of a student waiting on a chat reply.
+PRIORITIES = ('interactive', 'standard', 'background')
+PRIORITY_RANK = {name: rank for rank, name in enumerate(PRIORITIES)}
+
+LLM_RATE_QUEUE_SIZE = int(os.getenv('LLM_RATE_QUEUE_SIZE', 32))
+LLM_RATE_PENALTY_SECONDS = float(os.getenv('LLM_RATE_PENALTY_SECONDS', 10))
+LLM_RATE_MAX_WAIT_SECONDS = {
+    'interactive': float(os.getenv('LLM_RATE_MAX_WAIT_INTERACTIVE', 10)),
+    'standard': float(os.getenv('LLM_RATE_MAX_WAIT_STANDARD', 30)),
+    'background': float(os.getenv('LLM_RATE_MAX_WAIT_BACKGROUND', 120)),
+}
+# Total wait allowed to LLM calls made while an HTTP request is held open (see sync_wait_limit)
+LLM_RATE_MAX_WAIT_SYNC = float(os.getenv('LLM_RATE_MAX_WAIT_SYNC', 15))
+
+_wait_limit = contextvars.ContextVar('llm_rate_wait_limit', default=None)
+
+
+def provider_limits(name, default_rps=2.0, default_burst=5):
+    """(requests per second, burst) for a provider, from LLM_RATE_<NAME>_RPS / _BURST."""
+    prefix = f"LLM_RATE_{name.upper()}"
+    return float(os.getenv(f"{prefix}_RPS", default_rps)), int(os.getenv(f"{prefix}_BURST", default_burst))
+
+
+@contextmanager
+def sync_wait_limit(seconds=LLM_RATE_MAX_WAIT_SYNC):
+    """
+    Cap how long LLM calls made inside the block may queue for tokens, whatever their priority.
+    Synchronous endpoints wrap their generation in this so a background-priority call cannot
+    hold a web worker for the full background wait.
+    """
+    token = _wait_limit.set(seconds)
+    try:
+        yield
+    finally:
+        _wait_limit.reset(token)
+
+
+def wait_deadline(priority):
+    """Monotonic deadline for one generation's token waits, shared across every provider it tries."""
+    max_wait = LLM_RATE_MAX_WAIT_SECONDS[priority]
+    limit = _wait_limit.get()
+    if limit is not None:
+        max_wait = min(max_wait, limit)
+    return time.monotonic() + max_wait
+
+
+class RateLimitExceeded(RuntimeError):
+    """Raised fast when a request is shed instead of queued (queue full, or waited too long)."""
+
+
+class UpstreamRateLimited(RuntimeError):
+    """The provider itself answered 429; retry_after is its requested back-off in seconds."""
+
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class ProviderRateLimiter:
+    def __init__(self, name, rate_per_second, burst, queue_size=LLM_RATE_QUEUE_SIZE,
+                 max_wait=LLM_RATE_MAX_WAIT_SECONDS):
+        self.name = name
+        self.rate = rate_per_second
+        self.burst = burst
+        self.queue_size = queue_size
+        self.max_wait = max_wait
+
+        self._cond = threading.Condition()
+        self._tokens = float(burst)
+        self._refilled_at = time.monotonic()
+        self._paused_until = 0.0
+        self._waiters = []  # heap of (priority rank, arrival seq, ticket)
+        self._seq = itertools.count()
+        self.stats = {p: {'acquired': 0, 'shed': 0, 'timed_out': 0, 'total_wait_ms': 0.0} for p in PRIORITIES}
+        self.penalties = 0
+
+    def _refill(self, now):
+        # Caller holds self._cond
+        self._tokens = min(self.burst, self._tokens + (now - self._refilled_at) * self.rate)
+        self._refilled_at = now
+
+    def _try_take(self, now):
+        # Caller holds self._cond
+        if now < self._paused_until:
+            return False
+        self._refill(now)
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return True
+        return False
+
+    def _next_token_in(self, now):
+        # Caller holds self._cond
+        if now < self._paused_until:
+            return self._paused_until - now
+        return max((1 - self._tokens) / self.rate, 0.001)
+
+    def _shed_lowest_for(self, rank):
+        """Queue is full: evict the newest lowest-priority waiter if it ranks below `rank`."""
+        # Caller holds self._cond
+        victim = max(self._waiters, key=lambda entry: (entry[0], entry[1]))
+        if victim[0] <= rank:
+            return False
+        self._waiters.remove(victim)
+        heapq.heapify(self._waiters)
+        victim[2]['shed'] = True
+        self._cond.notify_all()
+        return True
+
+    def acquire(self, priority='standard', deadline=None):
+        """
+        Block until a request token is granted. Raises RateLimitExceeded when shed.
+        deadline (monotonic) caps the wait further, e.g. a budget shared across providers.
+        """
+        if priority not in PRIORITY_RANK:
+            raise ValueError(f"Unknown priority '{priority}'")
+        rank = PRIORITY_RANK[priority]
+        started = time.monotonic()
+        deadline = min(started + self.max_wait[priority], deadline if deadline is not None else float('inf'))
+
+        with self._cond:
+            if not self._waiters and self._try_take(started):
+                self._granted(priority, started)
+                return
+            if len(self._waiters) >= self.queue_size and not self._shed_lowest_for(rank):
+                self.stats[priority]['shed'] += 1
+                raise RateLimitExceeded(f"{self.name} is saturated; {priority} request shed")
+
+            entry = (rank, next(self._seq), {'shed': False})
+            heapq.heappush(self._waiters, entry)
+            while True:
+                if entry[2]['shed']:
+                    self.stats[priority]['shed'] += 1
+                    raise RateLimitExceeded(f"{self.name} is saturated; {priority} request shed")
+                now = time.monotonic()
+                if self._waiters[0] is entry and self._try_take(now):
+                    heapq.heappop(self._waiters)
+                    self._cond.notify_all()
+                    self._granted(priority, started)
+                    return
+                if now >= deadline:
+                    self._waiters.remove(entry)
+                    heapq.heapify(self._waiters)
+                    self._cond.notify_all()
+                    self.stats[priority]['timed_out'] += 1
+                    raise RateLimitExceeded(f"{self.name} is saturated; {priority} request waited too long")
+                self._cond.wait(min(deadline - now, self._next_token_in(now)))
+
+    def _granted(self, priority, started):
+        # Caller holds self._cond
+        self.stats[priority]['acquired'] += 1
+        self.stats[priority]['total_wait_ms'] += (time.monotonic() - started) * 1000
+
+    def penalize(self, retry_after=None):
+        """The provider returned 429: stop granting tokens for retry_after seconds."""
+        with self._cond:
+            self._tokens = 0.0
+            self._paused_until = max(self._paused_until, time.monotonic() + (retry_after or LLM_RATE_PENALTY_SECONDS))
+            self.penalties += 1
+            self._cond.notify_all()
+
+    def get_stats(self):
+        with self._cond:
+            now = time.monotonic()
+            self._refill(now)
+            stats = {
+                'rate_per_second': self.rate,
+                'burst': self.burst,
+                'tokens': round(self._tokens, 2),
+                'queued': len(self._waiters),
+                'paused_for_seconds': round(max(self._paused_until - now, 0), 1),
+                'penalties': self.penalties,
+            }
+            for priority, counts in self.stats.items():
+                summary = dict(counts)
+                total_ms = summary.pop('total_wait_ms')
+                summary['avg_wait_ms'] = round(total_ms / counts['acquired'], 1) if counts['acquired'] else 0.0
+                stats[priority] = summary
+        return stats
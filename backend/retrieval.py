@@ -0,0 +1,209 @@
+import os
+import re
+import time
+import threading
+
+import torch
+
+# Hybrid retrieval for chat RAG: BM25 (FTS5) and embedding (topic index) candidates are fused
+# with reciprocal-rank fusion, the head of the list is reranked by a local cross-encoder when it
+# fits the latency budget, and the survivors are rendered as query-focused snippets that share a
+# fixed token budget, so the prompt only carries context that is likely to help.
+RAG_TOP_K = int(os.getenv('RAG_TOP_K', 3))
+RAG_CANDIDATES = int(os.getenv('RAG_CANDIDATES', 12))  # per retriever, before fusion
+RAG_RRF_K = 60  # standard reciprocal-rank-fusion damping constant
+RAG_VECTOR_MIN_SCORE = float(os.getenv('RAG_VECTOR_MIN_SCORE', 0.2))
+RAG_CONTEXT_TOKENS = int(os.getenv('RAG_CONTEXT_TOKENS', 300))  # whole [RELEVANT COURSE CONTENT] block
+
+RAG_RERANK_ENABLED = os.getenv('RAG_RERANK_ENABLED', 'true').lower() == 'true'
+RAG_RERANKER_MODEL = os.getenv('RAG_RERANKER_MODEL', 'cross-encoder/ms-marco-MiniLM-L-6-v2')
+RAG_RERANK_CANDIDATES = int(os.getenv('RAG_RERANK_CANDIDATES', 8))
+RAG_RERANK_BUDGET_MS = float(os.getenv('RAG_RERANK_BUDGET_MS', 150))
+# Cross-encoder logit below which a candidate is dropped even if it made the top-k
+RAG_RERANK_MIN_SCORE = float(os.getenv('RAG_RERANK_MIN_SCORE', -4.0))
+
+CHARS_PER_TOKEN = 4  # same rough estimate the service uses when no tokenizer is at hand
+
+
+class CrossEncoderReranker:
+    """
+    Local cross-encoder, loaded in the background on first use so no chat request waits for it.
+    Each call reranks only as many pairs as the measured per-pair cost allows within the budget.
+    """
+
+    def __init__(self, model_path=RAG_RERANKER_MODEL, budget_ms=RAG_RERANK_BUDGET_MS, enabled=RAG_RERANK_ENABLED):
+        self.model_path = model_path
+        self.budget_ms = budget_ms
+        self.enabled = enabled
+        self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+        self._tokenizer = None
+        self._model = None
+        self._loading = False
+        self._load_error = None
+        self._lock = threading.Lock()
+        self._ms_per_pair = None  # moving average of observed cost
+        self.stats = {'reranked': 0, 'skipped_not_loaded': 0, 'skipped_budget': 0, 'truncated': 0,
+                      'total_ms': 0.0}
+
+    def _load(self):
+        try:
+            from transformers import AutoTokenizer, AutoModelForSequenceClassification
+            tokenizer = AutoTokenizer.from_pretrained(self.model_path)
+            model = AutoModelForSequenceClassification.from_pretrained(self.model_path)
+            model.to(self.device)
+            model.eval()
+            self._tokenizer = tokenizer
+            self._model = model
+            print(f"✅ Reranker: Loaded {self.model_path} on {self.device}")
+        except Exception as e:
+            self._load_error = str(e)
+            print(f"⚠️ Reranker: Failed to load {self.model_path}, using fused ranking only: {e}")
+
+    def _ensure_loading(self):
+        with self._lock:
+            if self._model is not None or self._loading or self._load_error:
+                return
+            self._loading = True
+        threading.Thread(target=self._load, name='reranker-load', daemon=True).start()
+
+    def _record(self, outcome):
+        with self._lock:
+            self.stats[outcome] += 1
+
+    def rerank(self, query, passages):
+        """Scores for the first n passages (n fitted to the budget), or None if reranking is skipped."""
+        if not self.enabled or not passages:
+            return None
+        if self._model is None:
+            self._ensure_loading()
+            self._record('skipped_not_loaded')
+            return None
+
+        n = len(passages)
+        if self._ms_per_pair:
+            n = min(n, int(self.budget_ms / self._ms_per_pair))
+            if n < 2:
+                # Reordering a single candidate buys nothing
+                self._record('skipped_budget')
+                return None
+            if n < len(passages):
+                self._record('truncated')
+
+        started = time.monotonic()
+        inputs = self._tokenizer([query] * n, passages[:n], padding=True, truncation=True,
+                                 max_length=256, return_tensors="pt").to(self.device)
+        with torch.no_grad():
+            logits = self._model(**inputs).logits
+        scores = logits[:, 0] if logits.shape[-1] == 1 else logits[:, -1]
+        elapsed_ms = (time.monotonic() - started) * 1000
+        with self._lock:
+            per_pair = elapsed_ms / n
+            self._ms_per_pair = per_pair if self._ms_per_pair is None else 0.8 * self._ms_per_pair + 0.2 * per_pair
+            self.stats['reranked'] += 1
+            self.stats['total_ms'] += elapsed_ms
+        return scores.float().cpu().tolist()
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self.stats)
+            stats['ms_per_pair'] = round(self._ms_per_pair, 2) if self._ms_per_pair else None
+        total_ms = stats.pop('total_ms')
+        stats['avg_rerank_ms'] = round(total_ms / stats['reranked'], 1) if stats['reranked'] else 0.0
+        stats['model'] = self.model_path
+        stats['loaded'] = self._model is not None
+        stats['enabled'] = self.enabled
+        stats['budget_ms'] = self.budget_ms
+        if self._load_error:
+            stats['load_error'] = self._load_error[:200]
+        return stats
+
+
+reranker = CrossEncoderReranker()
+
+
+def _fuse(*rankings):
+    """Reciprocal-rank fusion of several [(id, score)] lists -> [id] best first."""
+    fused = {}
+    for ranking in rankings:
+        for rank, (item_id, _) in enumerate(ranking or []):
+            fused[item_id] = fused.get(item_id, 0.0) + 1.0 / (RAG_RRF_K + rank + 1)
+    return sorted(fused, key=fused.get, reverse=True)
+
+
+def retrieve_topics(query_text, course_ids, student_id=None, k=RAG_TOP_K):
+    """
+    Best k topics for the query as [(Topic, source)], or None when neither retriever is available
+    (no FTS5 and no embedder) so the caller can fall back to a plain keyword query.
+    """
+    from models import Topic
+    from text_search import search_topics
+    from topic_index import topic_index, topic_text
+
+    lexical = search_topics(query_text, course_ids, student_id=student_id, limit=RAG_CANDIDATES)
+    semantic = topic_index.search(course_ids, query_text, student_id=student_id, k=RAG_CANDIDATES,
+                                  min_score=RAG_VECTOR_MIN_SCORE)
+    if lexical is None and semantic is None:
+        return None
+
+    ordered = _fuse(lexical, semantic)[:RAG_RERANK_CANDIDATES]
+    if not ordered:
+        return []
+    by_id = {t.topic_id: t for t in Topic.query.filter(Topic.topic_id.in_(ordered)).all()}
+    candidates = [by_id[topic_id] for topic_id in ordered if topic_id in by_id]
+
+    scores = reranker.rerank(query_text, [topic_text(t) for t in candidates])
+    if scores is None:
+        return [(t, 'fused') for t in candidates[:k]]
+    head = sorted(zip(candidates, scores), key=lambda pair: pair[1], reverse=True)
+    ranked = [(t, 'reranked') for t, score in head if score >= RAG_RERANK_MIN_SCORE]
+    # Candidates the budget left unscored keep their fused order behind the reranked head
+    ranked += [(t, 'fused') for t in candidates[len(scores):]]
+    return ranked[:k]
+
+
+def _query_terms(query_text):
+    return {w for w in re.findall(r"\w+", query_text.lower()) if len(w) > 2}
+
+
+def make_snippet(text, query_text, max_tokens):
+    """The sentences of text that share most words with the query, in original order, within max_tokens."""
+    text = (text or '').strip()
+    max_chars = max_tokens * CHARS_PER_TOKEN
+    if len(text) <= max_chars:
+        return text
+    sentences = re.split(r'(?<=[.!?])\s+', text)
+    terms = _query_terms(query_text)
+    ranked = sorted(range(len(sentences)),
+                    key=lambda i: (-len(terms & _query_terms(sentences[i])), i))
+    chosen, used = [], 0
+    for i in ranked:
+        length = len(sentences[i]) + 1
+        if used + length > max_chars:
+            continue
+        chosen.append(i)
+        used += length
+    if not chosen:
+        # One long sentence: cut at a word boundary
+        return text[:max_chars].rsplit(' ', 1)[0] + '…'
+    return ' … '.join(sentences[i] for i in sorted(chosen))
+
+
+def build_context(topics, query_text, token_budget=RAG_CONTEXT_TOKENS):
+    """[RELEVANT COURSE CONTENT] block whose snippets share token_budget, best topic first."""
+    if not topics:
+        return ""
+    lines = []
+    remaining = token_budget
+    for position, topic in enumerate(topics):
+        header = f"- {topic.course.title if topic.course else 'Course'} > {topic.title}"
+        remaining -= len(header) // CHARS_PER_TOKEN + 1
+        # Split what is left evenly over the topics still to be written
+        share = remaining // (len(topics) - position)
+        snippet = make_snippet(topic.description, query_text, share) if share > 0 else ''
+        remaining -= len(snippet) // CHARS_PER_TOKEN
+        lines.append(f"{header}: {snippet}" if snippet else header)
+    return "\n[RELEVANT COURSE CONTENT]:\n" + "\n".join(lines) + "\n"
+
+
+def get_retrieval_stats():
+    return {'reranker': reranker.get_stats(), 'top_k': RAG_TOP_K, 'context_tokens': RAG_CONTEXT_TOKENS}
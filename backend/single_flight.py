@@ -0,0 +1,63 @@
+import threading
+from concurrent.futures import Future
+
+# Request coalescing for identical concurrent LLM calls. The first caller for a key runs the
+# upstream request; callers arriving with the same key while it is in flight wait on its
+# Future and get the same result (or the same exception) instead of a second generation.
+
+
+class SingleFlight:
+    def __init__(self):
+        self._inflight = {}  # key -> Future
+        self._waiters = {}  # key -> number of callers sharing the in-flight call
+        self._lock = threading.Lock()
+        self.stats = {'leaders': 0, 'coalesced': 0, 'shared_errors': 0, 'max_waiters': 0}
+
+    def begin(self, key):
+        """Return (future, is_leader). The leader must call finish(key, ...) exactly once."""
+        with self._lock:
+            future = self._inflight.get(key)
+            if future is not None:
+                self._waiters[key] += 1
+                self.stats['coalesced'] += 1
+                self.stats['max_waiters'] = max(self.stats['max_waiters'], self._waiters[key])
+                return future, False
+            future = Future()
+            self._inflight[key] = future
+            self._waiters[key] = 0
+            self.stats['leaders'] += 1
+            return future, True
+
+    def finish(self, key, result=None, error=None):
+        with self._lock:
+            future = self._inflight.pop(key, None)
+            waiters = self._waiters.pop(key, 0)
+            if error is not None:
+                self.stats['shared_errors'] += waiters
+        if future is None:
+            return
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    def do(self, key, fn, *args):
+        """Run fn(*args) once per set of concurrent callers for key. Returns (result, shared)."""
+        future, leader = self.begin(key)
+        if not leader:
+            return future.result(), True
+        try:
+            result = fn(*args)
+        except Exception as e:
+            self.finish(key, error=e)
+            raise
+        self.finish(key, result=result)
+        return result, False
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self.stats)
+            stats['in_flight'] = len(self._inflight)
+        calls = stats['leaders'] + stats['coalesced']
+        stats['dedup_rate'] = round(stats['coalesced'] / calls, 3) if calls else 0.0
+        return stats
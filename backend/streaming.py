@@ -0,0 +1,19 @@
+import json
+from flask import Response, stream_with_context
+
+
+def sse_event(event, data):
+    """Format one Server-Sent Events frame with a JSON payload."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def sse_response(generator):
+    """Wrap a generator of SSE frames, keeping the request/app context alive while it runs."""
+    return Response(
+        stream_with_context(generator),
+        mimetype='text/event-stream',
+        headers={
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no'  # stop nginx from buffering the stream
+        }
+    )
@@ -0,0 +1,243 @@
+import os
+import re
+import ast
+import json
+import math
+import time
+import random
+import hashlib
+import threading
+
+from rate_limiter import UpstreamRateLimited
+
+# Offline LLM provider for load tests and benchmarks (LLM_PROVIDER=stub). Returns canned,
+# schema-valid responses per prompt family, deterministically per prompt, after a simulated
+# latency; failures and 429s are injected at configurable rates to reproduce brownouts.
+STUB_LLM_LATENCY = os.getenv('STUB_LLM_LATENCY', 'lognormal').lower()  # fixed, uniform, lognormal
+STUB_LLM_LATENCY_MS = float(os.getenv('STUB_LLM_LATENCY_MS', 300))  # fixed value / uniform mean / lognormal median
+STUB_LLM_LATENCY_SPREAD = float(os.getenv('STUB_LLM_LATENCY_SPREAD', 0.5))  # uniform +/- fraction, lognormal sigma
+STUB_LLM_MS_PER_TOKEN = float(os.getenv('STUB_LLM_MS_PER_TOKEN', 0))  # added per output token (~4 chars)
+STUB_LLM_FAILURE_RATE = float(os.getenv('STUB_LLM_FAILURE_RATE', 0.0))
+STUB_LLM_RATE_LIMIT_RATE = float(os.getenv('STUB_LLM_RATE_LIMIT_RATE', 0.0))
+STUB_LLM_SLOW_RATE = float(os.getenv('STUB_LLM_SLOW_RATE', 0.0))
+STUB_LLM_SLOW_MS = float(os.getenv('STUB_LLM_SLOW_MS', 20000))
+STUB_LLM_SEED = int(os.getenv('STUB_LLM_SEED', 1234))
+STUB_LLM_STREAM_CHUNK_CHARS = int(os.getenv('STUB_LLM_STREAM_CHUNK_CHARS', 24))
+
+
+def _prompt_hash(prompt):
+    return int(hashlib.sha256(prompt.encode('utf-8')).hexdigest()[:8], 16)
+
+
+def _topic(prompt):
+    match = re.search(r'(?:Topic|topic|for|about)[:\s]+"([^"]+)"', prompt)
+    return match.group(1) if match else "this topic"
+
+
+def _sample_from_schema(schema):
+    """Smallest value that satisfies the JSON-schema subset used by json_output.validate_schema."""
+    if 'enum' in schema:
+        return schema['enum'][0]
+    expected = schema.get('type')
+    if isinstance(expected, list):
+        expected = expected[0]
+    if expected == 'object':
+        properties = schema.get('properties', {})
+        keys = list(properties) + [k for k in schema.get('required', []) if k not in properties]
+        return {key: _sample_from_schema(properties.get(key, {'type': 'string'})) for key in keys}
+    if expected == 'array':
+        return [_sample_from_schema(schema.get('items', {'type': 'string'})) for _ in range(max(schema.get('minItems', 1), 1))]
+    return {'integer': 1, 'number': 1.0, 'boolean': True, 'null': None}.get(expected, "stub")
+
+
+def _repair(prompt, h):
+    match = re.search(r'JSON schema:\n(.*?)\n', prompt)
+    schema = json.loads(match.group(1)) if match else {'type': 'object'}
+    return json.dumps(_sample_from_schema(schema))
+
+
+def _conceptual_quiz(prompt, h):
+    topic = _topic(prompt)
+    return json.dumps([{
+        "question": f"Why does {topic} behave the way it does in case {i + 1}?",
+        "correct_answer": f"Because of the underlying principle {i + 1} of {topic}, which constrains the outcome step by step.",
+        "explanation": f"Checks whether the student can reason about principle {i + 1}.",
+        "type": "conceptual"
+    } for i in range(5)])
+
+
+def _mcq_quiz(prompt, h):
+    topic = _topic(prompt)
+    return json.dumps([{
+        "question_text": f"Which statement about {topic} is correct ({i + 1})?",
+        "options": ["Option A", "Option B", "Option C", "Option D"],
+        "correct_answer": "Option " + "ABCD"[(h + i) % 4],
+        "explanation": f"Stub explanation {i + 1}."
+    } for i in range(5)])
+
+
+def _reasoning(prompt, h):
+    score = round(4.0 + (h % 56) / 10, 1)  # 4.0 - 9.5, stable per answer
+    return json.dumps({
+        "points_allocated": score,
+        "grading_justification": "Stub evaluation: marks follow a deterministic hash of the answer.",
+        "label": "Entailment" if score >= 7.0 else "Neutral",
+        "severity": "minor" if score >= 7.0 else "core",
+        "feedback": "Good structure; tighten the link between cause and effect.",
+        "misconceptions": [] if score >= 7.0 else ["Confuses correlation with causation"],
+        "clarification_notes": "Revisit the core definition and apply it to the example."
+    })
+
+
+def _syllabus(prompt, h):
+    match = re.search(r'syllabus for: "([^"]+)"', prompt)
+    course = match.group(1) if match else "the course"
+    return json.dumps([
+        {"title": f"{course}: Module {i + 1} - Stub Chapter {(h + i) % 97}", "duration_minutes": 45 + 15 * (i % 3)}
+        for i in range(6)
+    ])
+
+
+def _remedial_path(prompt, h):
+    return json.dumps([
+        {"title": "Remedial Level 1: Simplified Logic", "description": "Foundational explanation of the core idea.", "duration": 15},
+        {"title": "Remedial Level 2: Bridging Back", "description": "Connecting the basics to the current topic.", "duration": 20}
+    ])
+
+
+def _remedial_lesson(prompt, h):
+    topic = _topic(prompt)
+    return json.dumps({
+        "title": f"Remedial: {topic}",
+        "description": f"A simpler walk-through of {topic}.",
+        "content": f"## {topic}, step by step\n\nStart from an everyday analogy, then formalise it."
+    })
+
+
+def _challenge(prompt, h):
+    return json.dumps({
+        "title": f"Stub Challenge #{h % 1000}",
+        "description": "Explain a familiar system to a ten-year-old using only diagrams.",
+        "estimated_hours": 1.5
+    })
+
+
+def _course_search(prompt, h):
+    match = re.search(r'learn about "([^"]+)"', prompt)
+    query = match.group(1) if match else "the subject"
+    return json.dumps({
+        "best_book": f"Foundations of {query} (Stub Press)",
+        "courses": [{
+            "title": f"{query} {level}",
+            "description": f"{level} course on {query}.",
+            "link": "#",
+            "thumbnail": "https://ui-avatars.com/api/?name=AI&background=0D8ABC&color=fff"
+        } for level in ("Essentials", "In Practice", "Advanced Topics")],
+        "chatbot_insight": f"{query} underpins much of the field.",
+        "related_searches": [f"{query} basics", f"{query} exercises", f"{query} history"]
+    })
+
+
+def _notes(prompt, h):
+    topic = _topic(prompt)
+    paragraph = f"{topic} is explained here with a definition, a worked example and a common pitfall. " * 8
+    return json.dumps({
+        "title": f"Notes: {topic}",
+        "sections": [{"heading": heading, "content": paragraph} for heading in (
+            "1. Core Concepts", "2. In-Depth Analysis", "3. Applications & Examples",
+            "4. Common Misconceptions", "5. Key Takeaways"
+        )]
+    })
+
+
+def _intent(prompt, h):
+    match = re.search(r'category from (\[.*?\])', prompt)
+    labels = ast.literal_eval(match.group(1)) if match else ["general chat"]
+    return labels[h % len(labels)]
+
+
+def _chat(prompt, h):
+    return ("That's a good question. In short: break the idea into its definition, an example, "
+            "and the reason it matters, then check yourself with a quick practice problem.")
+
+
+# First matching marker wins, so more specific markers come first
+PROMPT_FAMILIES = [
+    ('repair', 'was supposed to be JSON matching this JSON schema', _repair),
+    ('quiz_conceptual', 'CONCEPTUAL ASSESSMENT', _conceptual_quiz),
+    ('quiz_mcq', 'multiple choice quiz', _mcq_quiz),
+    ('reasoning', 'Academic Evaluator', _reasoning),
+    ('syllabus', 'syllabus for', _syllabus),
+    ('remedial_path', 'remedial sub-path', _remedial_path),
+    ('remedial_lesson', 'Remedial Lesson for', _remedial_lesson),
+    ('challenge', 'Brain Testing', _challenge),
+    ('course_search', 'elite academic advisor', _course_search),
+    ('notes', 'comprehensive study materials', _notes),
+    ('intent', 'Classify this text into one category', _intent),
+]
+
+
+class StubProvider:
+    def __init__(self, seed=STUB_LLM_SEED):
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.stats = {'calls': 0, 'failures': 0, 'rate_limited': 0, 'slow': 0}
+        self.family_counts = {}
+
+    def respond(self, prompt):
+        """Canned text for the prompt's family; identical prompts always get identical text."""
+        h = _prompt_hash(prompt)
+        for family, marker, build in PROMPT_FAMILIES:
+            if marker in prompt:
+                break
+        else:
+            family, build = 'chat', _chat
+        with self._lock:
+            self.family_counts[family] = self.family_counts.get(family, 0) + 1
+        return build(prompt, h)
+
+    def _latency_seconds(self, text, max_new_tokens):
+        with self._lock:
+            if self._rng.random() < STUB_LLM_SLOW_RATE:
+                self.stats['slow'] += 1
+                return STUB_LLM_SLOW_MS / 1000
+            if STUB_LLM_LATENCY == 'fixed':
+                ms = STUB_LLM_LATENCY_MS
+            elif STUB_LLM_LATENCY == 'uniform':
+                ms = STUB_LLM_LATENCY_MS * self._rng.uniform(1 - STUB_LLM_LATENCY_SPREAD, 1 + STUB_LLM_LATENCY_SPREAD)
+            else:
+                ms = STUB_LLM_LATENCY_MS * math.exp(self._rng.gauss(0, STUB_LLM_LATENCY_SPREAD))
+        tokens = min(len(text) // 4, max_new_tokens)
+        return max(ms + tokens * STUB_LLM_MS_PER_TOKEN, 0) / 1000
+
+    def _maybe_fail(self):
+        with self._lock:
+            self.stats['calls'] += 1
+            roll = self._rng.random()
+            if roll < STUB_LLM_RATE_LIMIT_RATE:
+                self.stats['rate_limited'] += 1
+                raise UpstreamRateLimited("Stub provider: injected 429")
+            if roll < STUB_LLM_RATE_LIMIT_RATE + STUB_LLM_FAILURE_RATE:
+                self.stats['failures'] += 1
+                raise RuntimeError("Stub provider: injected failure")
+
+    def generate(self, prompt, max_new_tokens, temperature):
+        self._maybe_fail()
+        text = self.respond(prompt)
+        time.sleep(self._latency_seconds(text, max_new_tokens))
+        return text
+
+    def stream(self, prompt, max_new_tokens, temperature):
+        self._maybe_fail()
+        text = self.respond(prompt)
+        chunks = [text[i:i + STUB_LLM_STREAM_CHUNK_CHARS] for i in range(0, len(text), STUB_LLM_STREAM_CHUNK_CHARS)]
+        delay = self._latency_seconds(text, max_new_tokens) / max(len(chunks), 1)
+        for chunk in chunks:
+            time.sleep(delay)
+            yield chunk
+
+    def get_stats(self):
+        with self._lock:
+            return dict(self.stats, families=dict(self.family_counts), latency=STUB_LLM_LATENCY,
+                        latency_ms=STUB_LLM_LATENCY_MS, failure_rate=STUB_LLM_FAILURE_RATE,
+                        rate_limit_rate=STUB_LLM_RATE_LIMIT_RATE)
@@ -5,6 +5,8 @@ from datetime import datetime
 
 tasks_bp = Blueprint('tasks', __name__)
 
+TASK_TAGS = ["Study", "Research", "Project", "Revision", "Administrative"]
+
 @tasks_bp.route('/', methods=['GET'])
 @jwt_required()
 def get_tasks():
@@ -23,18 +25,13 @@ def create_task():
     title = data.get('title', 'New Task')
     desc = data.get('description', '')
     
-    # 1. Automated Tagging (Similarity-based)
-    from chat_routes import get_embeddings
-    import torch.nn.functional as F
-    
-    tags = ["Study", "Research", "Project", "Revision", "Administrative"]
-    query_emb = get_embeddings([f"{title} {desc}"])
-    tag_embs = get_embeddings(tags)
-    
+    # 1. Automated Tagging (Similarity-based; tag embeddings come from the embedding cache)
+    from embedding_service import embedding_service
+
+    sims = embedding_service.similarity(f"{title} {desc}", TASK_TAGS)
     auto_tag = "General"
-    if query_emb is not None and tag_embs is not None:
-        sims = F.cosine_similarity(query_emb, tag_embs)
-        auto_tag = tags[torch.argmax(sims).item()]
+    if any(sims):
+        auto_tag = TASK_TAGS[max(range(len(TASK_TAGS)), key=lambda i: sims[i])]
 
     # 2. Eisenhower Matrix Prioritization (Rule-based heuristic)
     # Important Keywords
@@ -0,0 +1,103 @@
+import threading
+
+from circuit_breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker
+
+
+def make_breaker(**kwargs):
+    kwargs.setdefault('min_calls', 4)
+    kwargs.setdefault('error_rate', 0.5)
+    kwargs.setdefault('slow_call_seconds', 10)
+    kwargs.setdefault('slow_call_rate', 0.75)
+    return CircuitBreaker('Test', **kwargs)
+
+
+def test_stays_closed_below_min_calls():
+    breaker = make_breaker()
+    for _ in range(3):
+        breaker.record_failure(0.1, "boom")
+    assert breaker.state == CLOSED
+    assert breaker.allow_request()
+
+
+def test_trips_on_error_rate_and_short_circuits():
+    breaker = make_breaker()
+    breaker.record_success(0.1)
+    breaker.record_success(0.1)
+    breaker.record_failure(0.1, "boom")
+    breaker.record_failure(0.1, "boom")
+    assert breaker.state == OPEN
+    assert not breaker.allow_request()
+    status = breaker.get_status()
+    assert status['trips'] == 1
+    assert status['short_circuited'] == 1
+    assert status['last_error'] == "boom"
+
+
+def test_trips_on_slow_call_rate():
+    breaker = make_breaker()
+    for _ in range(3):
+        breaker.record_success(12)
+    breaker.record_success(0.1)
+    assert breaker.state == OPEN
+
+
+def test_without_probe_a_single_trial_request_decides_recovery():
+    breaker = make_breaker(open_seconds=0)
+    for _ in range(4):
+        breaker.record_failure(0.1)
+    assert breaker.allow_request()
+    assert breaker.state == HALF_OPEN
+    # Only one trial at a time
+    assert not breaker.allow_request()
+    breaker.record_success(0.1)
+    assert breaker.state == CLOSED
+    assert breaker.get_status()['window_calls'] == 1
+
+
+def test_failed_trial_reopens():
+    breaker = make_breaker(open_seconds=0)
+    for _ in range(4):
+        breaker.record_failure(0.1)
+    assert breaker.allow_request()
+    breaker.record_failure(0.1)
+    assert breaker.state == OPEN
+    assert breaker.get_status()['trips'] == 2
+
+
+def test_cancelled_trial_frees_the_slot():
+    breaker = make_breaker(open_seconds=0)
+    for _ in range(4):
+        breaker.record_failure(0.1)
+    assert breaker.allow_request()
+    breaker.record_cancelled(0.1)
+    assert breaker.allow_request()
+
+
+def test_background_probe_closes_the_circuit():
+    probed = threading.Event()
+    healthy = threading.Event()
+
+    def probe():
+        probed.set()
+        assert healthy.wait(5)
+
+    breaker = make_breaker(probe=probe, open_seconds=0, probe_interval=0)
+    for _ in range(4):
+        breaker.record_failure(0.1)
+    # With a probe, live requests never serve as the trial
+    assert probed.wait(5)
+    assert breaker.state == HALF_OPEN
+    assert not breaker.allow_request()
+    healthy.set()
+    breaker._probe_thread.join(5)
+    assert breaker.state == CLOSED
+    assert breaker.allow_request()
+
+
+def test_latency_percentile_ignores_failures():
+    breaker = make_breaker(min_calls=100)
+    for latency in (1, 2, 3, 4):
+        breaker.record_success(latency)
+    breaker.record_failure(50)
+    assert breaker.latency_percentile(0.5, min_samples=4) == 3
+    assert breaker.latency_percentile(0.5) is None
@@ -0,0 +1,105 @@
+import pytest
+
+from json_output import (
+    JSONBalancedStoppingCriteria,
+    build_repair_prompt,
+    extract_json,
+    extract_json_span,
+    schema_container,
+    validate_schema,
+)
+
+QUESTION_SCHEMA = {
+    'type': 'array',
+    'minItems': 1,
+    'items': {
+        'type': 'object',
+        'required': ['text', 'points'],
+        'properties': {
+            'text': {'type': 'string'},
+            'points': {'type': 'integer'},
+            'type': {'type': 'string', 'enum': ['mcq', 'true_false']},
+        },
+    },
+}
+
+
+@pytest.mark.parametrize('text, expected', [
+    ('{"a": 1}', {'a': 1}),
+    ('```json\n{"a": 1}\n```', {'a': 1}),
+    ('Sure! Here is the quiz:\n[1, 2, 3]\nHope it helps.', [1, 2, 3]),
+    ('{"a": [1, 2,], "b": {"c": 3,},}', {'a': [1, 2], 'b': {'c': 3}}),
+    ('{"text": "braces } and ] inside \\" strings"}', {'text': 'braces } and ] inside " strings'}),
+])
+def test_extract_json_tolerates_model_formatting(text, expected):
+    assert extract_json(text) == expected
+
+
+def test_extract_json_recovers_truncated_output():
+    truncated = '[{"text": "Q1", "points": 10}, {"text": "Q2", "points": 10}, {"text": "Q3", "poi'
+    # Cut at the last complete member; the partial item then fails validation and gets repaired
+    recovered = extract_json(truncated)
+    assert recovered == [{'text': 'Q1', 'points': 10}, {'text': 'Q2', 'points': 10}, {'text': 'Q3'}]
+    assert validate_schema(recovered, QUESTION_SCHEMA) == ["$[2]: missing required key 'points'"]
+
+
+def test_extract_json_honours_the_expected_container():
+    text = 'Result {"note": "ignore"} then [1, 2]'
+    assert extract_json(text) == {'note': 'ignore'}
+    assert extract_json(text, expect='[') == [1, 2]
+
+
+def test_extract_json_skips_an_unparseable_candidate():
+    assert extract_json('Use {curly} braces: {"ok": true}') == {'ok': True}
+
+
+@pytest.mark.parametrize('text', ['', 'no json here', '{not: json}'])
+def test_extract_json_raises_value_error(text):
+    with pytest.raises(ValueError):
+        extract_json(text)
+
+
+def test_extract_json_span_returns_the_raw_container():
+    assert extract_json_span('prefix {"a": [1, {"b": 2}]} suffix') == '{"a": [1, {"b": 2}]}'
+    assert extract_json_span('{"unterminated": [1, 2') is None
+
+
+def test_validate_schema_accepts_valid_output():
+    assert validate_schema([{'text': 'Q', 'points': 10, 'type': 'mcq'}], QUESTION_SCHEMA) == []
+
+
+def test_validate_schema_reports_every_problem_with_its_path():
+    errors = validate_schema([{'text': 'Q', 'points': 1.5, 'type': 'essay'}, {'points': True}], QUESTION_SCHEMA)
+    assert errors == [
+        "$[0].points: expected integer, got float",
+        "$[0].type: 'essay' is not one of ['mcq', 'true_false']",
+        "$[1]: missing required key 'text'",
+        "$[1].points: expected integer, got bool",
+    ]
+
+
+def test_validate_schema_checks_type_and_item_counts():
+    assert validate_schema({'a': 1}, QUESTION_SCHEMA) == ["$: expected array, got dict"]
+    assert validate_schema([], QUESTION_SCHEMA) == ["$: expected at least 1 items, got 0"]
+    assert validate_schema([1, 2, 3], {'type': 'array', 'maxItems': 2}) == ["$: expected at most 2 items, got 3"]
+    assert validate_schema(None, {'type': ['string', 'null']}) == []
+
+
+def test_schema_container_and_repair_prompt():
+    assert schema_container(QUESTION_SCHEMA) == '['
+    assert schema_container({'type': 'object'}) == '{'
+    assert schema_container({'type': 'string'}) is None
+    prompt = build_repair_prompt('x' * 10000, QUESTION_SCHEMA, ['e1', 'e2'], max_chars=100)
+    assert 'Problems found: e1; e2' in prompt
+    assert 'x' * 100 in prompt and 'x' * 101 not in prompt
+
+
+def test_balanced_stopping_tracks_each_row_until_its_container_closes():
+    criteria = JSONBalancedStoppingCriteria(tokenizer=None, prompt_length=0, batch_size=2)
+    first, second = criteria._rows
+    criteria._feed(first, 'Here: {"a": "}", "b": [1, {')
+    assert not first['done']
+    criteria._feed(first, '}]} trailing text')
+    assert first['done']
+    criteria._feed(second, '[1, 2')
+    assert not second['done']
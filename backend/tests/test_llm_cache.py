@@ -0,0 +1,87 @@
+import sqlite3
+import time
+
+from llm_cache import LLMCache, make_cache_key
+
+
+def make_cache(tmp_path, **kwargs):
+    return LLMCache(path=str(tmp_path / 'cache' / 'llm.db'), **kwargs)
+
+
+def test_cache_key_covers_every_parameter():
+    base = make_cache_key("prompt", max_new_tokens=100, temperature=0.7)
+    assert base == make_cache_key("prompt", temperature=0.7, max_new_tokens=100)
+    assert base != make_cache_key("prompt", max_new_tokens=100, temperature=0.0)
+    assert base != make_cache_key("other prompt", max_new_tokens=100, temperature=0.7)
+
+
+def test_memory_hit_after_set(tmp_path):
+    cache = make_cache(tmp_path)
+    assert cache.get('k') is None
+    cache.set('k', 'answer')
+    assert cache.get('k') == 'answer'
+    stats = cache.get_stats()
+    assert (stats['memory_hits'], stats['misses'], stats['stores']) == (1, 1, 1)
+    assert stats['disk_tier'] is True
+
+
+def test_disk_tier_survives_a_new_instance(tmp_path):
+    make_cache(tmp_path).set('k', 'answer')
+    fresh = make_cache(tmp_path)
+    assert fresh.get('k') == 'answer'
+    assert fresh.get_stats()['disk_hits'] == 1
+    # Promoted to memory on the disk hit
+    assert fresh.get('k') == 'answer'
+    assert fresh.get_stats()['memory_hits'] == 1
+
+
+def test_expired_entries_are_dropped_from_both_tiers(tmp_path):
+    cache = make_cache(tmp_path)
+    cache.set('k', 'answer', ttl_seconds=1)
+    with sqlite3.connect(cache.path) as conn:
+        conn.execute("UPDATE llm_cache SET expires_at = ?", (time.time() - 1,))
+    cache._memory['k'] = (time.time() - 1, 'answer')
+    assert cache.get('k') is None
+    assert cache.get_stats()['expired'] == 2
+    with sqlite3.connect(cache.path) as conn:
+        assert conn.execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0] == 0
+
+
+def test_memory_tier_evicts_least_recently_used(tmp_path):
+    cache = make_cache(tmp_path, memory_entries=2)
+    cache.set('a', '1')
+    cache.set('b', '2')
+    cache.get('a')
+    cache.set('c', '3')
+    assert list(cache._memory) == ['a', 'c']
+    assert cache.get_stats()['evictions'] == 1
+
+
+def test_disk_prune_keeps_the_most_recently_used_rows(tmp_path):
+    cache = make_cache(tmp_path, memory_entries=1, disk_entries=50)
+    for i in range(100):
+        cache.set(f'k{i}', str(i))
+    with sqlite3.connect(cache.path) as conn:
+        keys = {row[0] for row in conn.execute("SELECT cache_key FROM llm_cache")}
+    assert len(keys) == 50
+    assert 'k99' in keys and 'k0' not in keys
+
+
+def test_delete_and_clear(tmp_path):
+    cache = make_cache(tmp_path)
+    cache.set('a', '1')
+    cache.set('b', '2')
+    cache.delete('a')
+    assert cache.get('a') is None
+    assert cache.get('b') == '2'
+    cache.clear()
+    assert cache.get('b') is None
+
+
+def test_disabled_cache_stores_nothing(tmp_path):
+    cache = make_cache(tmp_path, enabled=False)
+    cache.set('k', 'answer')
+    assert cache.get('k') is None
+    assert not (tmp_path / 'cache').exists()
+    cache.record_bypass()
+    assert cache.get_stats()['bypassed'] == 1
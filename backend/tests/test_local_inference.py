@@ -0,0 +1,122 @@
+import threading
+
+import pytest
+
+from local_inference import InferenceQueueFull, LocalInferenceWorker
+
+
+class RecordingBatch:
+    """run_batch stand-in: records each call; the first call blocks until released so later requests queue up."""
+
+    def __init__(self, fail=False):
+        self.calls = []
+        self.entered = threading.Event()
+        self.release = threading.Event()
+        self.fail = fail
+
+    def __call__(self, prompts, max_new_tokens, temperature, response_format):
+        first = not self.calls
+        self.calls.append((list(prompts), max_new_tokens, temperature, response_format))
+        if first:
+            self.entered.set()
+            assert self.release.wait(5)
+        elif self.fail:
+            raise RuntimeError("generate failed")
+        return [f"{prompt}:{temperature}" for prompt in prompts]
+
+
+def start_worker(run_batch, **kwargs):
+    kwargs.setdefault('window_ms', 100)
+    worker = LocalInferenceWorker(run_batch, lambda prompt: len(prompt), **kwargs)
+    blocker = worker.submit('blocker', 16, 0.7)
+    assert run_batch.entered.wait(5)
+    return worker, blocker
+
+
+def test_matching_requests_share_one_generate_call():
+    run_batch = RecordingBatch()
+    worker, blocker = start_worker(run_batch)
+    futures = [worker.submit(f"p{i}", 16, 0.7) for i in range(3)]
+    run_batch.release.set()
+    assert [f.result(5) for f in futures] == ["p0:0.7", "p1:0.7", "p2:0.7"]
+    assert blocker.result(5) == "blocker:0.7"
+    assert run_batch.calls[1][0] == ["p0", "p1", "p2"]
+    assert worker.get_stats()['max_batch_size'] == 3
+
+
+def test_batches_are_keyed_by_sampling_settings_and_format():
+    run_batch = RecordingBatch()
+    worker, _ = start_worker(run_batch)
+    futures = [
+        worker.submit("a", 16, 0.7),
+        worker.submit("greedy", 16, 0.0),
+        worker.submit("b", 16, 0.7),
+        worker.submit("json", 16, 0.7, response_format='json_object'),
+        worker.submit("longer", 32, 0.7),
+    ]
+    run_batch.release.set()
+    for future in futures:
+        future.result(5)
+    batches = {(tuple(prompts), tokens, temperature, fmt) for prompts, tokens, temperature, fmt in run_batch.calls[1:]}
+    assert batches == {
+        (("a", "b"), 16, 0.7, None),
+        (("greedy",), 16, 0.0, None),
+        (("json",), 16, 0.7, 'json_object'),
+        (("longer",), 32, 0.7, None),
+    }
+
+
+def test_token_budget_splits_batches_in_arrival_order():
+    run_batch = RecordingBatch()
+    # Padded cost per row is prompt tokens (len) + 10 new tokens; 3 rows of 2-char prompts = 36
+    worker, _ = start_worker(run_batch, max_batch_tokens=36)
+    futures = [worker.submit(f"p{i}", 10, 0.7) for i in range(5)]
+    run_batch.release.set()
+    for future in futures:
+        future.result(5)
+    assert [call[0] for call in run_batch.calls[1:]] == [["p0", "p1", "p2"], ["p3", "p4"]]
+
+
+def test_max_batch_size_is_respected():
+    run_batch = RecordingBatch()
+    worker, _ = start_worker(run_batch, max_batch_size=2)
+    futures = [worker.submit(f"p{i}", 16, 0.7) for i in range(3)]
+    run_batch.release.set()
+    for future in futures:
+        future.result(5)
+    assert [len(call[0]) for call in run_batch.calls[1:]] == [2, 1]
+
+
+def test_a_failed_batch_fails_every_request_in_it():
+    run_batch = RecordingBatch(fail=True)
+    worker, _ = start_worker(run_batch)
+    futures = [worker.submit(f"p{i}", 16, 0.7) for i in range(2)]
+    run_batch.release.set()
+    for future in futures:
+        with pytest.raises(RuntimeError, match="generate failed"):
+            future.result(5)
+
+
+def test_streaming_requests_run_alone():
+    run_batch = RecordingBatch()
+    streamed = []
+    worker = LocalInferenceWorker(run_batch, len, run_stream=lambda *args: streamed.append(args), window_ms=100)
+    worker.submit('blocker', 16, 0.7)
+    assert run_batch.entered.wait(5)
+    stream_done = worker.submit_stream("s", 16, 0.7, streamer=object())
+    other = worker.submit("p", 16, 0.7)
+    run_batch.release.set()
+    assert stream_done.result(5) is None
+    assert other.result(5) == "p:0.7"
+    assert [args[0] for args in streamed] == ["s"]
+    assert all("s" not in call[0] for call in run_batch.calls)
+
+
+def test_full_queue_rejects_instead_of_blocking():
+    run_batch = RecordingBatch()
+    worker, _ = start_worker(run_batch, queue_size=1)
+    worker.submit("queued", 16, 0.7)
+    with pytest.raises(InferenceQueueFull):
+        worker.submit("overflow", 16, 0.7)
+    assert worker.get_stats()['rejected'] == 1
+    run_batch.release.set()
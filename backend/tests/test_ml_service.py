@@ -0,0 +1,128 @@
+import pytest
+
+# The service module pulls in the model stack; these tests only run where it is installed
+pytest.importorskip('torch')
+pytest.importorskip('transformers')
+pytest.importorskip('google.generativeai')
+
+from circuit_breaker import CircuitBreaker  # noqa: E402
+from llm_cache import LLMCache  # noqa: E402
+from local_inference import LocalInferenceWorker  # noqa: E402
+from ml_service import MockResponse, MultiLLMService  # noqa: E402
+from rate_limiter import ProviderRateLimiter, RateLimitExceeded  # noqa: E402
+
+
+def test_zero_temperature_decodes_greedily():
+    # Sampling with temperature=0 is rejected by generate(); JSON repair runs at 0.0
+    assert MultiLLMService._sampling_kwargs(0.0) == {'do_sample': False}
+    assert MultiLLMService._sampling_kwargs(None) == {'do_sample': False}
+
+
+def test_positive_temperature_samples():
+    assert MultiLLMService._sampling_kwargs(0.7) == {'do_sample': True, 'temperature': 0.7, 'top_p': 0.9}
+
+
+class ShedLimiter:
+    def acquire(self, priority='standard', deadline=None):
+        raise RateLimitExceeded("Test is saturated")
+
+
+def fail_if_called(*args, **kwargs):
+    pytest.fail("provider called after its limiter shed the request")
+
+
+@pytest.fixture
+def shed_service(monkeypatch):
+    """A service whose cloud providers all shed, with the local model replaced by a recorder."""
+    service = MultiLLMService()
+    service._cache = LLMCache(enabled=False)
+    service.local_calls = []
+    for name in ('stub', 'gemini'):
+        service._limiters[name] = ShedLimiter()
+        service._breakers[name] = CircuitBreaker(name)
+
+    def generate_local(prompt, max_new_tokens, temperature, response_format=None):
+        service.local_calls.append(prompt)
+        return MockResponse("local answer", provider='local')
+
+    def stream_local(prompt, max_new_tokens, temperature):
+        service.local_calls.append(prompt)
+        yield "local chunk"
+
+    monkeypatch.setattr(service, '_cloud_providers', lambda: [('stub', fail_if_called), ('gemini', fail_if_called)])
+    monkeypatch.setattr(service, '_stream_providers',
+                        lambda: [('stub', fail_if_called), ('gemini', fail_if_called), ('local', stream_local)])
+    monkeypatch.setattr(service, '_generate_local', generate_local)
+    return service
+
+
+@pytest.mark.parametrize('hedge', [False, True])
+def test_shed_background_generation_fails_fast(shed_service, hedge):
+    with pytest.raises(RateLimitExceeded):
+        shed_service._generate_uncached("prompt", 16, 0.7, hedge=hedge, priority='background')
+    assert shed_service.local_calls == []
+
+
+@pytest.mark.parametrize('hedge', [False, True])
+def test_shed_interactive_generation_falls_back_to_local(shed_service, hedge):
+    response = shed_service._generate_uncached("prompt", 16, 0.7, hedge=hedge, priority='interactive')
+    assert response.text == "local answer"
+    assert shed_service.local_calls == ["prompt"]
+
+
+def test_shed_background_stream_fails_fast(shed_service):
+    with pytest.raises(RateLimitExceeded):
+        list(shed_service.generate_stream("prompt", 16, use_cache=False, priority='background'))
+    assert shed_service.local_calls == []
+
+
+def test_shed_interactive_stream_falls_back_to_local(shed_service):
+    assert list(shed_service.generate_stream("prompt", 16, use_cache=False, priority='interactive')) == ["local chunk"]
+
+
+@pytest.fixture
+def batch_service(monkeypatch, tmp_path):
+    """A service with one fake cloud provider that upper-cases prompts and fails on 'bad'."""
+    service = MultiLLMService()
+    service._cache = LLMCache(path=str(tmp_path / 'llm.db'), enabled=True)
+    service._breakers['stub'] = CircuitBreaker('Stub')
+    service._limiters['stub'] = ProviderRateLimiter('Stub', 1000.0, 1000)
+    service.provider_calls = []
+
+    def provider(prompt, max_new_tokens, temperature, response_format=None):
+        service.provider_calls.append(prompt)
+        if prompt == 'bad':
+            raise RuntimeError("boom")
+        return MockResponse(prompt.upper(), provider='stub')
+
+    monkeypatch.setattr(service, '_cloud_providers', lambda: [('stub', provider)])
+    monkeypatch.setattr(service, '_generate_local',
+                        lambda *args, **kwargs: MockResponse("Error: All AI models offline.", is_error=True))
+    return service
+
+
+def test_generate_many_keeps_order_and_isolates_failures(batch_service):
+    batch_service._cache.set(batch_service._cache_key('cached', 64, 0.7), 'FROM CACHE')
+    results = batch_service.generate_many(['a', 'cached', 'b', 'a', 'bad'], max_new_tokens=64, temperature=0.7)
+    assert [r.text for r in results[:4]] == ['A', 'FROM CACHE', 'B', 'A']
+    assert results[1].cached
+    assert results[4].is_error
+    # The cached prompt is not sent and the duplicate 'a' rides on the first one
+    assert sorted(batch_service.provider_calls) == ['a', 'b', 'bad']
+    assert batch_service._cache.get(batch_service._cache_key('b', 64, 0.7)) == 'B'
+    assert batch_service._cache.get(batch_service._cache_key('bad', 64, 0.7)) is None
+
+
+def test_generate_many_sends_local_prompts_as_one_batch(batch_service, monkeypatch):
+    batches = []
+
+    def run_batch(prompts, max_new_tokens, temperature, response_format):
+        batches.append(list(prompts))
+        return [MockResponse(prompt.upper(), provider='local') for prompt in prompts]
+
+    worker = LocalInferenceWorker(run_batch, len, window_ms=50)
+    monkeypatch.setattr(batch_service, '_cloud_providers', lambda: [])
+    monkeypatch.setattr(batch_service, '_get_local_worker', lambda: worker)
+    results = batch_service.generate_many(['x', 'y', 'z'], max_new_tokens=64, temperature=0.7)
+    assert [r.text for r in results] == ['X', 'Y', 'Z']
+    assert batches == [['x', 'y', 'z']]
@@ -0,0 +1,124 @@
+import threading
+import time
+
+import pytest
+
+from rate_limiter import ProviderRateLimiter, RateLimitExceeded, sync_wait_limit, wait_deadline
+
+MAX_WAIT = {'interactive': 5, 'standard': 5, 'background': 5}
+
+
+def make_limiter(rate=10.0, burst=1, queue_size=8, max_wait=MAX_WAIT):
+    return ProviderRateLimiter('Test', rate, burst, queue_size=queue_size, max_wait=max_wait)
+
+
+def wait_until(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.001)
+
+
+def queue_waiter(limiter, priority, outcomes, queued_after=None):
+    """Start a thread blocked in acquire(priority); returns once the queue holds queued_after waiters."""
+    if queued_after is None:
+        queued_after = limiter.get_stats()['queued'] + 1
+
+    def acquire():
+        try:
+            limiter.acquire(priority)
+            outcomes.append(priority)
+        except RateLimitExceeded:
+            outcomes.append(f"{priority}:shed")
+
+    thread = threading.Thread(target=acquire)
+    thread.start()
+    wait_until(lambda: limiter.get_stats()['queued'] == queued_after)
+    return thread
+
+
+def test_burst_is_granted_without_waiting():
+    limiter = make_limiter(rate=0.001, burst=3)
+    for _ in range(3):
+        limiter.acquire('standard')
+    assert limiter.get_stats()['standard']['acquired'] == 3
+
+
+def test_higher_priority_waiters_are_served_first():
+    limiter = make_limiter()
+    limiter.penalize(0.2)  # hold every waiter until all three are queued
+    granted = []
+    threads = [queue_waiter(limiter, priority, granted) for priority in ('background', 'standard', 'interactive')]
+    for thread in threads:
+        thread.join(5)
+    assert granted == ['interactive', 'standard', 'background']
+
+
+def test_full_queue_sheds_the_lowest_priority_waiter():
+    limiter = make_limiter(queue_size=1)
+    limiter.penalize(0.5)
+    outcomes = []
+    background = queue_waiter(limiter, 'background', outcomes)
+    # Takes the shed waiter's place, so the queue length stays at 1
+    interactive = queue_waiter(limiter, 'interactive', outcomes, queued_after=1)
+    background.join(5)
+    assert outcomes == ['background:shed']
+    interactive.join(5)
+    assert outcomes == ['background:shed', 'interactive']
+
+
+def test_full_queue_rejects_a_request_that_outranks_nobody():
+    limiter = make_limiter(queue_size=1)
+    limiter.penalize(0.2)
+    outcomes = []
+    interactive = queue_waiter(limiter, 'interactive', outcomes)
+    with pytest.raises(RateLimitExceeded):
+        limiter.acquire('background')
+    interactive.join(5)
+    assert outcomes == ['interactive']
+
+
+def test_waiting_past_max_wait_times_out():
+    limiter = make_limiter(rate=0.001, max_wait=dict(MAX_WAIT, background=0.05))
+    limiter.acquire('background')
+    started = time.monotonic()
+    with pytest.raises(RateLimitExceeded):
+        limiter.acquire('background')
+    assert time.monotonic() - started < 1
+    stats = limiter.get_stats()
+    assert stats['background']['timed_out'] == 1
+    assert stats['queued'] == 0
+
+
+def test_explicit_deadline_caps_the_wait():
+    limiter = make_limiter(rate=0.001)
+    limiter.acquire('background')
+    started = time.monotonic()
+    with pytest.raises(RateLimitExceeded):
+        limiter.acquire('background', deadline=time.monotonic() + 0.05)
+    assert time.monotonic() - started < 1
+
+
+def test_penalize_pauses_grants():
+    limiter = make_limiter(rate=1000.0, burst=5)
+    limiter.penalize(0.1)
+    assert limiter.get_stats()['paused_for_seconds'] > 0
+    started = time.monotonic()
+    limiter.acquire('standard')
+    assert time.monotonic() - started >= 0.09
+    assert limiter.penalties == 1
+
+
+def test_sync_wait_limit_caps_the_shared_deadline():
+    background_budget = wait_deadline('background') - time.monotonic()
+    with sync_wait_limit(0.5):
+        capped = wait_deadline('background') - time.monotonic()
+        # The cap never extends a shorter budget
+        assert wait_deadline('interactive') - time.monotonic() <= 0.5
+    assert capped <= 0.5 < background_budget
+    assert wait_deadline('background') - time.monotonic() > 0.5
+
+
+def test_unknown_priority_is_rejected():
+    with pytest.raises(ValueError):
+        make_limiter().acquire('urgent')
@@ -0,0 +1,98 @@
+import threading
+import time
+
+import pytest
+
+from single_flight import SingleFlight
+
+
+def run_concurrently(flight, key, fn, callers):
+    """Start `callers` threads on flight.do(key, fn); returns their (result, shared) or exception."""
+    outcomes = [None] * callers
+    started = threading.Barrier(callers)
+
+    def call(i):
+        started.wait()
+        try:
+            outcomes[i] = flight.do(key, fn)
+        except Exception as e:
+            outcomes[i] = e
+
+    threads = [threading.Thread(target=call, args=(i,)) for i in range(callers)]
+    for thread in threads:
+        thread.start()
+    return threads, outcomes
+
+
+def wait_until(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.001)
+
+
+def test_concurrent_callers_share_one_call():
+    flight = SingleFlight()
+    release = threading.Event()
+    calls = []
+
+    def slow():
+        calls.append(1)
+        assert release.wait(5)
+        return "answer"
+
+    threads, outcomes = run_concurrently(flight, 'k', slow, 4)
+    # Every follower has joined the leader's flight before it finishes
+    wait_until(lambda: flight.get_stats()['coalesced'] == 3)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert len(calls) == 1
+    assert sorted(outcomes, key=lambda o: o[1]) == [("answer", False)] + [("answer", True)] * 3
+    stats = flight.get_stats()
+    assert (stats['leaders'], stats['coalesced'], stats['max_waiters'], stats['in_flight']) == (1, 3, 3, 0)
+    assert stats['dedup_rate'] == 0.75
+
+
+def test_errors_are_shared_with_waiters():
+    flight = SingleFlight()
+    release = threading.Event()
+
+    def failing():
+        assert release.wait(5)
+        raise RuntimeError("upstream down")
+
+    threads, outcomes = run_concurrently(flight, 'k', failing, 3)
+    wait_until(lambda: flight.get_stats()['coalesced'] == 2)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert all(isinstance(o, RuntimeError) and str(o) == "upstream down" for o in outcomes)
+    assert flight.get_stats()['shared_errors'] == 2
+
+
+def test_sequential_calls_are_not_coalesced():
+    flight = SingleFlight()
+    assert flight.do('k', lambda: 1) == (1, False)
+    assert flight.do('k', lambda: 2) == (2, False)
+    assert flight.get_stats()['coalesced'] == 0
+
+
+def test_different_keys_run_independently():
+    flight = SingleFlight()
+    first, leader_a = flight.begin('a')
+    second, leader_b = flight.begin('b')
+    assert leader_a and leader_b and first is not second
+    flight.finish('a', result='A')
+    flight.finish('b', error=ValueError('B'))
+    assert first.result() == 'A'
+    with pytest.raises(ValueError):
+        second.result()
+
+
+def test_finish_for_an_unknown_key_is_a_no_op():
+    flight = SingleFlight()
+    flight.finish('missing', result='ignored')
+    assert flight.get_stats()['in_flight'] == 0
@@ -0,0 +1,145 @@
+import re
+import threading
+
+from sqlalchemy import text
+
+from models import db
+
+# SQLite FTS5 full-text indexes over topics, notes and chat history. Each index is an
+# external-content FTS5 table (no second copy of the text) kept in sync by triggers on the base
+# table, so every ORM insert/update/delete is indexed without application code. Searches are
+# BM25-ranked and return None when FTS5 is unavailable (non-SQLite database, or an SQLite build
+# without FTS5) so callers can fall back to their old ILIKE queries.
+
+# name -> (base table, rowid column, indexed columns, BM25 column weights)
+FTS_INDEXES = {
+    'topics_fts': ('topics', 'topic_id', ('title', 'description'), (3.0, 1.0)),
+    'notes_fts': ('notes', 'note_id', ('title', 'content'), (3.0, 1.0)),
+    'chat_messages_fts': ('chat_messages', 'message_id', ('content',), (1.0,)),
+}
+
+STOP_WORDS = frozenset("""
+a an and are as at be but by can do does for from has have how i in is it its me my of on or
+please so tell than that the their them then there these this to was what when where which who
+why will with you your
+""".split())
+
+_state_lock = threading.Lock()
+_available = None
+_stats = {'queries': 0, 'fallbacks': 0, 'errors': 0}
+
+
+def _ddl(name, table, rowid, columns):
+    cols = ', '.join(columns)
+    new_cols = ', '.join(f'new.{c}' for c in columns)
+    old_cols = ', '.join(f'old.{c}' for c in columns)
+    return [
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {name} USING fts5({cols}, content='{table}', "
+        f"content_rowid='{rowid}', tokenize='porter unicode61')",
+        f"CREATE TRIGGER IF NOT EXISTS {name}_ai AFTER INSERT ON {table} BEGIN "
+        f"INSERT INTO {name}(rowid, {cols}) VALUES (new.{rowid}, {new_cols}); END",
+        f"CREATE TRIGGER IF NOT EXISTS {name}_ad AFTER DELETE ON {table} BEGIN "
+        f"INSERT INTO {name}({name}, rowid, {cols}) VALUES ('delete', old.{rowid}, {old_cols}); END",
+        f"CREATE TRIGGER IF NOT EXISTS {name}_au AFTER UPDATE ON {table} BEGIN "
+        f"INSERT INTO {name}({name}, rowid, {cols}) VALUES ('delete', old.{rowid}, {old_cols}); "
+        f"INSERT INTO {name}(rowid, {cols}) VALUES (new.{rowid}, {new_cols}); END",
+    ]
+
+
+def ensure_fts(backfill=False):
+    """
+    Create missing FTS tables and triggers (idempotent). Newly created indexes are backfilled
+    from their base table; backfill=True rebuilds every index. Must run in an app context.
+    """
+    global _available
+    if db.engine.dialect.name != 'sqlite':
+        _available = False
+        return False
+    try:
+        with db.engine.begin() as conn:
+            existing = {row[0] for row in conn.execute(text("SELECT name FROM sqlite_master WHERE type = 'table'"))}
+            for name, (table, rowid, columns, _) in FTS_INDEXES.items():
+                created = name not in existing
+                for statement in _ddl(name, table, rowid, columns):
+                    conn.execute(text(statement))
+                if created or backfill:
+                    conn.execute(text(f"INSERT INTO {name}({name}) VALUES ('rebuild')"))
+                    print(f"ℹ️ Text Search: Indexed existing rows of {table} into {name}.")
+        _available = True
+    except Exception as e:
+        print(f"⚠️ Text Search: FTS5 unavailable, keyword search falls back to ILIKE. Error: {e}")
+        _available = False
+    return _available
+
+
+def fts_query(query_text):
+    """Free text -> FTS5 MATCH expression: quoted terms OR-ed together (BM25 rewards matching more)."""
+    terms = []
+    for word in re.findall(r"\w+", query_text.lower()):
+        if len(word) > 2 and word not in STOP_WORDS and word not in terms:
+            terms.append(word)
+    return ' OR '.join(f'"{term}"' for term in terms[:16])
+
+
+def _search(name, query_text, filters, params, limit, snippet_column=None):
+    if not _available:
+        with _state_lock:
+            _stats['fallbacks'] += 1
+        return None
+    match = fts_query(query_text)
+    if not match:
+        return []
+    table, rowid, columns, weights = FTS_INDEXES[name]
+    snippet = ''
+    if snippet_column is not None:
+        snippet = f", snippet({name}, {snippet_column}, '[', ']', '…', 12)"
+    where = ''.join(f" AND {clause}" for clause in filters)
+    sql = (
+        f"SELECT {name}.rowid, bm25({name}, {', '.join(str(w) for w in weights)}) AS rank{snippet} "
+        f"FROM {name} JOIN {table} ON {table}.{rowid} = {name}.rowid "
+        f"WHERE {name} MATCH :match{where} ORDER BY rank LIMIT :limit"
+    )
+    try:
+        rows = db.session.execute(text(sql), dict(params, match=match, limit=limit)).fetchall()
+    except Exception as e:
+        with _state_lock:
+            _stats['errors'] += 1
+        print(f"⚠️ Text Search: Query on {name} failed: {e}")
+        return None
+    with _state_lock:
+        _stats['queries'] += 1
+    # bm25() is lower-is-better; flip it so callers can sort by score descending
+    if snippet_column is not None:
+        return [(row[0], -row[1], row[2]) for row in rows]
+    return [(row[0], -row[1]) for row in rows]
+
+
+def search_topics(query_text, course_ids, student_id=None, limit=10):
+    """[(topic_id, score)] within the courses; other students' personalized topics are excluded."""
+    if not course_ids:
+        return []
+    ids = {f'c{i}': course_id for i, course_id in enumerate(course_ids)}
+    filters = [
+        f"topics.course_id IN ({', '.join(':' + key for key in ids)})",
+        "(topics.student_id IS NULL OR topics.student_id = :student_id)",
+    ]
+    return _search('topics_fts', query_text, filters, dict(ids, student_id=student_id), limit)
+
+
+def search_notes(student_id, query_text, limit=10):
+    """[(note_id, score, snippet)] over one student's notes."""
+    return _search('notes_fts', query_text, ["notes.student_id = :student_id"],
+                   {'student_id': student_id}, limit, snippet_column=1)
+
+
+def search_chat_messages(student_id, query_text, limit=10):
+    """[(message_id, score, snippet)] over one student's chat history."""
+    return _search('chat_messages_fts', query_text, ["chat_messages.student_id = :student_id"],
+                   {'student_id': student_id}, limit, snippet_column=0)
+
+
+def get_search_stats():
+    with _state_lock:
+        stats = dict(_stats)
+    stats['fts5'] = bool(_available)
+    return stats
@@ -0,0 +1,208 @@
+import os
+import math
+import time
+import threading
+
+import numpy as np
+
+# In-process vector index over course topics for chat RAG. One partition per course holds an
+# L2-normalized embedding matrix plus parallel topic-id / owner arrays, loaded lazily from the
+# topics table and appended to as topics are created, so a lookup is one matrix-vector product
+# per enrolled course instead of an ILIKE scan of the whole table. Large partitions can switch
+# to an IVF layout (k-means lists, only the nearest few probed).
+TOPIC_INDEX_MIN_SCORE = float(os.getenv('TOPIC_INDEX_MIN_SCORE', 0.3))
+# Partitions are reloaded from the database after this long (topics added by other processes)
+TOPIC_INDEX_TTL_SECONDS = float(os.getenv('TOPIC_INDEX_TTL_SECONDS', 600))
+# 0 disables IVF; otherwise partitions with at least this many topics are clustered
+TOPIC_INDEX_IVF_MIN_TOPICS = int(os.getenv('TOPIC_INDEX_IVF_MIN_TOPICS', 0))
+TOPIC_INDEX_IVF_NPROBE = int(os.getenv('TOPIC_INDEX_IVF_NPROBE', 4))
+TOPIC_INDEX_IVF_ITERATIONS = 8
+
+
+def topic_text(topic):
+    """What gets embedded for a topic: its title plus the start of its description."""
+    if topic.description:
+        return f"{topic.title}. {topic.description[:300]}"
+    return topic.title
+
+
+class _Partition:
+    def __init__(self, ids, owners, matrix):
+        self.ids = np.asarray(ids, dtype=np.int64)
+        self.owners = list(owners)  # student_id for personalized topics, None for shared ones
+        self.matrix = matrix
+        self.loaded_at = time.monotonic()
+        self.centroids = None  # IVF only: [nlist, dim]
+        self.lists = None  # IVF only: row indices per centroid
+        self.built_size = 0
+
+    def append(self, ids, owners, matrix):
+        start = len(self.ids)
+        self.ids = np.concatenate([self.ids, np.asarray(ids, dtype=np.int64)])
+        self.owners.extend(owners)
+        self.matrix = np.vstack([self.matrix, matrix]) if len(self.matrix) else matrix
+        if self.centroids is not None:
+            nearest = np.argmax(matrix @ self.centroids.T, axis=1)
+            for offset, c in enumerate(nearest):
+                self.lists[c] = np.append(self.lists[c], start + offset)
+
+    def build_ivf(self):
+        n = len(self.ids)
+        nlist = max(int(math.sqrt(n)), 1)
+        rng = np.random.default_rng(0)
+        centroids = self.matrix[rng.choice(n, nlist, replace=False)].copy()
+        for _ in range(TOPIC_INDEX_IVF_ITERATIONS):
+            assign = np.argmax(self.matrix @ centroids.T, axis=1)
+            for c in range(nlist):
+                members = self.matrix[assign == c]
+                if len(members):
+                    mean = members.mean(axis=0)
+                    centroids[c] = mean / max(np.linalg.norm(mean), 1e-9)
+        assign = np.argmax(self.matrix @ centroids.T, axis=1)
+        self.centroids = centroids
+        self.lists = [np.where(assign == c)[0] for c in range(nlist)]
+        self.built_size = n
+
+    def candidate_rows(self, query):
+        if self.centroids is None:
+            return None
+        probe = np.argsort(-(self.centroids @ query))[:TOPIC_INDEX_IVF_NPROBE]
+        return np.concatenate([self.lists[c] for c in probe])
+
+
+class TopicIndex:
+    def __init__(self, ttl_seconds=TOPIC_INDEX_TTL_SECONDS, ivf_min_topics=TOPIC_INDEX_IVF_MIN_TOPICS):
+        self.ttl_seconds = ttl_seconds
+        self.ivf_min_topics = ivf_min_topics
+        self._partitions = {}  # course_id -> _Partition
+        self._lock = threading.Lock()
+        self.stats = {'queries': 0, 'loads': 0, 'appended': 0, 'ivf_builds': 0, 'unavailable': 0,
+                      'total_query_ms': 0.0}
+
+    def _embed(self, texts):
+        from embedding_service import embedding_service
+        return embedding_service.encode(texts)
+
+    def _maybe_build_ivf(self, partition):
+        # Caller holds self._lock
+        if self.ivf_min_topics and len(partition.ids) >= self.ivf_min_topics \
+                and len(partition.ids) >= 2 * partition.built_size:
+            partition.build_ivf()
+            self.stats['ivf_builds'] += 1
+
+    def _load(self, course_id):
+        from models import Topic
+        topics = Topic.query.filter_by(course_id=course_id).all()
+        if topics:
+            matrix = self._embed([topic_text(t) for t in topics])
+            if matrix is None:
+                return None
+        else:
+            matrix = np.zeros((0, 0), dtype=np.float32)
+        partition = _Partition([t.topic_id for t in topics], [t.student_id for t in topics], matrix)
+        with self._lock:
+            self._maybe_build_ivf(partition)
+            self._partitions[course_id] = partition
+            self.stats['loads'] += 1
+        return partition
+
+    def _get_partition(self, course_id):
+        with self._lock:
+            partition = self._partitions.get(course_id)
+        if partition is None or time.monotonic() - partition.loaded_at > self.ttl_seconds:
+            partition = self._load(course_id)
+        return partition
+
+    def add_topics(self, topics):
+        """
+        Append freshly committed topics to their course partitions. Courses that are not loaded
+        yet are skipped; they pick the new rows up from the database on first use.
+        """
+        by_course = {}
+        with self._lock:
+            for topic in topics:
+                if topic.course_id in self._partitions:
+                    by_course.setdefault(topic.course_id, []).append(topic)
+        for course_id, course_topics in by_course.items():
+            try:
+                matrix = self._embed([topic_text(t) for t in course_topics])
+            except Exception as e:
+                print(f"⚠️ Topic Index: Embedding new topics failed: {e}")
+                matrix = None
+            with self._lock:
+                partition = self._partitions.get(course_id)
+                if partition is None:
+                    continue
+                if matrix is None:
+                    # Cannot append, so force a reload on next use instead of serving a stale partition
+                    del self._partitions[course_id]
+                    continue
+                known = set(partition.ids.tolist())
+                fresh = [i for i, t in enumerate(course_topics) if t.topic_id not in known]
+                if fresh:
+                    partition.append([course_topics[i].topic_id for i in fresh],
+                                     [course_topics[i].student_id for i in fresh], matrix[fresh])
+                    self.stats['appended'] += len(fresh)
+                    self._maybe_build_ivf(partition)
+
+    def invalidate(self, course_id=None):
+        with self._lock:
+            if course_id is None:
+                self._partitions.clear()
+            else:
+                self._partitions.pop(course_id, None)
+
+    def search(self, course_ids, query_text, student_id=None, k=3, min_score=TOPIC_INDEX_MIN_SCORE):
+        """
+        Top-k (topic_id, score) over the given courses, skipping other students' personalized
+        topics. Returns None when the embedder is unavailable so callers can fall back.
+        """
+        started = time.monotonic()
+        query = self._embed([query_text])
+        if query is None:
+            with self._lock:
+                self.stats['unavailable'] += 1
+            return None
+        query = query[0]
+
+        hits = []
+        for course_id in course_ids:
+            partition = self._get_partition(course_id)
+            if partition is None:
+                with self._lock:
+                    self.stats['unavailable'] += 1
+                return None
+            if not len(partition.ids):
+                continue
+            rows = partition.candidate_rows(query)
+            if rows is None:
+                scores = partition.matrix @ query
+                rows = np.arange(len(scores))
+            else:
+                scores = partition.matrix[rows] @ query
+            for i in np.argsort(-scores)[:k * 4]:
+                if scores[i] < min_score:
+                    break
+                owner = partition.owners[rows[i]]
+                if owner is None or owner == student_id:
+                    hits.append((int(partition.ids[rows[i]]), float(scores[i])))
+
+        hits.sort(key=lambda hit: hit[1], reverse=True)
+        with self._lock:
+            self.stats['queries'] += 1
+            self.stats['total_query_ms'] += (time.monotonic() - started) * 1000
+        return hits[:k]
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self.stats)
+            stats['partitions'] = len(self._partitions)
+            stats['topics'] = sum(len(p.ids) for p in self._partitions.values())
+            stats['ivf_partitions'] = sum(1 for p in self._partitions.values() if p.centroids is not None)
+        total_ms = stats.pop('total_query_ms')
+        stats['avg_query_ms'] = round(total_ms / stats['queries'], 2) if stats['queries'] else 0.0
+        stats['ivf_min_topics'] = self.ivf_min_topics
+        return stats
+
+
+topic_index = TopicIndex()
@@ -1,118 +1,228 @@
 import os
+import re
+import time
 import requests
 import json
-import torch
-import torch.nn.functional as F
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+import numpy as np
+import http_client
+from embedding_service import embedding_service
+from llm_cache import LLMCache
 
 YOUTUBE_API_KEY = os.getenv('YOUTUBE_API_KEY')
 YOUTUBE_SEARCH_URL = "https://www.googleapis.com/youtube/v3/search"
 
-# Shared MiniLM loading from chat_routes logic
-MINILM_PATH = r"C:\Users\Yashas H D\Desktop\PYTHON\dbms\companion\models\all-MiniLM-L6-v2"
-_tokenizer = None
-_model = None
-_device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+# Search results are cached per normalized query (the same topic titles come up for every
+# student), and a quota 403 stops all API calls until the daily quota resets at midnight
+# Pacific time instead of retrying on the very next request. The block lives in its own
+# one-row table next to the cache (not in the evictable cache itself) so every worker process
+# honours it; each process re-reads it at most every YOUTUBE_BLOCK_RECHECK_SECONDS.
+YOUTUBE_CACHE_ENABLED = os.getenv('YOUTUBE_CACHE_ENABLED', 'true').lower() == 'true'
+YOUTUBE_CACHE_PATH = os.getenv('YOUTUBE_CACHE_PATH', 'cache/youtube_cache.db')
+YOUTUBE_CACHE_TTL_SECONDS = int(os.getenv('YOUTUBE_CACHE_TTL_SECONDS', 7 * 24 * 3600))
+YOUTUBE_EMPTY_TTL_SECONDS = int(os.getenv('YOUTUBE_EMPTY_TTL_SECONDS', 24 * 3600))
+# Non-quota 403s (bad key, API disabled) back off for this long
+YOUTUBE_FORBIDDEN_BACKOFF_SECONDS = int(os.getenv('YOUTUBE_FORBIDDEN_BACKOFF_SECONDS', 600))
+# Added to a video's similarity for the topic whose own search returned it
+VIDEO_OWN_SEARCH_BONUS = float(os.getenv('VIDEO_OWN_SEARCH_BONUS', 0.05))
+# Concurrent searches per get_videos_for_topics call
+YOUTUBE_SEARCH_WORKERS = int(os.getenv('YOUTUBE_SEARCH_WORKERS', 4))
+YOUTUBE_BLOCK_RECHECK_SECONDS = float(os.getenv('YOUTUBE_BLOCK_RECHECK_SECONDS', 30))
+YOUTUBE_SEARCH_QUOTA_UNITS = 100  # cost of one search.list call
+QUOTA_REASONS = ('quotaExceeded', 'dailyLimitExceeded')
 
-def get_embedder():
-    global _tokenizer, _model
-    if _model is None:
+_search_cache = LLMCache(path=YOUTUBE_CACHE_PATH, ttl_seconds=YOUTUBE_CACHE_TTL_SECONDS,
+                         enabled=YOUTUBE_CACHE_ENABLED, label='YouTube Cache')
+_stats_lock = threading.Lock()
+_stats = {'hits': 0, 'misses': 0, 'api_calls': 0, 'api_errors': 0, 'quota_exceeded': 0,
+          'blocked_calls': 0, 'quota_units_used': 0}
+_blocked_until = 0.0  # local copy of the shared block
+_block_checked_at = 0.0  # monotonic time the shared block was last read
+
+
+def _count(name, amount=1):
+    with _stats_lock:
+        _stats[name] += amount
+
+
+def _next_quota_reset(now=None):
+    """Epoch seconds of the next midnight in America/Los_Angeles (YouTube's quota day)."""
+    try:
+        from zoneinfo import ZoneInfo
+        pacific = ZoneInfo('America/Los_Angeles')
+    except Exception:
+        pacific = timezone(timedelta(hours=-8))  # no tzdata: PST, at worst an hour late in summer
+    local_now = datetime.fromtimestamp(now or time.time(), pacific)
+    midnight = (local_now + timedelta(days=1)).replace(hour=0, minute=0, second=0, microsecond=0)
+    return midnight.timestamp()
+
+
+def _block_store():
+    """Connection to the shared block table (created on first use)."""
+    directory = os.path.dirname(YOUTUBE_CACHE_PATH)
+    if directory and not os.path.exists(directory):
+        os.makedirs(directory, exist_ok=True)
+    conn = sqlite3.connect(YOUTUBE_CACHE_PATH, timeout=5)
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS youtube_quota_block ("
+        "id INTEGER PRIMARY KEY CHECK (id = 1), blocked_until REAL NOT NULL, reason TEXT)"
+    )
+    return conn
+
+
+def _read_shared_block():
+    try:
+        conn = _block_store()
         try:
-            from transformers import AutoTokenizer, AutoModel
-            _tokenizer = AutoTokenizer.from_pretrained(MINILM_PATH)
-            _model = AutoModel.from_pretrained(MINILM_PATH)
-            _model.to(_device)
-            _model.eval()
-        except: pass
-    return _tokenizer, _model
+            row = conn.execute("SELECT blocked_until FROM youtube_quota_block WHERE id = 1").fetchone()
+        finally:
+            conn.close()
+        return row[0] if row else 0.0
+    except sqlite3.Error as e:
+        print(f"⚠️ YouTube API: could not read the shared quota block: {e}")
+        return 0.0
+
+
+def _blocked_for():
+    """Seconds left on a quota/forbidden block (0 when the API may be called)."""
+    global _blocked_until, _block_checked_at
+    now = time.time()
+    if _blocked_until > now:
+        return _blocked_until - now
+    # Another process may have hit the quota; poll the shared row rather than read it per search
+    checked = time.monotonic()
+    if checked - _block_checked_at >= YOUTUBE_BLOCK_RECHECK_SECONDS:
+        _block_checked_at = checked
+        _blocked_until = max(_blocked_until, _read_shared_block())
+    return max(_blocked_until - now, 0)
+
+
+def _block(until, reason):
+    global _blocked_until
+    _blocked_until = max(_blocked_until, until)
+    try:
+        conn = _block_store()
+        try:
+            with conn:
+                conn.execute(
+                    "INSERT INTO youtube_quota_block (id, blocked_until, reason) VALUES (1, ?, ?) "
+                    "ON CONFLICT(id) DO UPDATE SET blocked_until = MAX(blocked_until, excluded.blocked_until), "
+                    "reason = excluded.reason",
+                    (until, reason)
+                )
+        finally:
+            conn.close()
+    except sqlite3.Error as e:
+        print(f"⚠️ YouTube API: could not share the quota block: {e}")
+    print(f"⚠️ YouTube API: {reason}; skipping searches for {(_blocked_until - time.time()) / 60:.0f} min.")
+
+
+def _error_reason(response):
+    try:
+        return response.json()['error']['errors'][0]['reason']
+    except Exception:
+        return None
+
+
+def _search_key(search_query, max_results):
+    normalized = re.sub(r'\s+', ' ', search_query.lower()).strip()
+    return f"youtube:{max_results}:{normalized}"
+
+
+def get_youtube_stats():
+    with _stats_lock:
+        stats = dict(_stats)
+    lookups = stats['hits'] + stats['misses']
+    stats['hit_rate'] = round(stats['hits'] / lookups, 3) if lookups else 0.0
+    blocked = _blocked_for()
+    stats['blocked_for_seconds'] = round(blocked) if blocked else 0
+    stats['cache'] = _search_cache.get_stats()
+    return stats
+
+def warmup_embedder():
+    """Load MiniLM and run one forward pass so the first ranking request is not the slow one."""
+    embedding_service.warmup()
 
 def get_similarity_scores(target_text, candidate_list):
-    tok, mod = get_embedder()
-    if not mod: return [0] * len(candidate_list)
-    
-    inputs = tok([target_text] + candidate_list, padding=True, truncation=True, return_tensors="pt", max_length=128).to(_device)
-    with torch.no_grad():
-        out = mod(**inputs)
-    embs = out.last_hidden_state.mean(dim=1)
-    
-    target_emb = embs[0:1]
-    cand_embs = embs[1:]
-    
-    sims = F.cosine_similarity(target_emb, cand_embs)
-    return sims.cpu().tolist()
+    return embedding_service.similarity(target_text, candidate_list)
 
 def search_youtube_video(query, topic_title="", max_results=5):
     """
     Search YouTube and rank results using a Hybrid approach:
     Relevance (YouTube) + Semantic Similarity (MiniLM)
     """
-    # Prioritize YOUTUBE_API_KEY from .env
-    api_key = os.getenv('YOUTUBE_API_KEY') or YOUTUBE_API_KEY or os.getenv('GOOGLE_API_KEY')
-    
-    if not api_key:
-        print("CRITICAL: No YouTube API Key found in environment.")
-        return [{'youtube_id': None, 'title': f'{topic_title} Search', 'url': f'https://www.youtube.com/results?search_query={topic_title}'}]
+    candidates, fallback = _search_candidates(query, topic_title, max_results)
+    if fallback is not None:
+        return fallback
+    if not candidates: return []
 
     try:
-        # Relaxed academic context to ensure results
-        search_query = f"{query} full lecture tutorial"
-        
-        params = {
-            'part': 'snippet',
-            'q': search_query,
-            'type': 'video',
-            'key': api_key,
-            'maxResults': max_results,
-            'relevanceLanguage': 'en',
-            # 'videoDuration': 'long' # Removed strict long duration enabling more hits (medium/long)
-        }
-        resp = requests.get(YOUTUBE_SEARCH_URL, params=params)
-        resp.raise_for_status()
-        data = resp.json()
-        
-        candidates = []
-        titles = []
-        for item in data.get('items', []):
-            vid = {
-                'youtube_id': item['id']['videoId'],
-                'title': item['snippet']['title'],
-                'description': item['snippet']['description'],
-                'thumbnail': item['snippet']['thumbnails']['high']['url'],
-                'url': f"https://www.youtube.com/watch?v={item['id']['videoId']}"
-            }
-            candidates.append(vid)
-            titles.append(vid['title'])
-            
-        if not candidates: return []
-
         # 2. Hybrid Ranking: Boost based on Semantic Similarity to topic_title
         if topic_title:
-            sim_scores = get_similarity_scores(topic_title, titles)
+            topic_embs, video_embs = _embed_topics_and_videos([topic_title], candidates)
+            sim_scores = (video_embs @ topic_embs[0]).tolist() if topic_embs is not None else [0] * len(candidates)
             for i, score in enumerate(sim_scores):
                 candidates[i]['rank_score'] = score
 
             # Sort by semantic similarity
             candidates.sort(key=lambda x: x.get('rank_score', 0), reverse=True)
+    except Exception as e:
+        print(f"Hybrid YouTube Ranking Error: {e}")
 
-        return candidates
+    return candidates
+
+def _search_candidates(query, topic_title, max_results):
+    """
+    Unranked search results (cached per normalized query) as (candidates, None), or
+    (None, fallback_results) when the API cannot be used.
+    """
+    # Prioritize YOUTUBE_API_KEY from .env
+    api_key = os.getenv('YOUTUBE_API_KEY') or YOUTUBE_API_KEY or os.getenv('GOOGLE_API_KEY')
+    
+    if not api_key:
+        print("CRITICAL: No YouTube API Key found in environment.")
+        return None, [{'youtube_id': None, 'title': f'{topic_title} Search', 'url': f'https://www.youtube.com/results?search_query={topic_title}'}]
+
+    # Relaxed academic context to ensure results
+    search_query = f"{query} full lecture tutorial"
+    
+    if _blocked_for():
+        _count('blocked_calls')
+        return None, [_manual_search_result(topic_title, search_query)]
+
+    try:
+        cache_key = _search_key(search_query, max_results)
+        cached = _search_cache.get(cache_key)
+        if cached is not None:
+            _count('hits')
+            return json.loads(cached), None
+        _count('misses')
+        candidates = _fetch_search_results(search_query, api_key, max_results)
+        _search_cache.set(cache_key, json.dumps(candidates),
+                          ttl_seconds=YOUTUBE_CACHE_TTL_SECONDS if candidates else YOUTUBE_EMPTY_TTL_SECONDS)
+        return candidates, None
         
     except requests.exceptions.HTTPError as e:
-        if e.response.status_code == 403:
+        _count('api_errors')
+        if e.response is not None and e.response.status_code == 403:
+            reason = _error_reason(e.response)
+            if reason in QUOTA_REASONS:
+                _count('quota_exceeded')
+                _block(_next_quota_reset(), f"Quota exhausted ({reason})")
+            else:
+                _block(time.time() + YOUTUBE_FORBIDDEN_BACKOFF_SECONDS, f"Forbidden (403, {reason or 'no reason'})")
             print(f"YouTube Quota Exceeded/Forbidden (403). Using Fallback.")
         else:
             print(f"YouTube API Error: {e}")
         
         # Fallback to generic URL
-        return [{
-            'youtube_id': None, 
-            'title': f'{topic_title} (Click to Search YouTube)', 
-            'description': 'Direct video feed unavailable due to API limits. Click to search manually.',
-            'url': f'https://www.youtube.com/results?search_query={requests.utils.quote(search_query)}',
-            'thumbnail': '',
-            'rank_score': 0
-        }]
+        return None, [_manual_search_result(topic_title, search_query)]
     except Exception as e:
         print(f"Hybrid YouTube Search Error: {e}")
-        return [{
+        return None, [{
             'youtube_id': None, 
             'title': f'{topic_title} (Manual Search)', 
             'description': 'Search failed. Click to find manually.',
@@ -121,15 +231,158 @@ def search_youtube_video(query, topic_title="", max_results=5):
             'rank_score': 0
         }]
 
+def _manual_search_result(topic_title, search_query):
+    return {
+        'youtube_id': None, 
+        'title': f'{topic_title} (Click to Search YouTube)', 
+        'description': 'Direct video feed unavailable due to API limits. Click to search manually.',
+        'url': f'https://www.youtube.com/results?search_query={requests.utils.quote(search_query)}',
+        'thumbnail': '',
+        'rank_score': 0
+    }
+
+def _fetch_search_results(search_query, api_key, max_results):
+    """One search.list call (100 quota units). Returns the unranked candidate videos."""
+    params = {
+        'part': 'snippet',
+        'q': search_query,
+        'type': 'video',
+        'key': api_key,
+        'maxResults': max_results,
+        'relevanceLanguage': 'en',
+        # 'videoDuration': 'long' # Removed strict long duration enabling more hits (medium/long)
+    }
+    _count('api_calls')
+    _count('quota_units_used', YOUTUBE_SEARCH_QUOTA_UNITS)
+    resp = http_client.get(YOUTUBE_SEARCH_URL, params=params)
+    resp.raise_for_status()
+    data = resp.json()
+    
+    candidates = []
+    for item in data.get('items', []):
+        candidates.append({
+            'youtube_id': item['id']['videoId'],
+            'title': item['snippet']['title'],
+            'description': item['snippet']['description'],
+            'thumbnail': item['snippet']['thumbnails']['high']['url'],
+            'url': f"https://www.youtube.com/watch?v={item['id']['videoId']}"
+        })
+    return candidates
+
 def get_video_for_topic(topic_title, course_context=""):
     """
     Get the single best semantically relevant video for a topic.
     """
-    # Explicitly request full coverage of the topic
-    query = f"{topic_title} {course_context} full detailed explanation"
-    videos = search_youtube_video(query, topic_title=topic_title, max_results=5)
+    videos = search_youtube_video(_topic_query(topic_title, course_context), topic_title=topic_title, max_results=5)
     return videos[0] if videos else None
 
+def _topic_query(topic_title, course_context):
+    # Explicitly request full coverage of the topic
+    return f"{topic_title} {course_context} full detailed explanation"
+
+def _embed_topics_and_videos(topic_titles, videos):
+    """
+    Embeddings of the topic titles and the candidate videos in one pass, or (None, None).
+    Video vectors are cached by video id, so a video seen in any earlier search is never re-embedded.
+    """
+    texts = list(topic_titles) + [vid['title'] for vid in videos]
+    cache_ids = [None] * len(topic_titles) + [f"youtube:{vid['youtube_id']}" for vid in videos]
+    try:
+        embs = embedding_service.encode(texts, cache_ids=cache_ids)
+    except Exception as e:
+        print(f"Hybrid YouTube Ranking Error: {e}")
+        embs = None
+    if embs is None:
+        return None, None
+    return embs[:len(topic_titles)], embs[len(topic_titles):]
+
+def _assign_greedy(scores):
+    """
+    Global one-to-one assignment over a [topics, videos] score matrix: repeatedly take the best
+    remaining (topic, video) pair. Entries of -inf are never assigned; returns a video index or -1 per topic.
+    """
+    n_topics, n_videos = scores.shape
+    assigned = [-1] * n_topics
+    used = np.zeros(n_videos, dtype=bool)
+    remaining = n_topics
+    for flat in np.argsort(-scores, axis=None):
+        t, v = divmod(int(flat), n_videos)
+        if scores[t, v] == -np.inf:
+            break
+        if assigned[t] >= 0 or used[v]:
+            continue
+        assigned[t] = v
+        used[v] = True
+        remaining -= 1
+        if not remaining:
+            break
+    return assigned
+
+def get_videos_for_topics(topic_titles, course_context="", max_results=5, exclude_video_ids=()):
+    """
+    Best video per topic title (or None), in input order, with no video used for two topics.
+    Duplicate titles are searched once and searches run concurrently on a bounded pool. The
+    results form one course-wide candidate pool, scored against every topic in a single
+    vectorized pass and assigned greedily; a topic the pool runs out for gets None.
+    exclude_video_ids are videos other topics already use and are never assigned.
+    """
+    unique = list(dict.fromkeys(topic_titles))
+    if not unique:
+        return []
+
+    workers = max(min(YOUTUBE_SEARCH_WORKERS, len(unique)), 1)
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='youtube-search') as pool:
+        searches = list(pool.map(
+            lambda title: _search_candidates(_topic_query(title, course_context), title, max_results), unique
+        ))
+
+    search_for = dict(zip(unique, searches))
+    results = [None] * len(topic_titles)
+    pool_index = {}  # youtube_id -> column in the pool
+    videos = []
+    own_rank = {}  # (assignment row, pool column) -> position in that topic's own search results
+    rows = []  # indexes into topic_titles of the topics that take part in the assignment
+    for i, title in enumerate(topic_titles):
+        candidates, fallback = search_for[title]
+        if fallback is not None:
+            # Search links without a video id, so repeating one is harmless
+            results[i] = fallback[0] if fallback else None
+            continue
+        if not candidates:
+            continue
+        # One row per topic, not per title: repeated titles share candidates but not a video
+        row = len(rows)
+        rows.append(i)
+        for rank, vid in enumerate(candidates):
+            column = pool_index.get(vid['youtube_id'])
+            if column is None:
+                column = pool_index[vid['youtube_id']] = len(videos)
+                videos.append(vid)
+            own_rank.setdefault((row, column), rank)
+
+    if rows:
+        own = np.full((len(rows), len(videos)), np.nan)
+        for (row, column), rank in own_rank.items():
+            own[row, column] = rank
+        topic_embs, video_embs = _embed_topics_and_videos([topic_titles[i] for i in rows], videos)
+        if topic_embs is not None:
+            # Semantic fit to each topic, nudged towards the topic's own search results
+            scores = topic_embs @ video_embs.T + np.where(np.isnan(own), 0.0, VIDEO_OWN_SEARCH_BONUS)
+        else:
+            # No embedder: keep YouTube's order within each topic's own results
+            scores = np.where(np.isnan(own), -np.inf, max_results - np.nan_to_num(own))
+        excluded = set(exclude_video_ids or ())
+        for column, vid in enumerate(videos):
+            if vid['youtube_id'] in excluded:
+                scores[:, column] = -np.inf
+
+        # A topic left over once the pool is exhausted stays None (the resolver retries it later)
+        for row, column in enumerate(_assign_greedy(scores)):
+            if column >= 0:
+                results[rows[row]] = dict(videos[column], rank_score=float(scores[row, column]))
+
+    return results
+
 def get_remedial_videos(topic_title, misconception, count=2):
     """
     Find remedial videos specifically targeting a misconception.
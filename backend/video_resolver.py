@@ -0,0 +1,154 @@
+import os
+import time
+import queue
+import threading
+
+from sqlalchemy import bindparam
+
+from models import db, Topic, Course
+
+# Background resolution of missing topic videos. Request handlers only enqueue topic ids; one
+# worker thread drains the queue in batches, resolves each course's titles with a single
+# get_videos_for_topics call (avoiding videos the course already uses) and writes all found
+# ids back in one executemany UPDATE, so no page load or form submit waits on YouTube.
+VIDEO_RESOLVER_BATCH_SIZE = int(os.getenv('VIDEO_RESOLVER_BATCH_SIZE', 20))
+VIDEO_RESOLVER_BATCH_WINDOW_SECONDS = float(os.getenv('VIDEO_RESOLVER_BATCH_WINDOW_SECONDS', 0.5))
+# A topic no video was found for (quota block, no results) is not re-queued before this
+VIDEO_RESOLVER_RETRY_SECONDS = float(os.getenv('VIDEO_RESOLVER_RETRY_SECONDS', 600))
+
+_app = None
+_queue = queue.Queue()
+_lock = threading.Lock()
+_pending = set()  # topic ids queued or being resolved
+_gave_up = {}  # topic_id -> monotonic time of the last unsuccessful attempt
+_started = False
+_stats = {'enqueued': 0, 'batches': 0, 'resolved': 0, 'unresolved': 0, 'errors': 0, 'total_batch_ms': 0.0}
+
+
+def enqueue_video_resolution(topic_ids):
+    """
+    Queue topics for background video lookup. Returns the subset that is now pending (queued or
+    in flight); topics that recently came back empty are left alone until the retry delay passes.
+    """
+    now = time.monotonic()
+    pending = set()
+    with _lock:
+        for topic_id in topic_ids:
+            if topic_id in _pending:
+                pending.add(topic_id)
+                continue
+            failed_at = _gave_up.get(topic_id)
+            if failed_at is not None and now - failed_at < VIDEO_RESOLVER_RETRY_SECONDS:
+                continue
+            _gave_up.pop(topic_id, None)
+            _pending.add(topic_id)
+            _queue.put(topic_id)
+            _stats['enqueued'] += 1
+            pending.add(topic_id)
+    return pending
+
+
+def _next_batch():
+    """Block for the first id, then gather more for a short window so a page of topics is one batch."""
+    batch = [_queue.get()]
+    deadline = time.monotonic() + VIDEO_RESOLVER_BATCH_WINDOW_SECONDS
+    while len(batch) < VIDEO_RESOLVER_BATCH_SIZE:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        try:
+            batch.append(_queue.get(timeout=remaining))
+        except queue.Empty:
+            break
+    return batch
+
+
+def _resolve(topic_ids):
+    from video_recommender import get_videos_for_topics
+
+    topics = Topic.query.filter(Topic.topic_id.in_(topic_ids), Topic.youtube_video_id.is_(None)).all()
+    by_course = {}  # course_id -> [(topic_id, title)]
+    for topic in topics:
+        by_course.setdefault(topic.course_id, []).append((topic.topic_id, topic.title))
+    course_titles = dict(
+        db.session.query(Course.course_id, Course.title).filter(Course.course_id.in_(list(by_course))).all()
+    ) if by_course else {}
+    # Videos other topics of the course already show, so the new assignments do not repeat them
+    used_videos = {}
+    if by_course:
+        rows = db.session.query(Topic.course_id, Topic.youtube_video_id).filter(
+            Topic.course_id.in_(list(by_course)), Topic.youtube_video_id.isnot(None)
+        ).all()
+        for course_id, video_id in rows:
+            used_videos.setdefault(course_id, set()).add(video_id)
+    db.session.rollback()  # end the read transaction before the slow external calls
+
+    updates = []
+    for course_id, course_topics in by_course.items():
+        videos = get_videos_for_topics([title for _, title in course_topics], course_titles.get(course_id, ""),
+                                       exclude_video_ids=used_videos.get(course_id, ()))
+        for (topic_id, _), video in zip(course_topics, videos):
+            if video and video.get('youtube_id'):
+                updates.append({'b_topic_id': topic_id, 'b_video_id': video['youtube_id']})
+
+    if updates:
+        table = Topic.__table__
+        with db.engine.begin() as conn:
+            # Only fill topics that are still empty (a user or another worker may have set one meanwhile)
+            conn.execute(
+                table.update()
+                .where(table.c.topic_id == bindparam('b_topic_id'), table.c.youtube_video_id.is_(None))
+                .values(youtube_video_id=bindparam('b_video_id')),
+                updates
+            )
+    return {u['b_topic_id'] for u in updates}
+
+
+def _worker():
+    while True:
+        batch = _next_batch()
+        started = time.monotonic()
+        resolved = set()
+        try:
+            with _app.app_context():
+                resolved = _resolve(batch)
+        except Exception as e:
+            print(f"⚠️ Video Resolver: Batch of {len(batch)} failed: {e}")
+            with _lock:
+                _stats['errors'] += 1
+        finally:
+            now = time.monotonic()
+            with _lock:
+                for topic_id in batch:
+                    _pending.discard(topic_id)
+                    if topic_id not in resolved:
+                        _gave_up[topic_id] = now
+                _stats['batches'] += 1
+                _stats['resolved'] += len(resolved)
+                _stats['unresolved'] += len(set(batch) - resolved)
+                _stats['total_batch_ms'] += (now - started) * 1000
+                for topic_id, failed_at in list(_gave_up.items()):
+                    if now - failed_at >= VIDEO_RESOLVER_RETRY_SECONDS:
+                        del _gave_up[topic_id]
+
+
+def start_video_resolver(app):
+    """Start the resolver thread once per process."""
+    global _app, _started
+    with _lock:
+        if _started:
+            return
+        _started = True
+        _app = app
+    threading.Thread(target=_worker, name='video-resolver', daemon=True).start()
+
+
+def get_video_resolver_stats():
+    with _lock:
+        stats = dict(_stats)
+        stats['pending'] = len(_pending)
+        stats['backing_off'] = len(_gave_up)
+    total_ms = stats.pop('total_batch_ms')
+    stats['avg_batch_ms'] = round(total_ms / stats['batches'], 1) if stats['batches'] else 0.0
+    stats['running'] = _started
+    return stats
@@ -0,0 +1,73 @@
+import os
+import time
+import threading
+
+# Opt-in background model warm-up. With MODEL_WARMUP=true the local LLM and the MiniLM
+# embedder are loaded (and run once) in a background thread at startup, and /api/ready
+# reports 503 until they are done so the load balancer only sends traffic to warm workers.
+MODEL_WARMUP = os.getenv('MODEL_WARMUP', 'false').lower() == 'true'
+MODEL_WARMUP_COMPONENTS = [c.strip() for c in os.getenv('MODEL_WARMUP_COMPONENTS', 'llm,embedder').split(',') if c.strip()]
+
+_state_lock = threading.Lock()
+_started = False
+_components = {}
+
+
+def _warm_llm():
+    from ml_service import llm_service
+    llm_service.warmup_local_model()
+
+
+def _warm_embedder():
+    from embedding_service import embedding_service
+    embedding_service.warmup()
+
+
+WARMUP_STEPS = {
+    'llm': _warm_llm,
+    'embedder': _warm_embedder,
+}
+
+
+def _set(name, **fields):
+    with _state_lock:
+        _components[name].update(fields)
+
+
+def _run():
+    for name in list(_components):
+        _set(name, status='loading')
+        started = time.monotonic()
+        try:
+            WARMUP_STEPS[name]()
+            _set(name, status='ready', seconds=round(time.monotonic() - started, 2))
+            print(f"✅ Warm-up: {name} ready in {time.monotonic() - started:.1f}s")
+        except Exception as e:
+            # A failed component is reported but does not block readiness forever:
+            # the lazy load path still works, just slowly
+            _set(name, status='failed', error=str(e)[:200], seconds=round(time.monotonic() - started, 2))
+            print(f"⚠️ Warm-up: {name} failed: {e}")
+
+
+def start_warmup():
+    """Start the warm-up thread once per process. No-op unless MODEL_WARMUP=true."""
+    global _started
+    with _state_lock:
+        if _started or not MODEL_WARMUP:
+            return
+        _started = True
+        for name in MODEL_WARMUP_COMPONENTS:
+            if name in WARMUP_STEPS:
+                _components[name] = {'status': 'pending'}
+            else:
+                print(f"⚠️ Warm-up: Unknown component '{name}' ignored.")
+    threading.Thread(target=_run, name='model-warmup', daemon=True).start()
+
+
+def get_readiness():
+    with _state_lock:
+        components = {name: dict(state) for name, state in _components.items()}
+    if not MODEL_WARMUP:
+        return {'ready': True, 'warmup': 'disabled', 'components': {}}
+    ready = all(state['status'] in ('ready', 'failed') for state in components.values())
+    return {'ready': ready, 'warmup': 'enabled', 'components': components}
@@ -151,6 +151,28 @@ const LearningPath = () => {
         }
     }, [currentTopic]);
 
+    // Videos still being looked up server-side: re-poll until they are resolved
+    useEffect(() => {
+        if (!activeCourse || !topics.some(t => t.video_status === 'pending')) return;
+        const timer = setTimeout(async () => {
+            try {
+                const res = await api.get(`/courses/learning-path/active?course_id=${activeCourse.course_id}`);
+                if (!res.ok) return;
+                const data = await res.json();
+                const fresh = new Map((data.topics || []).map(t => [t.topic_id, t]));
+                const merge = (t) => {
+                    const f = fresh.get(t.topic_id);
+                    return f ? { ...t, youtube_video_id: f.youtube_video_id, video_status: f.video_status } : t;
+                };
+                setTopics(prev => prev.map(merge));
+                setCurrentTopic(prev => (prev ? merge(prev) : prev));
+            } catch (err) {
+                console.error('Failed to refresh topic videos', err);
+            }
+        }, 3000);
+        return () => clearTimeout(timer);
+    }, [topics, activeCourse]);
+
     const fetchActiveCourse = async () => {
         try {
             // Check localStorage for user's selected course